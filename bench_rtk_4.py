@@ -0,0 +1,516 @@
+"""
+Замеры для rtk_4.py на синтетических данных.
+
+    python bench_rtk_4.py memory --rows 100000
+    python bench_rtk_4.py startup --rows 200000
+    python bench_rtk_4.py imports
+    python bench_rtk_4.py fleet --rows 1m --faulty 0.2 fleet.csv
+    python bench_rtk_4.py run --sizes 10k,100k,1m --output bench.json --baseline bench_baseline.json
+
+run гоняет каждую операцию в отдельном процессе (чистый пик памяти) и пишет JSON:
+время, пик RSS и записей в секунду. С --baseline сравнивает с прежним JSON
+и завершается с кодом 1, если операция стала медленнее больше чем на --tolerance.
+"""
+import argparse
+import gc
+import itertools
+import platform
+import resource
+import json
+import os
+import tempfile
+import threading
+import time
+import random
+import subprocess
+import sys
+import tracemalloc
+from datetime import date, datetime
+
+import rtk_4
+
+
+BRANCHES = ['краснодарский', 'ростовский', 'ставропольский', 'волгоградский', 'астраханский',
+            'адыгейский', 'калмыцкий', 'крымский', 'севастопольский', 'дагестанский']
+BRANDS = ['смарт', 'галилео', 'навтелеком', 'тесла', 'омникомм', 'автограф']
+CONDITIONS = sorted(rtk_4.ALLOWED_CONDITION)
+STATUSES = sorted(rtk_4.ALLOWED_STATUS)
+LOCATIONS = sorted(rtk_4.ALLOWED_LOCATION)
+
+
+SIZES = {'10k': 10000, '100k': 100000, '1m': 1000000, '10m': 10000000}
+GENERATE_BLOCK = 100000
+
+# состояние зависит от статуса: неисправные чаще в ремонте и на диагностике
+CONDITION_WEIGHTS = {
+    'исправен': {'установлен': 70, 'неустановлен': 15, 'демонтирован': 10, 'диагностика': 4, 'ремонт': 1},
+    'неисправен': {'ремонт': 40, 'диагностика': 30, 'демонтирован': 20, 'установлен': 7, 'неустановлен': 3},
+}
+
+
+def parse_rows(text):
+    """'10k', '1m', '250000' -> число записей."""
+    text = text.strip().lower()
+    if text in SIZES:
+        return SIZES[text]
+    if text[-1:] in ('k', 'm'):
+        return int(float(text[:-1]) * (1000 if text[-1] == 'k' else 1000000))
+    return int(text)
+
+
+def _zipf_weights(n, skew):
+    # skew=0 - равномерно, 1 - первый в списке встречается в n раз чаще последнего
+    return [1 / (rank ** skew) for rank in range(1, n + 1)]
+
+
+def generate_records(rows, seed=0, faulty_ratio=0.15, skew=1.0):
+    """
+    Корректные записи (dict) с уникальными 15-значными IMEI: филиалы и марки
+    распределены неравномерно (закон Ципфа с показателем skew), доля неисправных -
+    faulty_ratio, устройств с более поздней датой установки больше.
+    """
+    rnd = random.Random(seed)
+    start = date(2015, 1, 1).toordinal()
+    span = date(2025, 12, 31).toordinal() - start
+    branch_cum = list(itertools.accumulate(_zipf_weights(len(BRANCHES), skew)))
+    brand_cum = list(itertools.accumulate(_zipf_weights(len(BRANDS), skew)))
+    conditions = {status: (list(w), list(itertools.accumulate(w.values())))
+                  for status, w in CONDITION_WEIGHTS.items()}
+    iso = {}
+    for block_start in range(0, rows, GENERATE_BLOCK):
+        k = min(GENERATE_BLOCK, rows - block_start)
+        branches = rnd.choices(BRANCHES, cum_weights=branch_cum, k=k)
+        brands = rnd.choices(BRANDS, cum_weights=brand_cum, k=k)
+        for i in range(k):
+            status = 'неисправен' if rnd.random() < faulty_ratio else 'исправен'
+            names, cum = conditions[status]
+            condition = rnd.choices(names, cum_weights=cum)[0]
+            day = start + int(rnd.triangular(0, span, span))
+            date_str = iso.get(day)
+            if date_str is None:
+                date_str = iso[day] = date.fromordinal(day).isoformat()
+            yield {
+                'branch': branches[i],
+                'imei': str(860000000000000 + block_start + i),
+                'brand': brands[i],
+                'model': str(rnd.randint(100, 9999)),
+                'status': status,
+                'condition': condition,
+                'location': 'тс' if condition == 'установлен' else 'склад',
+                'date': date_str,
+            }
+
+
+def generate_store(rows, seed=0, faulty_ratio=0.15, skew=1.0):
+    """EquipmentStore с синтетическим парком, без промежуточных объектов Equipment."""
+    store = rtk_4.EquipmentStore()
+    store.append_rows(tuple(rec.values())[:-1] + (rtk_4.parse_date_ordinal(rec['date']),)
+                      for rec in generate_records(rows, seed, faulty_ratio, skew))
+    return store
+
+
+class LegacyEquipment:
+    """Прежнее устройство записи: обычный объект с __dict__ и datetime (для сравнения)."""
+
+    def __init__(self, branch, imei, brand, model, status, condition, location, date_str):
+        self.branch = branch
+        self.imei = imei
+        self.brand = brand
+        self.model = model
+        self.status = status
+        self.condition = condition
+        self.location = location
+        try:
+            self.date = datetime.strptime(date_str, '%Y-%m-%d')
+        except:
+            self.date = None
+
+
+def _traced_size(build):
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def bench_memory(rows):
+    # разбор строк JSON внутри замера: у каждой записи, как при загрузке файла, свои строки
+    lines = [json.dumps(rec, ensure_ascii=False) for rec in generate_records(rows)]
+
+    def build_legacy():
+        out = []
+        for line in lines:
+            r = json.loads(line)
+            out.append(LegacyEquipment(r['branch'], r['imei'], r['brand'], r['model'], r['status'],
+                                       r['condition'], r['location'], r['date']))
+        return out
+
+    def build_store():
+        return rtk_4.EquipmentStore(rtk_4.Equipment.from_dict(json.loads(line)) for line in lines)
+
+    legacy, legacy_size = _traced_size(build_legacy)
+    del legacy
+    store, store_size = _traced_size(build_store)
+    del store
+
+    print(f"записей: {rows}")
+    print(f"  список объектов Equipment (прежний): {legacy_size / 2**20:8.1f} МБ, {legacy_size / rows:6.0f} байт/запись")
+    print(f"  EquipmentStore (столбцы + индексы):  {store_size / 2**20:8.1f} МБ, {store_size / rows:6.0f} байт/запись")
+    return {'rows': rows, 'legacy_bytes': legacy_size, 'store_bytes': store_size}
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def bench_startup(rows):
+    """Запуск: текущий загрузчик JSON против бинарного снимка (целиком и через mmap)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, 'equipment_data.json')
+        snap_file = os.path.join(tmp, 'equipment_data.rtk')
+        store = rtk_4.EquipmentStore(rtk_4.Equipment.from_dict(r) for r in generate_records(rows))
+        rtk_4.write_json(store, json_file)
+        rtk_4.write_snapshot(store, snap_file)
+        probe = store.to_list()[rows // 2].imei
+        del store
+
+        _, t_json = _timed(lambda: rtk_4.EquipmentStore(rtk_4.load_from_json(json_file)))
+        _, t_snap = _timed(lambda: rtk_4.load_snapshot_into(rtk_4.EquipmentStore(), snap_file))
+
+        def mmap_lookup():
+            with rtk_4.SnapshotFile(snap_file) as snap:
+                return snap.get(probe)
+        found, t_mmap = _timed(mmap_lookup)
+        assert found is not None and found.imei == probe
+
+        print(f"записей: {rows}")
+        print(f"  JSON -> EquipmentStore:               {t_json:8.3f} с")
+        print(f"  бинарный снимок -> EquipmentStore:    {t_snap:8.3f} с  (x{t_json / t_snap:.0f})")
+        print(f"  mmap: открыть снимок + найти IMEI:    {t_mmap * 1000:8.3f} мс")
+        return {'rows': rows, 'json_s': t_json, 'snapshot_s': t_snap, 'mmap_lookup_s': t_mmap}
+
+
+def _process_time(code, runs):
+    """Лучшее время запуска отдельного процесса python -c code (холодный импорт)."""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_imports(runs=5):
+    """Время импорта rtk_4 (тяжелые модули откладываются) против импорта pandas и matplotlib."""
+    results = {
+        'python': _process_time('pass', runs),
+        'rtk_4': _process_time('import rtk_4', runs),
+        'rtk_4+analysis': _process_time('import rtk_4; rtk_4.pd.DataFrame; rtk_4.plt.figure', runs),
+        'pandas+matplotlib': _process_time('import pandas, matplotlib.pyplot', runs),
+    }
+    print("запуск процесса (лучшее из %d):" % runs)
+    for name, seconds in results.items():
+        print(f"  {name:20s} {seconds:8.3f} с")
+    return results
+
+
+# --- набор замеров: каждая операция в отдельном процессе ---
+
+SEARCH_LOOKUPS = 10000
+VALIDATE_SAMPLE = 200000
+SERVICE_READERS = 4
+ROLLUP_QUERIES = 100
+HISTORY_EVENTS = 200000
+SERVICE_WRITERS = 2
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает КБ, macOS - байты
+    return peak / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def _files(data_dir):
+    files = {fmt: os.path.join(data_dir, 'fleet.' + fmt) for fmt in ('json', 'csv', 'rtk')}
+    files['shards'] = os.path.join(data_dir, 'fleet_shards')
+    return files
+
+
+def _stored(data_dir):
+    store = rtk_4.EquipmentStore()
+    rtk_4.load_snapshot_into(store, _files(data_dir)['rtk'])
+    return store
+
+
+def _service_lookups(store, data_dir):
+    """Функция замера для service_lookup: SEARCH_LOOKUPS поисков через клиентов сервиса."""
+    journal = rtk_4.ChangeJournal(os.path.join(data_dir, 'service.journal'))
+    saver = rtk_4.PersistenceWorker(journal)
+    saver.start()
+    port = rtk_4.EquipmentService(store, saver, journal).start_in_thread()
+    rnd = random.Random(3)
+    imeis = [store.row(rnd.randrange(len(store))).imei for _ in range(SEARCH_LOOKUPS)]
+    readers = [rtk_4.ServiceClient(port=port) for _ in range(SERVICE_READERS)]
+    writers = [rtk_4.ServiceClient(port=port) for _ in range(SERVICE_WRITERS)]
+    done = threading.Event()
+
+    def read(client, part):
+        for imei in part:
+            client.find(imei)
+
+    def write(client, offset):
+        for i in itertools.count(offset, SERVICE_WRITERS):
+            if done.is_set():
+                return
+            eq = client.find(imeis[i % len(imeis)])
+            client.update(eq, location='склад' if eq.location == 'тс' else 'тс')
+
+    def run():
+        done.clear()
+        threads = [threading.Thread(target=write, args=(client, k)) for k, client in enumerate(writers)]
+        for t in threads:
+            t.start()
+        reading = [threading.Thread(target=read, args=(client, imeis[k::SERVICE_READERS]))
+                   for k, client in enumerate(readers)]
+        for t in reading:
+            t.start()
+        for t in reading:
+            t.join()
+        done.set()
+        for t in threads:
+            t.join()
+    return run
+
+
+def _history(store, data_dir):
+    """История из HISTORY_EVENTS правок состояния за 2024-2025 со снимком посередине (вне замера)."""
+    history = rtk_4.ChangeHistory(os.path.join(data_dir, 'bench.history'), os.path.join(data_dir, 'bench.values'),
+                                  os.path.join(data_dir, 'bench_history'))
+    rnd = random.Random(4)
+    start = datetime(2024, 1, 1)
+    step = (datetime(2026, 1, 1) - start) / HISTORY_EVENTS
+    for i in range(HISTORY_EVENTS):
+        eq = store.row(rnd.randrange(len(store)))
+        changes = {'condition': rnd.choice(CONDITIONS)}
+        history.record(eq, changes, start + step * i)
+        store.update(eq, **changes)
+        if i == HISTORY_EVENTS // 2:
+            history.write_snapshot(*history.snapshot(store))
+    store.frame()
+    return history
+
+
+def _prepare_op(op, data_dir):
+    """Подготовка вне замера. Возвращает (функция замера, сколько записей она обработает)."""
+    files = _files(data_dir)
+    out = os.path.join(data_dir, 'out')
+    if op == 'load_json':
+        return lambda: rtk_4.load_from_json(files['json']), None
+    if op == 'load_csv':
+        return lambda: rtk_4.load_from_csv(files['csv']), None
+    if op == 'load_shards':
+        def load_shards():
+            store = rtk_4.EquipmentStore()
+            rtk_4.load_shards_into(store, files['shards'])
+            return store
+        return load_shards, None
+    store = _stored(data_dir)
+    if op == 'save_json':
+        return lambda: rtk_4.save_to_json(store, out + '.json'), len(store)
+    if op == 'save_csv':
+        return lambda: rtk_4.save_to_csv(store, out + '.csv'), len(store)
+    if op == 'save_shards':
+        return lambda: rtk_4.save_shards(store, out + '_shards'), len(store)
+    if op == 'save_shards_edit':
+        # после правки одного устройства переписывается только файл его филиала
+        rtk_4.save_shards(store, out + '_shards')
+        store.update(store.row(0), status='неисправен' if store.row(0).status != 'неисправен' else 'исправен')
+        return lambda: rtk_4.save_shards(store, out + '_shards'), len(store)
+    if op == 'search':
+        # тот же путь, что App.search: IMEI + филиал через индекс хранилища
+        rnd = random.Random(1)
+        probes = [store.row(rnd.randrange(len(store))) for _ in range(SEARCH_LOOKUPS)]
+        probes = [(eq.imei, eq.branch) for eq in probes]
+        return lambda: [store.find(imei, branch) for imei, branch in probes], len(probes)
+    if op == 'imei_partial':
+        # App._suggest: часть номера (начало, конец, середина); индекс строится вне замера
+        rnd = random.Random(2)
+        imeis = [store.row(rnd.randrange(len(store))).imei for _ in range(SEARCH_LOOKUPS // 3)]
+        probes = [text for imei in imeis for text in (imei[:10], imei[-6:], imei[4:10])]
+        store.imei_candidates(probes[0])
+        return lambda: [store.imei_candidates(text) for text in probes], len(probes)
+    if op == 'service_lookup':
+        # сервис на localhost: SERVICE_READERS клиентов ищут по IMEI, пока SERVICE_WRITERS правят записи
+        return _service_lookups(store, data_dir), SEARCH_LOOKUPS
+    if op in ('sort_date', 'sort_condition'):
+        # App.sort_equipments: первое построение SortedView и порядок обхода по нему
+        field = op[len('sort_'):]
+        return lambda: store.sort_by(field), len(store)
+    if op == 'validate':
+        sample = [dict(zip(rtk_4.EQUIPMENT_FIELDS, values))
+                  for values in itertools.islice(store.iter_tuples(), VALIDATE_SAMPLE)]
+        return lambda: [rtk_4.validate_fields(rec) for rec in sample], len(sample)
+    if op == 'rollup_build':
+        return lambda: store.rollup(), len(store)
+    if op == 'rollup_query':
+        # "неисправные по филиалам по месяцам за 3 года" из готового куба; построение - вне замера
+        store.rollup()
+        today = date(2025, 12, 31)
+        return lambda: [rtk_4.condition_dynamics(store, 'branch', 36, today, status='неисправен')
+                        for _ in range(ROLLUP_QUERIES)], ROLLUP_QUERIES
+    if op in ('history_as_of', 'history_repair'):
+        history = _history(store, data_dir)
+        if op == 'history_as_of':
+            # от снимка вперед: состояние на 2025-03-01
+            return lambda: history.state_at(date(2025, 3, 1), store), len(store)
+        return lambda: rtk_4.time_in_state(history, store), len(history)
+    if op == 'chart_copy':
+        # App.show_chart: все, что при промахе кэша делается в потоке окна, - копия для потока графиков
+        return lambda: store.frozen_copy(), len(store)
+    if op == 'top_defective':
+        return lambda: rtk_4.defective_by_branch(store), len(store)
+    if op == 'brand_condition':
+        return lambda: rtk_4.brand_condition_pivot(store), len(store)
+    if op == 'brand_condition_frame':
+        # другая дата начала - через типизированный DataFrame (первое построение кэша)
+        return lambda: rtk_4.brand_condition_pivot(store, '2020-01-01'), len(store)
+    raise ValueError(f"неизвестная операция: {op}")
+
+
+OPS = ['load_json', 'load_csv', 'load_shards', 'save_json', 'save_csv', 'save_shards', 'save_shards_edit',
+       'search', 'imei_partial', 'service_lookup', 'sort_date', 'sort_condition', 'validate', 'rollup_build',
+       'rollup_query', 'history_as_of', 'history_repair', 'chart_copy', 'top_defective', 'brand_condition',
+       'brand_condition_frame']
+
+
+def run_op(op, data_dir):
+    """Выполняется в дочернем процессе; печатает одну строку JSON с результатом."""
+    func, rows = _prepare_op(op, data_dir)
+    # импорт numpy/pandas (отложенный в rtk_4) в замер операции не входит - его меряет imports
+    rtk_4.np.ndarray, rtk_4.pd.DataFrame
+    gc.collect()
+    rss_before = _peak_rss_mb()
+    result, seconds = _timed(func)
+    if rows is None:
+        rows = len(result)
+    print(json.dumps({'op': op, 'rows': rows, 'seconds': seconds,
+                      'rows_per_s': rows / seconds if seconds else None,
+                      'peak_rss_mb': _peak_rss_mb(), 'rss_before_mb': rss_before}))
+
+
+def prepare_fleet(rows, data_dir, faulty_ratio, skew):
+    store = generate_store(rows, faulty_ratio=faulty_ratio, skew=skew)
+    files = _files(data_dir)
+    rtk_4.write_json(store, files['json'])
+    rtk_4.write_csv(store, files['csv'])
+    rtk_4.write_snapshot(store, files['rtk'])
+    rtk_4.save_shards(store, files['shards'])
+
+
+def run_suite(sizes, ops, faulty_ratio=0.15, skew=1.0):
+    results = []
+    for size in sizes:
+        rows = parse_rows(size)
+        with tempfile.TemporaryDirectory() as data_dir:
+            print(f"парк {rows} записей: подготовка…", file=sys.stderr)
+            prepare_fleet(rows, data_dir, faulty_ratio, skew)
+            for op in ops:
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), '_op', op, data_dir],
+                                      capture_output=True, text=True)
+                if proc.returncode != 0:
+                    print(f"  {op}: ошибка\n{proc.stderr}", file=sys.stderr)
+                    continue
+                res = json.loads(proc.stdout.strip().splitlines()[-1])
+                res['fleet_rows'] = rows
+                results.append(res)
+                print(f"  {op:22s} {res['seconds']:9.3f} с  {res['rows_per_s'] or 0:12.0f} зап/с"
+                      f"  пик {res['peak_rss_mb']:8.1f} МБ", file=sys.stderr)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'faulty_ratio': faulty_ratio,
+            'skew': skew,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=0.25):
+    """Сравнение с прежним прогоном по (операция, размер). Возвращает список регрессий."""
+    before = {(r['op'], r['fleet_rows']): r for r in baseline['results']}
+    regressions = []
+    for res in current['results']:
+        old = before.get((res['op'], res['fleet_rows']))
+        if old is None:
+            continue
+        ratio = res['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        mem_ratio = res['peak_rss_mb'] / old['peak_rss_mb'] if old['peak_rss_mb'] else float('inf')
+        slower = ratio > 1 + tolerance
+        mark = 'РЕГРЕССИЯ' if slower else ''
+        print(f"  {res['op']:22s} {res['fleet_rows']:>9d}  время x{ratio:5.2f}  память x{mem_ratio:5.2f}  {mark}")
+        if slower:
+            regressions.append(res)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_mem = sub.add_parser('memory', help='память: объекты Equipment против столбцового хранилища')
+    p_mem.add_argument('--rows', type=int, default=100000)
+    p_start = sub.add_parser('startup', help='запуск: JSON против бинарного снимка')
+    p_start.add_argument('--rows', type=int, default=200000)
+    p_imp = sub.add_parser('imports', help='время импорта модуля')
+    p_imp.add_argument('--runs', type=int, default=5)
+    p_fleet = sub.add_parser('fleet', help='записать синтетический парк в CSV')
+    p_fleet.add_argument('output')
+    p_fleet.add_argument('--rows', default='10k')
+    p_fleet.add_argument('--faulty', type=float, default=0.15, help='доля неисправных')
+    p_fleet.add_argument('--skew', type=float, default=1.0, help='неравномерность филиалов и марок')
+    p_fleet.add_argument('--seed', type=int, default=0)
+    p_run = sub.add_parser('run', help='набор замеров по размерам парка')
+    p_run.add_argument('--sizes', default='10k,100k', help='через запятую: 10k,100k,1m,10m')
+    p_run.add_argument('--ops', default=','.join(OPS))
+    p_run.add_argument('--faulty', type=float, default=0.15)
+    p_run.add_argument('--skew', type=float, default=1.0)
+    p_run.add_argument('--output', help='куда записать результаты (JSON)')
+    p_run.add_argument('--baseline', help='JSON прежнего прогона для сравнения')
+    p_run.add_argument('--tolerance', type=float, default=0.25, help='допустимое замедление (0.25 = 25%%)')
+    p_op = sub.add_parser('_op')  # одна операция в дочернем процессе
+    p_op.add_argument('op')
+    p_op.add_argument('data_dir')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'memory':
+        bench_memory(args.rows)
+    elif args.cmd == 'startup':
+        bench_startup(args.rows)
+    elif args.cmd == 'imports':
+        bench_imports(args.runs)
+    elif args.cmd == 'fleet':
+        store = generate_store(parse_rows(args.rows), args.seed, args.faulty, args.skew)
+        rtk_4.write_csv(store, args.output)
+    elif args.cmd == '_op':
+        run_op(args.op, args.data_dir)
+    elif args.cmd == 'run':
+        results = run_suite(args.sizes.split(','), args.ops.split(','), args.faulty, args.skew)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            if compare(results, baseline, args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,147 +1,3305 @@
-from tkinter import ttk, messagebox
+import argparse
+import bisect
+import cProfile
 import csv
+import functools
+import heapq
+import importlib
+import itertools
 import json
+import logging
+import logging.handlers
+import math
+import mmap
+import os
+import queue
 import re
-from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
-from tkinter import simpledialog
-import tkinter as tk
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
 
+class _LazyModule:
+    """Модуль, который импортируется при первом обращении к нему (numpy, pandas, matplotlib нужны только аналитике)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+np = _LazyModule('numpy')
+pd = _LazyModule('pandas')
+plt = _LazyModule('matplotlib.pyplot')
+# пул процессов и контрольные суммы нужны только файлам филиалов
+futures = _LazyModule('concurrent.futures')
+multiprocessing = _LazyModule('multiprocessing')
+hashlib = _LazyModule('hashlib')
+asyncio = _LazyModule('asyncio')   # только для сервиса (serve)
+# Tk нужен только окну: командная строка и сервис работают без python3-tk
+tk = _LazyModule('tkinter')
+ttk = _LazyModule('tkinter.ttk')
+messagebox = _LazyModule('tkinter.messagebox')
+simpledialog = _LazyModule('tkinter.simpledialog')
+filedialog = _LazyModule('tkinter.filedialog')
+
+
+# ===================== Замеры времени операций =====================
+
+METRICS_FILE = 'rtk_metrics.jsonl'    # строка JSON на каждую операцию, с ротацией
+METRICS_MAX_BYTES = 1_000_000
+METRICS_BACKUPS = 3
+PROFILE_FILE = 'rtk_profile.prof'     # результат cProfile (pstats / snakeviz)
+
+class LatencyHistogram:
+    """Гистограмма задержек в логарифмических корзинах (4 на удвоение, от 10 мкс): память не растет."""
+    BASE_MS = 0.01
+    PER_DOUBLING = 4
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+    def add(self, ms, rows=None):
+        index = max(0, int(math.log2(max(ms, self.BASE_MS) / self.BASE_MS) * self.PER_DOUBLING))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if rows:
+            self.rows += rows
+
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попадает q-я доля замеров (погрешность ~19%)."""
+        if not self.count:
+            return 0.0
+        need = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= need:
+                return min(self.max_ms, self.BASE_MS * 2 ** ((index + 1) / self.PER_DOUBLING))
+        return self.max_ms
+
+class Metrics:
+    """
+    Замеры операций текущего сеанса: гистограммы по именам операций, строки в файл
+    METRICS_FILE (ротация по размеру). По желанию - cProfile вызовов из главного потока.
+    """
+
+    def __init__(self, filename=METRICS_FILE):
+        self.filename = filename
+        self.histograms = {}
+        self.profiler = None
+        self._lock = threading.Lock()
+        self._log = None
+        self._local = threading.local()
+
+    def _logger(self):
+        if self._log is None:
+            # свой логгер у каждого Metrics: общий из getLogger писал бы строки во все их файлы
+            log = logging.Logger('rtk.metrics')
+            log.propagate = False
+            log.setLevel(logging.INFO)
+            try:
+                handler = logging.handlers.RotatingFileHandler(
+                    self.filename, maxBytes=METRICS_MAX_BYTES, backupCount=METRICS_BACKUPS, encoding='utf-8')
+                log.addHandler(handler)
+            except OSError as e:
+                print(f"Ошибка при открытии файла замеров: {e}")
+            self._log = log
+        return self._log
+
+    def record(self, op, seconds, rows=None):
+        ms = seconds * 1000
+        with self._lock:
+            hist = self.histograms.get(op)
+            if hist is None:
+                hist = self.histograms[op] = LatencyHistogram()
+            hist.add(ms, rows)
+        if self.filename:
+            line = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'op': op, 'ms': round(ms, 3)}
+            if rows is not None:
+                line['rows'] = rows
+            self._logger().info(json.dumps(line, ensure_ascii=False))
+
+    @contextmanager
+    def timer(self, op, rows=None):
+        """with metrics.timer('search'): ... - замер блока (и cProfile, если включен)."""
+        profiling = self._profile_start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._profile_stop(profiling)
+            self.record(op, elapsed, rows)
+
+    def summary(self):
+        """[(операция, число вызовов, p50 мс, p95 мс, макс мс, строк)] по убыванию общего времени."""
+        with self._lock:
+            items = sorted(self.histograms.items(), key=lambda kv: -kv[1].total_ms)
+            return [(op, h.count, h.percentile(0.5), h.percentile(0.95), h.max_ms, h.rows) for op, h in items]
+
+    # --- cProfile: только главный поток (профиль в Python 3.11 - на поток) и только внешний вызов ---
+    def start_profiling(self):
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+
+    def stop_profiling(self, filename=PROFILE_FILE):
+        """Выключает профилирование и пишет накопленное в filename. Возвращает имя файла или None."""
+        profiler, self.profiler = self.profiler, None
+        if profiler is None:
+            return None
+        profiler.dump_stats(filename)
+        return filename
+
+    def _profile_start(self):
+        if self.profiler is None or threading.current_thread() is not threading.main_thread():
+            return False
+        if getattr(self._local, 'profiling', False):
+            return False
+        self._local.profiling = True
+        self.profiler.enable()
+        return True
+
+    def _profile_stop(self, profiling):
+        if profiling:
+            self._local.profiling = False
+            if self.profiler is not None:
+                self.profiler.disable()
+
+metrics = Metrics()
+if os.environ.get('RTK_PROFILE') == '1':
+    metrics.start_profiling()
+
+def timed(op, rows=None):
+    """
+    Декоратор замера функции. rows - откуда взять число записей:
+    'result' - len(результата), число - len(аргумента с этим номером), функция(result, args).
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiling = metrics._profile_start()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics._profile_stop(profiling)
+            count = None
+            try:
+                if rows == 'result':
+                    count = len(result)
+                elif isinstance(rows, int):
+                    count = len(args[rows])
+                elif callable(rows):
+                    count = rows(result, args)
+            except TypeError:
+                pass
+            metrics.record(op, elapsed, count)
+            return result
+        return wrapper
+    return decorate
+
+
+# ===================== Модель записи =====================
+EQUIPMENT_FIELDS = ('branch', 'imei', 'brand', 'model', 'status', 'condition', 'location', 'date')
+CATEGORY_FIELDS = ('branch', 'brand', 'status', 'condition', 'location')
+DIGIT_FIELDS = ('imei', 'model')
+
+def parse_date_ordinal(date_str):
+    """'YYYY-MM-DD' -> порядковый номер дня (date.toordinal); 0 - дата неизвестна."""
+    if not date_str:
+        return 0
+    try:
+        if len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-':
+            return date.fromisoformat(date_str).toordinal()
+        return datetime.strptime(date_str, '%Y-%m-%d').toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+def ordinal_to_datetime(ordinal):
+    return datetime.fromordinal(ordinal) if ordinal else None
+
+def ordinal_to_str(ordinal):
+    return date.fromordinal(ordinal).isoformat() if ordinal else ''
+
+def _datetime_to_ordinal(value):
+    return value.toordinal() if value else 0
+
+_ORDINAL_1970 = date(1970, 1, 1).toordinal()
+
+def ordinals_to_datetime64(ordinals):
+    """Массив номеров дней -> datetime64[s] (0 - NaT), без разбора строк дат."""
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    out = (ordinals - _ORDINAL_1970).astype('datetime64[D]').astype('datetime64[s]')
+    out[ordinals == 0] = np.datetime64('NaT')
+    return out
+
+def _field_property(name, idx):
+    def fget(self):
+        if self._table is None:
+            return self._row[idx]
+        return self._table.get(self._row, name)
+
+    def fset(self, value):
+        if self._table is None:
+            self._row[idx] = value
+        else:
+            self._table.set_field(self._row, name, value)
+    return property(fget, fset)
 
-# ===================== Модели и файлы - без изменений =====================
 class Equipment:
+    """
+    Запись об устройстве. Значения записей из хранилища живут в его столбцах,
+    а Equipment - легкое представление строки (__slots__, без __dict__).
+    Созданный напрямую объект держит значения у себя, пока его не добавят в хранилище.
+    """
+    __slots__ = ('_table', '_row')
+
     def __init__(self, branch, imei, brand, model, status, condition, location, date_str):
-        self.branch = branch
-        self.imei = imei
-        self.brand = brand
-        self.model = model
-        self.status = status
-        self.condition = condition
-        self.location = location
+        self._table = None
+        self._row = [branch, imei, brand, model, status, condition, location, parse_date_ordinal(date_str)]
+
+    @classmethod
+    def _view(cls, table, row):
+        eq = cls.__new__(cls)
+        eq._table = table
+        eq._row = row
+        return eq
+
+    branch = _field_property('branch', 0)
+    imei = _field_property('imei', 1)
+    brand = _field_property('brand', 2)
+    model = _field_property('model', 3)
+    status = _field_property('status', 4)
+    condition = _field_property('condition', 5)
+    location = _field_property('location', 6)
+
+    @property
+    def date(self):
+        if self._table is None:
+            return ordinal_to_datetime(self._row[7])
+        return ordinal_to_datetime(self._table.dates[self._row])
+
+    @date.setter
+    def date(self, value):
+        if self._table is None:
+            self._row[7] = _datetime_to_ordinal(value)
+        else:
+            self._table.set_field(self._row, 'date', value)
+
+    def _values(self):
+        """(branch, imei, brand, model, status, condition, location, дата как ordinal)"""
+        if self._table is None:
+            return tuple(self._row)
+        return self._table.row_values(self._row)
+
+    def to_tuple(self):
+        values = self._values()
+        return values[:7] + (ordinal_to_str(values[7]),)
+
+    def to_dict(self):
+        return dict(zip(EQUIPMENT_FIELDS, self.to_tuple()))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            branch=data['branch'],
+            imei=data['imei'],
+            brand=data['brand'],
+            model=data['model'],
+            status=data['status'],
+            condition=data['condition'],
+            location=data['location'],
+            date_str=data['date']
+        )
+
+# ===================== Столбцовое хранение =====================
+class _CategoryColumn:
+    """Словарное кодирование: каждая строка хранится один раз, в строке таблицы - ее код."""
+    __slots__ = ('codes', 'values', 'code_of')
+
+    def __init__(self):
+        self.codes = array('I')
+        self.values = []
+        self.code_of = {}
+
+    def encode(self, s):
+        code = self.code_of.get(s)
+        if code is None:
+            code = len(self.values)
+            self.values.append(sys.intern(s) if type(s) is str else s)
+            self.code_of[s] = code
+        return code
+
+    def append(self, s):
+        code = self.code_of.get(s)
+        self.codes.append(self.encode(s) if code is None else code)
+
+    def get(self, row):
+        return self.values[self.codes[row]]
+
+    def set(self, row, s):
+        self.codes[row] = self.encode(s)
+
+    def copy(self):
+        col = _CategoryColumn()
+        col.codes = array('I', self.codes)
+        col.values = list(self.values)
+        col.code_of = dict(self.code_of)
+        return col
+
+class _DigitColumn:
+    """
+    Строка из цифр хранится числом в array('q') и шириной (ведущие нули) в array('b').
+    Все остальное (пустые значения, буквы из непроверенных файлов) - в списке extra,
+    тогда ширина -1, а число - индекс в extra.
+    """
+    __slots__ = ('nums', 'widths', 'extra')
+    MAX_WIDTH = 18
+
+    def __init__(self):
+        self.nums = array('q')
+        self.widths = array('b')
+        self.extra = []
+
+    def _pack(self, s):
+        if type(s) is str and 0 < len(s) <= self.MAX_WIDTH and s.isascii() and s.isdigit():
+            return int(s), len(s)
+        self.extra.append(s)
+        return len(self.extra) - 1, -1
+
+    def append(self, s):
+        num, width = self._pack(s)
+        self.nums.append(num)
+        self.widths.append(width)
+
+    def get(self, row):
+        width = self.widths[row]
+        if width < 0:
+            return self.extra[self.nums[row]]
+        return str(self.nums[row]).zfill(width)
+
+    def set(self, row, s):
+        self.nums[row], self.widths[row] = self._pack(s)
+
+    def copy(self):
+        col = _DigitColumn()
+        col.nums = array('q', self.nums)
+        col.widths = array('b', self.widths)
+        col.extra = list(self.extra)
+        return col
+
+def imei_key(imei):
+    """Ключ индекса IMEI: для строки из цифр - число (с учетом длины), иначе сама строка."""
+    if type(imei) is str and 0 < len(imei) <= _DigitColumn.MAX_WIDTH and imei.isascii() and imei.isdigit():
+        return int(imei) * 32 + len(imei)
+    return imei
+
+def stable_hash(key):
+    """
+    Хэш ключа IMEI, одинаковый во всех процессах (hash() для строк случаен),
+    чтобы готовую таблицу индекса можно было хранить в файле снимка.
+    """
+    if type(key) is int:
+        h = (key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return h ^ (h >> 29)
+    return zlib.crc32(key.encode('utf-8', 'surrogatepass'))
+
+class _ImeiIndex:
+    """
+    IMEI -> номер строки: хэш-таблица с открытой адресацией в array('i') (-1 - пустая ячейка).
+    Ключ не хранится - сравнение идет со столбцом IMEI, так что на запись уходит ~8-16 байт
+    вместо ~100 у dict с объектами int.
+    """
+    __slots__ = ('col', 'slots', 'mask', 'used')
+
+    def __init__(self, column, capacity=8):
+        self.col = column
+        size = 8
+        while size < capacity * 2:
+            size *= 2
+        self.slots = array('i', [-1]) * size
+        self.mask = size - 1
+        self.used = 0
+
+    @classmethod
+    def build(cls, column, n):
+        """
+        Индекс по столбцу целиком (IMEI уникальны): цифровые ключи раскладываются векторно -
+        каждый раунд все еще не размещенные ключи пробуют очередную ячейку своей цепочки,
+        в свободную попадает первый из претендентов, остальные идут дальше по цепочке.
+        Поиск идет по тем же цепочкам, поэтому результат равен вставке по одному.
+        """
+        index = cls(column, n)
+        nums = np.array(column.nums, dtype=np.int64)
+        widths = np.array(column.widths, dtype=np.int8)
+        rows = np.flatnonzero(widths >= 0)
+        # stable_hash для ключа число * 32 + длина, в арифметике по модулю 2**64
+        with np.errstate(over='ignore'):
+            keys = nums[rows].astype(np.uint64) * np.uint64(32) + widths[rows].astype(np.uint64)
+            perturb = keys * np.uint64(0x9E3779B97F4A7C15)
+        perturb ^= perturb >> np.uint64(29)
+        mask = np.uint64(index.mask)
+        slot = perturb & mask
+        slots = np.full(len(index.slots), -1, dtype=np.int32)
+        while len(rows):
+            free = np.flatnonzero(slots[slot] < 0)
+            _, first = np.unique(slot[free], return_index=True)
+            placed = free[first]
+            slots[slot[placed]] = rows[placed]
+            waiting = np.ones(len(rows), dtype=bool)
+            waiting[placed] = False
+            rows, perturb, slot = rows[waiting], perturb[waiting] >> np.uint64(5), slot[waiting]
+            slot = (slot * np.uint64(5) + perturb + np.uint64(1)) & mask
+        index.slots = array('i', slots.tobytes())
+        index.used = n - int(np.count_nonzero(widths < 0))
+        for row in np.flatnonzero(widths < 0).tolist():
+            index.fill(index.slot_for(index._key_of_row(row)), row)
+        return index
+
+    @classmethod
+    def from_slots(cls, column, slots, used):
+        index = cls(column)
+        index.slots = slots
+        index.mask = len(slots) - 1
+        index.used = used
+        return index
+
+    def _key_of_row(self, row):
+        col = self.col
+        width = col.widths[row]
+        if width < 0:
+            return col.extra[col.nums[row]]
+        return col.nums[row] * 32 + width
+
+    def _probe(self, key):
+        slots, mask, key_of_row = self.slots, self.mask, self._key_of_row
+        perturb = stable_hash(key)
+        i = perturb & mask
+        while True:
+            row = slots[i]
+            if row < 0 or key_of_row(row) == key:
+                return i
+            perturb >>= 5
+            i = (i * 5 + perturb + 1) & mask
+
+    def get(self, key):
+        row = self.slots[self._probe(key)]
+        return None if row < 0 else row
+
+    def slot_for(self, key):
+        """Ячейка ключа: занятая им или пустая, куда его можно вставить."""
+        return self._probe(key)
+
+    def fill(self, slot, row):
+        self.slots[slot] = row
+        self.used += 1
+        if self.used * 2 > len(self.slots):
+            self._grow()
+
+    def _grow(self):
+        old = self.slots
+        self.slots = array('i', [-1]) * (len(old) * 4)
+        self.mask = len(self.slots) - 1
+        for row in old:
+            if row >= 0:
+                self.slots[self._probe(self._key_of_row(row))] = row
+
+class _EquipmentTable:
+    """Столбцы записей: категории словарем, IMEI и модель числами, дата - номером дня."""
+
+    def __init__(self, owner=None):
+        self.owner = owner  # хранилище, через которое идут изменения (индексы)
+        self.cols = {f: _CategoryColumn() for f in CATEGORY_FIELDS}
+        self.cols.update({f: _DigitColumn() for f in DIGIT_FIELDS})
+        self.dates = array('i')
+        self.n = 0
+
+    def append(self, values):
+        branch, imei, brand, model, status, condition, location, ordinal = values
+        cols = self.cols
+        cols['branch'].append(branch)
+        cols['imei'].append(imei)
+        cols['brand'].append(brand)
+        cols['model'].append(model)
+        cols['status'].append(status)
+        cols['condition'].append(condition)
+        cols['location'].append(location)
+        self.dates.append(ordinal)
+        self.n += 1
+        return self.n - 1
+
+    def get(self, row, name):
+        return self.cols[name].get(row)
+
+    def row_values(self, row):
+        cols = self.cols
+        return (cols['branch'].get(row), cols['imei'].get(row), cols['brand'].get(row),
+                cols['model'].get(row), cols['status'].get(row), cols['condition'].get(row),
+                cols['location'].get(row), self.dates[row])
+
+    def set(self, row, name, value):
+        if name == 'date':
+            self.dates[row] = _datetime_to_ordinal(value)
+        else:
+            self.cols[name].set(row, value)
+
+    def set_field(self, row, name, value):
+        # присваивание через представление строки тоже должно обновлять индексы
+        if self.owner is not None:
+            self.owner.update(Equipment._view(self, row), **{name: value})
+        else:
+            self.set(row, name, value)
+
+    def iter_tuples(self, rows):
+        cols = self.cols
+        branch, brand, status, condition, location = (
+            (cols[f].values, cols[f].codes) for f in CATEGORY_FIELDS)
+        imei, model, dates = cols['imei'].get, cols['model'].get, self.dates
+        for row in rows:
+            yield (branch[0][branch[1][row]], imei(row), brand[0][brand[1][row]], model(row),
+                   status[0][status[1][row]], condition[0][condition[1][row]],
+                   location[0][location[1][row]], ordinal_to_str(dates[row]))
+
+    def column(self, name, rows):
+        """Значения столбца в порядке rows (даты - ordinal)."""
+        if name == 'date':
+            return [self.dates[r] for r in rows]
+        col = self.cols[name]
+        if name in CATEGORY_FIELDS:
+            values, codes = col.values, col.codes
+            return [values[codes[r]] for r in rows]
+        return [col.get(r) for r in rows]
+
+    def copy(self):
+        table = _EquipmentTable()
+        table.cols = {name: col.copy() for name, col in self.cols.items()}
+        table.dates = array('i', self.dates)
+        table.n = self.n
+        return table
+
+class EquipmentSnapshot:
+    """Неизменяемая копия столбцов хранилища на момент вызова snapshot() - для фоновой записи."""
+
+    def __init__(self, table, order, index_slots):
+        self.table = table
+        self.order = order              # array строк в порядке обхода или None - порядок вставки
+        self.index_slots = index_slots  # копия таблицы индекса IMEI
+
+    def _rows(self):
+        return self.order if self.order is not None else range(self.table.n)
+
+    def __len__(self):
+        return self.table.n
+
+    def __iter__(self):
+        table = self.table
+        return (Equipment._view(table, row) for row in self._rows())
+
+    def iter_tuples(self):
+        return self.table.iter_tuples(self._rows())
+
+class _FrameCache:
+    """
+    Типизированные столбцы таблицы для DataFrame. Догоняют таблицу по изменениям:
+    дописываются новые строки, пересчитываются только измененные (dirty).
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.n = 0
+        self.dirty = set()
+        self.arrays = {}
+        self.version = -1
+        self.frame = None
+
+    def _extract(self, rows):
+        """Значения строк rows (range или массив номеров) по столбцам в numpy."""
+        table = self.table
+        out = {}
+        for name in CATEGORY_FIELDS:
+            codes = table.cols[name].codes
+            if isinstance(rows, range):
+                out[name] = np.array(codes[rows.start:rows.stop], dtype=np.int32)
+            else:
+                out[name] = np.array([codes[r] for r in rows], dtype=np.int32)
+        for name in DIGIT_FIELDS:
+            get = table.cols[name].get
+            out[name] = np.array([get(r) for r in rows], dtype=object)
+        dates = table.dates
+        if isinstance(rows, range):
+            out['date'] = np.array(dates[rows.start:rows.stop], dtype=np.int32)
+        else:
+            out['date'] = np.array([dates[r] for r in rows], dtype=np.int32)
+        return out
+
+    def sync(self):
+        n = self.table.n
+        dirty = np.fromiter((r for r in self.dirty if r < self.n), dtype=np.int64)
+        self.dirty = set()
+        # прежний кадр делит с кэшем массивы, а его еще может читать отчет: правки - в копию
+        shared = self.frame is not None
+        if self.n < n:
+            fresh = self._extract(range(self.n, n))
+            self.arrays = {k: np.concatenate([self.arrays[k], v]) if self.arrays else v
+                           for k, v in fresh.items()}
+            self.n = n
+            shared = False
+        if len(dirty):
+            for k, v in self._extract(dirty).items():
+                if shared:
+                    self.arrays[k] = self.arrays[k].copy()
+                self.arrays[k][dirty] = v
+
+    def build(self, order):
+        table, arrays = self.table, self.arrays
+        if not self.n:
+            return pd.DataFrame({name: pd.Series(dtype='category' if name in CATEGORY_FIELDS else object)
+                                 for name in EQUIPMENT_FIELDS}).astype({'date': 'datetime64[s]'})
+        data = {}
+        for name in EQUIPMENT_FIELDS:
+            if name in CATEGORY_FIELDS:
+                data[name] = pd.Categorical.from_codes(arrays[name], categories=table.cols[name].values)
+            elif name == 'date':
+                data[name] = ordinals_to_datetime64(arrays[name])
+            else:
+                data[name] = arrays[name]
+        frame = pd.DataFrame(data)   # индекс - номер строки в хранилище
+        return frame if order is None else frame.take(np.frombuffer(order, dtype=np.uint32))
+
+def _date_prefix_bounds(text):
+    """Диапазон номеров дней [от, до) для 'YYYY', 'YYYY-MM' или 'YYYY-MM-DD'; None - не дата."""
+    try:
+        if re.fullmatch(r'\d{4}', text):
+            first = date(int(text), 1, 1)
+            last = date(first.year, 12, 31)
+        elif re.fullmatch(r'\d{4}-\d{2}', text):
+            first = date(int(text[:4]), int(text[5:]), 1)
+            last = date(first.year, 12, 31) if first.month == 12 else \
+                date.fromordinal(date(first.year, first.month + 1, 1).toordinal() - 1)
+        elif re.fullmatch(r'\d{4}-\d{2}-\d{2}', text):
+            first = last = date.fromisoformat(text)
+        else:
+            return None
+    except ValueError:
+        return None
+    return first.toordinal(), last.toordinal() + 1
+
+class SortedView:
+    """
+    Номера строк, упорядоченные по полям fields (при равенстве - по номеру строки,
+    то есть порядку добавления). Строится один раз, дальше поддерживается вставкой
+    bisect при добавлении и правке; сами строки хранилища не переставляются.
+    """
+    FIELDS = ('date', 'condition', 'branch', 'brand', 'status', 'location')
+
+    def __init__(self, table, fields):
+        unknown = [f for f in fields if f not in self.FIELDS]
+        if unknown or not fields:
+            raise ValueError(f"Сортировка по полям {unknown or fields} не поддерживается")
+        self.fields = tuple(fields)
+        self.table = table
+        self.key = self._make_key()
+        self.rows = array('I', self._initial_order().astype(np.uint32).tobytes())
+
+    def _initial_order(self):
+        # первое построение - одним np.lexsort по числовым ключам (ранг значения категории, дата)
+        keys = []
+        for name in self.fields:
+            if name == 'date':
+                keys.append(np.array(self.table.dates, dtype=np.int64))
+                continue
+            col = self.table.cols[name]
+            rank = np.empty(len(col.values), dtype=np.int64)
+            rank[sorted(range(len(col.values)), key=col.values.__getitem__)] = np.arange(len(col.values))
+            keys.append(rank[np.array(col.codes, dtype=np.int64)])
+        # lexsort устойчив: при равных ключах остается порядок строк; главный ключ - последний
+        return np.lexsort(keys[::-1]) if self.table.n else np.empty(0, dtype=np.int64)
+
+    def _make_key(self):
+        getters = []
+        for name in self.fields:
+            if name == 'date':
+                getters.append(self.table.dates.__getitem__)
+            else:
+                col = self.table.cols[name]
+                getters.append(lambda row, values=col.values, codes=col.codes: values[codes[row]])
+        if len(getters) == 1:
+            get = getters[0]
+            return lambda row: (get(row), row)
+        return lambda row: (*(get(row) for get in getters), row)
+
+    def insert(self, row):
+        self.rows.insert(bisect.bisect_left(self.rows, self.key(row), key=self.key), row)
+
+    def remove(self, row):
+        """Убирает строку - вызывается до изменения ее полей, пока ключ прежний."""
+        i = bisect.bisect_left(self.rows, self.key(row), key=self.key)
+        del self.rows[i]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _index(self, i, descending):
+        return self.rows[len(self.rows) - 1 - i] if descending else self.rows[i]
+
+    def row_numbers(self, offset=0, limit=None, descending=False):
+        """Номера строк страницы [offset, offset+limit) без копирования всего порядка."""
+        n = len(self.rows)
+        offset = max(offset, 0)
+        stop = n if limit is None else min(n, offset + limit)
+        return [self._index(i, descending) for i in range(offset, stop)]
+
+    def page(self, offset, limit, descending=False):
+        """Записи страницы (представления строк)."""
+        table = self.table
+        return [Equipment._view(table, row) for row in self.row_numbers(offset, limit, descending)]
+
+    def top(self, k, descending=True):
+        """Первые k записей по убыванию (или возрастанию) ключа."""
+        return self.page(0, k, descending)
+
+    def iter_rows(self, descending=False):
+        return reversed(self.rows) if descending else iter(self.rows)
+
+    def __iter__(self):
+        table = self.table
+        return (Equipment._view(table, row) for row in self.iter_rows())
+
+def _reverse_digits(nums, width):
+    """Числа из width цифр (с ведущими нулями) с цифрами в обратном порядке, векторно."""
+    nums = nums.copy()
+    out = np.zeros_like(nums)
+    for _ in range(width):
+        out = out * 10 + nums % 10
+        nums //= 10
+    return out
+
+class ImeiSearchIndex:
+    """
+    Поиск по части IMEI: точно, по началу, по концу и по середине номера.
+    Для каждой длины номера хранятся числа IMEI по возрастанию (начало номера - это диапазон
+    чисел, два np.searchsorted) и они же с перевернутыми цифрами (конец номера - начало
+    перевернутого). Для середины - пары соседних цифр по позициям (uint8) и их частоты:
+    сравнение по самой редкой паре запроса отсекает большинство номеров без деления,
+    остальные проверяются по числу; проход идет кусками и останавливается, когда набран limit.
+    IMEI не меняются, поэтому строки, добавленные после построения, просматриваются
+    отдельно, а когда их больше TAIL_ROWS - индекс строится заново.
+    """
+    TAIL_ROWS = 4096
+    SCAN_CHUNK = 1 << 17
+    KINDS = ('точно', 'начало', 'конец', 'середина')
+
+    def __init__(self, table):
+        self.table = table
+        self._build()
+
+    def _build(self):
+        col = self.table.cols['imei']
+        nums = np.array(col.nums, dtype=np.int64)
+        widths = np.array(col.widths, dtype=np.int8)
+        self.built = len(nums)
+        self.by_width = {}  # длина -> (числа, строки, перевернутые числа, строки, пары цифр, частоты пар)
+        for width in np.unique(widths[widths > 0]).tolist():
+            rows = np.flatnonzero(widths == width)
+            keys = nums[rows]
+            reverse = _reverse_digits(keys, width)
+            order = np.argsort(keys, kind='stable')
+            reverse_order = np.argsort(reverse, kind='stable')
+            keys = keys[order]
+            pairs = self._digit_pairs(keys, width)
+            counts = np.array([np.bincount(p, minlength=100) for p in pairs]).reshape(-1, 100)
+            self.by_width[width] = (keys, rows[order].astype(np.uint32),
+                                    reverse[reverse_order], rows[reverse_order].astype(np.uint32),
+                                    pairs, counts)
+        self.extra_rows = np.flatnonzero(widths < 0).tolist()  # не цифровые IMEI - перебором
+
+    @staticmethod
+    def _digit_pairs(keys, width):
+        """Матрица (width-1, n) uint8: число из цифр i и i+1 каждого номера."""
+        digits = np.empty((width, len(keys)), dtype=np.uint8)
+        rest = keys.copy()
+        for i in range(width - 1, -1, -1):
+            digits[i] = rest % 10
+            rest //= 10
+        return digits[:-1] * 10 + digits[1:]
+
+    @staticmethod
+    def _bounds(keys, text, width):
+        if len(text) > width:
+            return 0, 0
+        scale = 10 ** (width - len(text))
+        prefix = int(text)
+        return np.searchsorted(keys, prefix * scale), np.searchsorted(keys, (prefix + 1) * scale)
+
+    def _filter(self, branch, brand):
+        """Функция: массив строк -> маска подходящих под филиал/марку; None - фильтра нет."""
+        wanted = []
+        for name, value in (('branch', branch), ('brand', brand)):
+            if value:
+                col = self.table.cols[name]
+                code = col.code_of.get(value)
+                if code is None:
+                    return False
+                wanted.append((col.codes, code))
+        if not wanted:
+            return None
+
+        def keep(rows):
+            mask = np.ones(len(rows), dtype=bool)
+            for codes, code in wanted:
+                # frombuffer без копии; массив живет только внутри вызова
+                mask &= np.frombuffer(codes, dtype=np.uint32)[rows] == code
+            return mask
+        return keep
+
+    def _tail_matches(self, text):
+        """Строки вне отсортированных массивов (новые и не цифровые) по видам совпадения."""
+        col = self.table.cols['imei']
+        found = {kind: [] for kind in self.KINDS}
+        for row in [*self.extra_rows, *range(self.built, self.table.n)]:
+            imei = str(col.get(row))
+            if imei == text:
+                found['точно'].append(row)
+            elif imei.startswith(text):
+                found['начало'].append(row)
+            elif imei.endswith(text):
+                found['конец'].append(row)
+            elif text in imei:
+                found['середина'].append(row)
+        return found
+
+    def _digit_matches(self, text, kind):
+        """Куски массивов строк с совпадением вида kind (по возрастанию длины номера)."""
+        for width, (keys, rows, reverse, reverse_rows, pairs, counts) in sorted(self.by_width.items()):
+            if kind == 'точно':
+                if width == len(text):
+                    lo, hi = self._bounds(keys, text, width)
+                    yield rows[lo:hi]
+            elif kind == 'начало':
+                lo, hi = self._bounds(keys, text, width)
+                yield rows[lo:hi]
+            elif kind == 'конец':
+                lo, hi = self._bounds(reverse, text[::-1], width)
+                yield reverse_rows[lo:hi]
+            elif width > len(text) + 1:
+                # середина: совпадение с позиции i (слева и справа остается хотя бы по цифре)
+                k, value = len(text), int(text)
+                # для каждой позиции - самая редкая пара цифр запроса (j - ее место в запросе)
+                probes = []
+                for i in range(1, width - k):
+                    if k == 1:
+                        probes.append((i, 0, None))
+                        continue
+                    j = min(range(k - 1), key=lambda j: counts[i + j, int(text[j:j + 2])])
+                    if counts[i + j, int(text[j:j + 2])]:
+                        probes.append((i, j, int(text[j:j + 2])))
+                for start in range(0, len(keys) if probes else 0, self.SCAN_CHUNK):
+                    stop = start + self.SCAN_CHUNK
+                    mask = np.zeros(len(keys[start:stop]), dtype=bool)
+                    for i, j, pair in probes:
+                        if pair is None:
+                            mask |= pairs[i, start:stop] // 10 == value
+                            continue
+                        hit = np.flatnonzero(pairs[i + j, start:stop] == pair)
+                        if k > 2:
+                            hit = hit[keys[start:stop][hit] // 10 ** (width - i - k) % 10 ** k == value]
+                        mask[hit] = True
+                    yield rows[start:stop][mask]
+
+    def search(self, text, limit=20, branch=None, brand=None):
+        """
+        Кандидаты [(номер строки, вид совпадения)] по убыванию точности: точно, начало, конец,
+        середина; внутри вида - по возрастанию IMEI (у конца - перевернутого IMEI).
+        Не больше limit; branch/brand - фильтры.
+        """
+        text = (text or '').strip()
+        keep = self._filter(branch, brand)
+        if not text or keep is False or limit <= 0:
+            return []
+        if self.table.n - self.built > self.TAIL_ROWS:
+            self._build()
+        digits = text.isascii() and text.isdigit() and len(text) <= _DigitColumn.MAX_WIDTH
+        tail = self._tail_matches(text)
+        found = {}  # строка -> вид; порядок вставки - порядок выдачи
+        for kind in self.KINDS:
+            parts = self._digit_matches(text, kind) if digits else ()
+            # генератор: середина номера досматривается, только пока не набран limit
+            for part in itertools.chain(parts, [np.array(tail[kind], dtype=np.int64)]):
+                # большие диапазоны (начало '8') фильтруются кусками, пока не набран limit
+                for start in range(0, len(part), max(limit * 8, 1024)):
+                    rows = part[start:start + max(limit * 8, 1024)]
+                    if keep is not None:
+                        rows = rows[keep(rows)]
+                    for row in rows.tolist():
+                        found.setdefault(row, kind)
+                        if len(found) >= limit:
+                            return list(found.items())
+        return list(found.items())
+
+# ===================== Хранилище с индексами =====================
+PIVOT_START = '2000-01-01'  # с этой даты считается таблица бренд x состояние
+WARRANTY_DAYS = 1095  # гарантия 3 года с даты установки
+
+class EquipmentStore:
+    """
+    Владеет записями в столбцовом виде и поддерживает индексы:
+    IMEI -> номер строки, а для филиала, марки, статуса и состояния -
+    счетчики и списки строк по каждому значению.
+    Для графиков ведутся готовые счетчики: неисправные по филиалам
+    и устройства по бренду и состоянию (с PIVOT_START).
+    Порядок обхода - порядок вставки (или последней сортировки).
+    Обход и поиск отдают Equipment - представления строк.
+    """
+    INDEXED_FIELDS = ('branch', 'brand', 'status', 'condition')
+    AGGREGATE_FIELDS = frozenset(('branch', 'brand', 'status', 'condition', 'date'))
+    PIVOT_START_ORDINAL = date.fromisoformat(PIVOT_START).toordinal()
+
+    def __init__(self, equipments=None):
+        self.version = 0   # растет при любом изменении данных или порядка (ключ кэшей)
+        self._reset()
+        if equipments:
+            self.extend(equipments)
+
+    def _reset(self):
+        # новая таблица: представления старой продолжают видеть прежние данные
+        self._table = _EquipmentTable(owner=self)
+        self._order = None  # перестановка строк после сортировки; None - порядок вставки
+        self._by_imei = _ImeiIndex(self._table.cols['imei'])
+        # код значения -> array строк; строится при первом filter_by по полю.
+        # После правок в массиве бывают устаревшие строки, их число = len(массива) - счетчик,
+        # чистятся при чтении
+        self._buckets = {f: None for f in self.INDEXED_FIELDS}
+        self._counts = {f: {} for f in self.INDEXED_FIELDS}
+        # счетчики для графиков по кодам значений: филиал -> неисправных, (бренд, состояние) -> устройств
+        self._faulty_status = {}   # код статуса -> неисправен ли
+        self._faulty_by_branch = {}
+        self._brand_condition = {}
+        self._frame_cache = None
+        self._views = {}  # поля -> SortedView, строится при первом запросе
+        self._imei_search = None  # ImeiSearchIndex, строится при первом поиске по части IMEI
+        self._rollup = None  # RollupCube, строится при первом запросе динамики
+        self.version += 1
+
+    def __len__(self):
+        return self._table.n
+
+    def _rows(self):
+        return self._order if self._order is not None else range(self._table.n)
+
+    def __iter__(self):
+        table = self._table
+        return (Equipment._view(table, row) for row in self._rows())
+
+    def __contains__(self, imei):
+        return self._by_imei.get(imei_key(imei)) is not None
+
+    def _index_add(self, row):
+        cols = self._table.cols
+        for f in self.INDEXED_FIELDS:
+            code = cols[f].codes[row]
+            counts = self._counts[f]
+            counts[code] = counts.get(code, 0) + 1
+            buckets = self._buckets[f]
+            if buckets is not None:
+                bucket = buckets.get(code)
+                if bucket is None:
+                    buckets[code] = array('I', [row])
+                else:
+                    bucket.append(row)
+        self._aggregate(row, 1)
+
+    def _is_faulty(self, status_code):
+        faulty = self._faulty_status.get(status_code)
+        if faulty is None:
+            # как str.contains('неисправен') по статусу в нижнем регистре
+            status = self._table.cols['status'].values[status_code]
+            faulty = self._faulty_status[status_code] = 'неисправен' in str(status).lower()
+        return faulty
+
+    def _aggregate(self, row, sign):
+        """Учитывает строку в счетчиках графиков (sign=1) или снимает ее (sign=-1)."""
+        cols = self._table.cols
+        if self._is_faulty(cols['status'].codes[row]):
+            branch = cols['branch'].codes[row]
+            self._faulty_by_branch[branch] = self._faulty_by_branch.get(branch, 0) + sign
+        if self._table.dates[row] >= self.PIVOT_START_ORDINAL:
+            key = (cols['brand'].codes[row], cols['condition'].codes[row])
+            self._brand_condition[key] = self._brand_condition.get(key, 0) + sign
+        if self._rollup is not None:
+            self._rollup.add(row, sign)
+
+    def _append_values(self, values):
+        """Новая строка из кортежа значений (дата - ordinal). None - такой IMEI уже есть."""
+        slot = self._by_imei.slot_for(imei_key(values[1]))
+        if self._by_imei.slots[slot] >= 0:
+            return None
+        row = self._table.append(values)
+        self._by_imei.fill(slot, row)
+        self.version += 1
+        self._index_add(row)
+        if self._order is not None:
+            self._order.append(row)
+        for view in self._views.values():
+            view.insert(row)
+        return row
+
+    def add(self, eq):
+        """Добавляет запись. Возвращает False, если такой IMEI уже есть."""
+        row = self._append_values(eq._values())
+        if row is None:
+            return False
+        if eq._table is None:
+            # объект, созданный вручную, становится представлением своей строки
+            eq._table, eq._row = self._table, row
+        return True
+
+    def append_rows(self, rows):
+        """
+        Массовое добавление кортежей (branch, imei, brand, model, status, condition, location, ordinal)
+        без создания Equipment. Возвращает номера (по порядку в rows) пропущенных из-за повтора IMEI.
+        """
+        append = self._append_values
+        return [i for i, values in enumerate(rows) if append(values) is None]
+
+    def extend(self, equipments):
+        """Добавляет пачку записей, повторные IMEI пропускаются. Возвращает число пропущенных."""
+        skipped = 0
+        for eq in equipments:
+            if not self.add(eq):
+                skipped += 1
+        return skipped
+
+    def replace_all(self, equipments):
+        """Заменяет содержимое (загрузка из файла). Возвращает число пропущенных дублей."""
+        self._reset()
+        return self.extend(equipments)
+
+    def _row_of_imei(self, imei):
+        return self._by_imei.get(imei_key(imei))
+
+    def _row_of(self, eq):
+        if eq._table is self._table:
+            return eq._row
+        row = self._row_of_imei(eq.imei)
+        if row is None:
+            raise KeyError(eq.imei)
+        return row
+
+    def get(self, imei):
+        row = self._row_of_imei(imei)
+        return None if row is None else Equipment._view(self._table, row)
+
+    def find(self, imei, branch=None):
+        """Поиск по IMEI; если задан филиал - запись должна принадлежать ему."""
+        row = self._row_of_imei(imei)
+        if row is None or (branch and self._table.get(row, 'branch') != branch):
+            return None
+        return Equipment._view(self._table, row)
+
+    def _build_buckets(self, field):
+        buckets = {}
+        for row, code in enumerate(self._table.cols[field].codes):
+            bucket = buckets.get(code)
+            if bucket is None:
+                buckets[code] = array('I', [row])
+            else:
+                bucket.append(row)
+        self._buckets[field] = buckets
+        return buckets
+
+    def _bucket_rows(self, field, code):
+        buckets = self._buckets[field]
+        if buckets is None:
+            buckets = self._build_buckets(field)
+        bucket = buckets.get(code)
+        if bucket is None:
+            return []
+        if len(bucket) == self._counts[field].get(code, 0):
+            return bucket
+        codes = self._table.cols[field].codes
+        seen = set()
+        rows = array('I', (r for r in bucket if codes[r] == code and not (r in seen or seen.add(r))))
+        self._buckets[field][code] = rows
+        return rows
+
+    def filter_by(self, field, value):
+        """Записи с заданным значением индексированного поля (в порядке добавления/изменения)."""
+        code = self._table.cols[field].code_of.get(value)
+        if code is None:
+            return []
+        table = self._table
+        return [Equipment._view(table, row) for row in self._bucket_rows(field, code)]
+
+    def defective_counts(self):
+        """{филиал: число неисправных устройств} из готовых счетчиков."""
+        values = self._table.cols['branch'].values
+        return {values[code]: cnt for code, cnt in self._faulty_by_branch.items() if cnt}
+
+    def brand_condition_counts(self):
+        """{(бренд, состояние): число устройств с датой не раньше PIVOT_START} из готовых счетчиков."""
+        brands = self._table.cols['brand'].values
+        conditions = self._table.cols['condition'].values
+        return {(brands[b], conditions[c]): cnt for (b, c), cnt in self._brand_condition.items() if cnt}
+
+    def count_by(self, field):
+        """{значение: количество} по индексированному полю без обхода записей."""
+        values = self._table.cols[field].values
+        return {values[code]: cnt for code, cnt in self._counts[field].items() if cnt}
+
+    def update(self, eq, **fields):
+        """Меняет поля записи с поддержкой индексов. IMEI менять нельзя."""
+        if 'imei' in fields:
+            raise ValueError("IMEI нельзя изменить")
+        row = self._row_of(eq)
+        table = self._table
+        counted = not self.AGGREGATE_FIELDS.isdisjoint(fields)
+        self.version += 1
+        if self._frame_cache is not None:
+            self._frame_cache.dirty.add(row)
+        if counted:
+            self._aggregate(row, -1)
+        moved = [view for view in self._views.values() if not fields.keys().isdisjoint(view.fields)]
+        for view in moved:
+            view.remove(row)
+        for name, value in fields.items():
+            if name not in self.INDEXED_FIELDS:
+                table.set(row, name, value)
+                continue
+            codes = table.cols[name].codes
+            old = codes[row]
+            table.set(row, name, value)
+            new = codes[row]
+            if new != old:
+                counts = self._counts[name]
+                counts[old] -= 1
+                counts[new] = counts.get(new, 0) + 1
+                buckets = self._buckets[name]
+                if buckets is None:
+                    continue
+                bucket = buckets.get(new)
+                if bucket is None:
+                    bucket = buckets[new] = array('I')
+                bucket.append(row)
+                if len(bucket) > 2 * counts[new] + 64:
+                    self._bucket_rows(name, new)
+        if counted:
+            self._aggregate(row, 1)
+        for view in moved:
+            view.insert(row)
+
+    def upsert(self, eq):
+        """Добавляет запись или переносит ее поля в уже существующую с тем же IMEI."""
+        if eq.imei not in self:
+            self.add(eq)
+            return
+        fields = eq.to_dict()
+        del fields['imei'], fields['date']
+        self.update(eq if eq._table is self._table else self.get(eq.imei), date=eq.date, **fields)
+
+    def match(self, text, fields=EQUIPMENT_FIELDS):
+        """
+        Маска строк (numpy bool по номеру строки), где хотя бы одно из полей подходит под text:
+        категории - подстрока, IMEI и модель - начало, дата - 'YYYY', 'YYYY-MM' или 'YYYY-MM-DD'.
+        Считается по столбцам векторно, без строк на каждую запись.
+        """
+        table = self._table
+        text = (text or '').strip().lower()
+        mask = np.zeros(table.n, dtype=bool)
+        for name in fields:
+            if name in CATEGORY_FIELDS:
+                col = table.cols[name]
+                hit = np.array([text in str(v) for v in col.values], dtype=bool)
+                if hit.any():
+                    mask |= hit[np.array(col.codes, dtype=np.int64)]
+            elif name in DIGIT_FIELDS:
+                mask |= self._digit_prefix_mask(table.cols[name], text)
+            elif name == 'date':
+                bounds = _date_prefix_bounds(text)
+                if bounds:
+                    dates = np.array(table.dates, dtype=np.int64)
+                    mask |= (dates >= bounds[0]) & (dates < bounds[1])
+        return mask
+
+    @staticmethod
+    def _digit_prefix_mask(col, text):
+        nums = np.array(col.nums, dtype=np.int64)
+        widths = np.array(col.widths, dtype=np.int8)
+        mask = np.zeros(len(nums), dtype=bool)
+        if text.isascii() and text.isdigit() and len(text) <= col.MAX_WIDTH:
+            # начало строки из w цифр (с ведущими нулями) - это число // 10**(w - len(text))
+            prefix = int(text)
+            for width in range(len(text), col.MAX_WIDTH + 1):
+                mask |= (widths == width) & (nums // 10 ** (width - len(text)) == prefix)
+        for row in np.flatnonzero(widths < 0):
+            mask[row] = str(col.extra[nums[row]]).startswith(text)
+        return mask
+
+    def row_numbers(self, offset=0, limit=None):
+        """Номера строк в порядке обхода; страница [offset, offset+limit) без копирования всего порядка."""
+        rows = self._rows()
+        stop = len(rows) if limit is None else min(len(rows), offset + limit)
+        return rows[offset:stop]
+
+    def row(self, row):
+        """Запись по номеру строки (из row_numbers или SortedView)."""
+        return Equipment._view(self._table, row)
+
+    def sorted_view(self, *fields):
+        """Поддерживаемый порядок строк по полям, например sorted_view('branch', 'date')."""
+        view = self._views.get(fields)
+        if view is None:
+            view = self._views[fields] = SortedView(self._table, fields)
+        return view
+
+    def imei_candidates(self, text, limit=20, branch=None, brand=None):
+        """Поиск по части IMEI (начало, конец, середина): [(Equipment, вид совпадения)], лучшие первыми."""
+        index = self._imei_search
+        if index is None or index.table is not self._table:
+            index = self._imei_search = ImeiSearchIndex(self._table)
+        table = self._table
+        return [(Equipment._view(table, row), kind) for row, kind in index.search(text, limit, branch, brand)]
+
+    def warranty(self, days=WARRANTY_DAYS):
+        """Запросы по окончанию гарантии (см. WarrantyIndex)."""
+        return WarrantyIndex(self, days)
+
+    def rollup(self):
+        """Сводка по месяцам (см. RollupCube); после построения поддерживается при изменениях."""
+        if self._rollup is None or self._rollup.table is not self._table:
+            self._rollup = RollupCube(self._table)
+        return self._rollup
+
+    def sort_by(self, field, descending=False):
+        """
+        Переупорядочивает обход записей по готовому SortedView (без пересортировки);
+        строки и индексы остаются на месте. field - имя поля или кортеж полей.
+        """
+        fields = (field,) if isinstance(field, str) else tuple(field)
+        if not fields or any(f not in SortedView.FIELDS for f in fields):
+            return
+        view = self.sorted_view(*fields)
+        self._order = array('I', view.iter_rows(descending)) if descending else array('I', view.rows)
+        self.version += 1
+
+    def iter_tuples(self):
+        """Кортежи строковых значений в порядке EQUIPMENT_FIELDS - для записи без dict на строку."""
+        return self._table.iter_tuples(self._rows())
+
+    def columns(self, fields=EQUIPMENT_FIELDS):
+        """{поле: список значений} в порядке обхода; дата - строкой 'YYYY-MM-DD' или ''."""
+        rows = self._rows()
+        out = {}
+        for name in fields:
+            values = self._table.column(name, rows)
+            out[name] = [ordinal_to_str(v) for v in values] if name == 'date' else values
+        return out
+
+    def frame(self):
+        """
+        Типизированный DataFrame в порядке обхода (категории, дата - datetime64, индекс - номер строки).
+        Кэшируется по version и при изменениях пересчитывает только новые и измененные строки.
+        Общий для всех отчетов - не изменять.
+        """
+        cache = self._frame_cache
+        if cache is None:
+            cache = self._frame_cache = _FrameCache(self._table)
+        if cache.version != self.version:
+            cache.sync()
+            cache.frame = cache.build(self._order)
+            cache.version = self.version
+        return cache.frame
+
+    def snapshot(self):
+        """Копия столбцов (memcpy массивов), которую можно писать из другого потока."""
+        order = array('I', self._order) if self._order is not None else None
+        return EquipmentSnapshot(self._table.copy(), order, array('i', self._by_imei.slots))
+
+    def adopt(self, table, order, index):
+        """Принимает готовые столбцы и индекс IMEI (из бинарного снимка) без построчного разбора."""
+        self._reset()
+        table.owner = self
+        self._table = table
+        self._order = order
+        self._by_imei = index
+        self.version += 1
+        for f in self.INDEXED_FIELDS:
+            self._counts[f] = dict(Counter(table.cols[f].codes))
+        cols = table.cols
+        faulty = {code for code in self._counts['status'] if self._is_faulty(code)}
+        self._faulty_by_branch = dict(Counter(
+            b for b, st in zip(cols['branch'].codes, cols['status'].codes) if st in faulty))
+        start = self.PIVOT_START_ORDINAL
+        self._brand_condition = dict(Counter(
+            (b, c) for b, c, d in zip(cols['brand'].codes, cols['condition'].codes, table.dates) if d >= start))
+
+    def frozen_copy(self):
+        """
+        Независимая копия для чтения в другом потоке (данные графиков): столбцы и индекс IMEI -
+        memcpy массивов, готовые счетчики и сводка по месяцам копируются, а не пересчитываются.
+        """
+        snap = self.snapshot()
+        copy = EquipmentStore()
+        snap.table.owner = copy
+        copy._table = snap.table
+        copy._order = snap.order
+        copy._by_imei = _ImeiIndex.from_slots(snap.table.cols['imei'], snap.index_slots, self._by_imei.used)
+        copy._counts = {f: dict(counts) for f, counts in self._counts.items()}
+        copy._faulty_status = dict(self._faulty_status)
+        copy._faulty_by_branch = dict(self._faulty_by_branch)
+        copy._brand_condition = dict(self._brand_condition)
+        if self._rollup is not None and self._rollup.table is self._table:
+            copy._rollup = self._rollup.copy(snap.table)
+        copy.version = self.version
+        return copy
+
+    def to_list(self):
+        return list(self)
+
+# ===================== Гарантия =====================
+def warranty_status(ordinal, today=None, days=WARRANTY_DAYS):
+    """Текст статуса гарантии для даты (номер дня; 0 - неизвестна)."""
+    if not ordinal:
+        return "Дата неизвестна."
+    today = today or date.today().toordinal()
+    return "Гарантия завершена." if today - ordinal >= days else "На гарантии."
+
+class WarrantyIndex:
+    """
+    Запросы по окончанию гарантии без обхода всего парка. Конец гарантии = дата + days,
+    поэтому упорядоченный по дате SortedView (с фильтрующими полями впереди, например
+    ('condition', 'date')) и есть индекс по окончанию: ответ - один срез между двумя bisect.
+    """
+    FILTER_FIELDS = ('branch', 'brand', 'status', 'condition', 'location')
+
+    def __init__(self, store, days=WARRANTY_DAYS):
+        self.store = store
+        self.days = days
+
+    def _rows(self, first_date, end_date, filters):
+        """Строки с датой в [first_date, end_date) и заданными значениями полей (в порядке окончания)."""
+        unknown = [f for f in filters if f not in self.FILTER_FIELDS]
+        if unknown:
+            raise ValueError(f"Фильтр по полям {unknown} не поддерживается")
+        fields = tuple(f for f in self.FILTER_FIELDS if filters.get(f) is not None)
+        prefix = tuple(filters[f] for f in fields)
+        view = self.store.sorted_view(*fields, 'date')
+        first_date = max(first_date, 1)  # 0 - дата неизвестна, такие строки в запросы не входят
+        if end_date <= first_date:
+            return array('I')
+        lo = bisect.bisect_left(view.rows, prefix + (first_date, -1), key=view.key)
+        hi = bisect.bisect_left(view.rows, prefix + (end_date, -1), key=view.key)
+        return view.rows[lo:hi]
+
+    def expiring(self, within_days, today=None, **filters):
+        """Номера строк, у которых гарантия закончится в ближайшие within_days дней (today не входит)."""
+        today = today or date.today().toordinal()
+        return self._rows(today - self.days + 1, today - self.days + within_days + 1, filters)
+
+    def expired(self, today=None, **filters):
+        """Номера строк с завершенной гарантией, например expired(condition='установлен')."""
+        today = today or date.today().toordinal()
+        return self._rows(1, today - self.days + 1, filters)
+
+    def active(self, today=None, **filters):
+        today = today or date.today().toordinal()
+        return self._rows(today - self.days + 1, date.max.toordinal() + 1, filters)
+
+    SUMMARY_COLUMNS = ('на гарантии', 'истекает', 'завершена', 'завершена, установлено', 'дата неизвестна')
+
+    def summary(self, within_days=30, today=None):
+        """
+        Сводка по филиалам одним векторным проходом (bincount по кодам филиала):
+        на гарантии, истекает за within_days дней, завершена, завершена при состоянии 'установлен',
+        дата неизвестна.
+        """
+        table = self.store._table
+        left = self.days_left(today)
+        branches = np.array(table.cols['branch'].codes, dtype=np.int64)
+        installed_code = table.cols['condition'].code_of.get('установлен', -1)
+        installed = np.array(table.cols['condition'].codes, dtype=np.int64) == installed_code
+        with np.errstate(invalid='ignore'):
+            active = left > 0
+            ended = left <= 0
+            masks = (active, active & (left <= within_days), ended, ended & installed, np.isnan(left))
+        values = table.cols['branch'].values
+        counts = {name: np.bincount(branches[mask], minlength=len(values))
+                  for name, mask in zip(self.SUMMARY_COLUMNS, masks)}
+        frame = pd.DataFrame(counts, index=pd.Index(values, name='branch'))
+        return frame[frame.sum(axis=1) > 0].sort_index()
+
+    def days_left(self, today=None):
+        """Векторно по всем строкам: дней до конца гарантии (<= 0 - завершена), NaN - дата неизвестна."""
+        today = today or date.today().toordinal()
+        dates = np.array(self.store._table.dates, dtype=np.float64)
+        left = dates + self.days - today
+        left[dates == 0] = np.nan
+        return left
+
+# ===================== Сводка по месяцам =====================
+def month_number(value):
+    """'YYYY-MM', 'YYYY-MM-DD' или date -> номер месяца от 1970-01 (для RollupCube)."""
+    if isinstance(value, str):
+        year, month = value[:7].split('-')
+        value = date(int(year), int(month), 1)
+    return (value.year - 1970) * 12 + value.month - 1
+
+def month_label(number):
+    year, month = divmod(number, 12)
+    return f"{year + 1970:04d}-{month + 1:02d}"
+
+class RollupCube:
+    """
+    Число устройств по месяцу даты установки, филиалу, бренду, состоянию и статусу:
+    плотный массив int32 (месяц x коды значений полей). Строится одним векторным проходом
+    (bincount по составному индексу), дальше хранилище правит его по строке при добавлении
+    и изменении (EquipmentStore._aggregate). Устройства без даты в куб не входят.
+    """
+    FIELDS = ('branch', 'brand', 'condition', 'status')
+
+    def __init__(self, table):
+        self.table = table
+        cols = table.cols
+        dates = np.array(table.dates, dtype=np.int64)
+        known = dates > 0
+        months = (dates[known] - _ORDINAL_1970).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        self.first = int(months.min()) if len(months) else month_number(date.today())
+        size = int(months.max()) - self.first + 1 if len(months) else 1
+        shape = (size,) + tuple(max(len(cols[f].values), 1) for f in self.FIELDS)
+        codes = [np.array(cols[f].codes, dtype=np.int64)[known] for f in self.FIELDS]
+        flat = np.ravel_multi_index((months - self.first, *codes), shape)
+        self.counts = np.bincount(flat, minlength=math.prod(shape)).astype(np.int32).reshape(shape)
+        self.undated = int(len(dates) - known.sum())
+
+    def copy(self, table):
+        """Тот же куб для копии таблицы (EquipmentStore.frozen_copy)."""
+        cube = RollupCube.__new__(RollupCube)
+        cube.table = table
+        cube.first = self.first
+        cube.counts = self.counts.copy()
+        cube.undated = self.undated
+        return cube
+
+    def _grow(self, index):
+        """Расширяет массив под новый месяц или новое значение поля."""
+        before = [max(-index[0], 0)] + [0] * len(self.FIELDS)
+        after = [max(i - n + 1, 0) for i, n in zip(index, self.counts.shape)]
+        self.counts = np.pad(self.counts, list(zip(before, after)))
+        self.first -= before[0]
+
+    def add(self, row, sign):
+        """Учитывает строку (sign=1) или снимает ее (sign=-1)."""
+        ordinal = self.table.dates[row]
+        if not ordinal:
+            self.undated += sign
+            return
+        cols = self.table.cols
+        month = month_number(date.fromordinal(ordinal))
+        index = (month - self.first,) + tuple(cols[f].codes[row] for f in self.FIELDS)
+        if index[0] < 0 or any(i >= n for i, n in zip(index, self.counts.shape)):
+            self._grow(index)
+            index = (month - self.first,) + index[1:]
+        self.counts[index] += sign
+
+    def months(self):
+        """(первый, последний + 1) номер месяца, в котором есть устройства."""
+        filled = np.flatnonzero(self.counts.reshape(len(self.counts), -1).any(axis=1))
+        if not len(filled):
+            return self.first, self.first
+        return self.first + int(filled[0]), self.first + int(filled[-1]) + 1
+
+    def series(self, by=None, start=None, end=None, **filters):
+        """
+        Ряды по месяцам [start, end) ('YYYY-MM'; по умолчанию - все месяцы с данными):
+        DataFrame, строки - месяцы (datetime64), столбцы - значения поля by (без by - 'count').
+        Фильтры - значение или список значений поля, например series('branch', status='неисправен').
+        """
+        if by is not None and by not in self.FIELDS:
+            raise ValueError(f"Группировка по полю '{by}' не поддерживается")
+        unknown = [f for f in filters if f not in self.FIELDS]
+        if unknown:
+            raise ValueError(f"Фильтр по полям {unknown} не поддерживается")
+        lo, hi = self.months()
+        lo = month_number(start) if start else lo
+        hi = month_number(end) if end else hi
+        cube = self.counts[max(lo - self.first, 0):max(hi - self.first, 0)]
+        kept = {}   # поле -> коды, оставленные фильтром (по ним и подписи столбцов, если by - это поле)
+        for axis, name in enumerate(self.FIELDS, 1):
+            wanted = filters.get(name)
+            if wanted is None:
+                continue
+            code_of = self.table.cols[name].code_of
+            wanted = [wanted] if isinstance(wanted, str) else wanted
+            # значение без строк с датой еще не расширило куб - его и считать нечего
+            kept[name] = [code_of[v] for v in wanted if v in code_of and code_of[v] < cube.shape[axis]]
+            cube = cube.take(kept[name], axis=axis)
+        keep = (0,) if by is None else (0, self.FIELDS.index(by) + 1)
+        counts = cube.sum(axis=tuple(a for a in range(cube.ndim) if a not in keep), dtype=np.int64)
+        if counts.ndim == 1:
+            counts = counts[:, None]
+        # месяцы без данных до и после куба - нулями, чтобы ось времени была сплошной
+        rows = np.zeros((max(hi - lo, 0), counts.shape[1]), dtype=np.int64)
+        offset = max(self.first - lo, 0)
+        rows[offset:offset + len(counts)] = counts[:len(rows) - offset]
+        index = pd.DatetimeIndex(np.arange(lo, lo + len(rows)).astype('datetime64[M]'), name='month')
+        if by is None:
+            return pd.DataFrame({'count': rows[:, 0]}, index=index)
+        values = self.table.cols[by].values
+        if by in kept:
+            values = [values[code] for code in kept[by]]
+        else:
+            values = values[:rows.shape[1]]  # у пустой таблицы в массиве есть столбец без значения
+        frame = pd.DataFrame(rows[:, :len(values)], index=index, columns=pd.Index(values, name=by))
+        return frame.loc[:, frame.sum() > 0]
+
+# ===================== Сохранение и загрузка файлов =====================
+def _iter_tuples(data):
+    """Строки данных кортежами в порядке EQUIPMENT_FIELDS: у хранилища - прямо из столбцов."""
+    if hasattr(data, 'iter_tuples'):
+        return data.iter_tuples()
+    return (item.to_tuple() for item in data)
+
+def _replace_atomically(tmp_name, filename):
+    """Сбрасывает временный файл на диск и подменяет им целевой (старый файл цел до rename)."""
+    with open(tmp_name, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_name, filename)
+
+@timed('write_csv', rows=0)
+def write_csv(data, filename='equipment_data.csv'):
+    """Как save_to_csv, но ошибки не гасит (для фоновой записи)."""
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'w', newline='', encoding='utf-8-sig') as f:
+        if len(data):
+            writer = csv.writer(f)
+            writer.writerow(EQUIPMENT_FIELDS)
+            writer.writerows(_iter_tuples(data))
+    _replace_atomically(tmp_name, filename)
+
+def save_to_csv(data, filename='equipment_data.csv'):
+    try:
+        write_csv(data, filename)
+        return True
+    except Exception as e:
+        print(f"Ошибка при сохранении в CSV: {e}")
+        return False
+
+@timed('load_from_csv', rows='result')
+def load_from_csv(filename='equipment_data.csv'):
+    report = LoadReport(filename)
+    return _collect(iter_csv(filename, report=report), report)
+
+@timed('write_json', rows=0)
+def write_json(data, filename='equipment_data.json'):
+    """Как save_to_json, но ошибки не гасит (для фоновой записи)."""
+    tmp_name = filename + '.tmp'
+    # тот же текст, что у json.dump(список словарей, indent=4, ensure_ascii=False),
+    # но по шаблону: без словаря на запись и без медленного кодировщика с отступами
+    template = '{\n' + ',\n'.join(f'        "{k}": %s' for k in EQUIPMENT_FIELDS) + '\n    }'
+    quote = json.encoder.encode_basestring
+    with open(tmp_name, 'w', encoding='utf-8') as f:
+        first = True
+        for values in _iter_tuples(data):
+            f.write('[\n    ' if first else ',\n    ')
+            f.write(template % tuple(map(quote, values)))
+            first = False
+        f.write('[]' if first else '\n]')
+    _replace_atomically(tmp_name, filename)
+
+def save_to_json(data, filename='equipment_data.json'):
+    try:
+        write_json(data, filename)
+        return True
+    except Exception as e:
+        print(f"Ошибка при сохранении в JSON: {e}")
+        return False
+
+@timed('load_from_json', rows='result')
+def load_from_json(filename='equipment_data.json'):
+    report = LoadReport(filename)
+    return _collect(iter_json(filename, report=report), report)
+
+@timed('write_jsonl', rows=0)
+def write_jsonl(data, filename='equipment_data.jsonl'):
+    """JSON Lines: одна запись на строку, читается построчно и дописывается без перезаписи."""
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'w', encoding='utf-8') as f:
+        for values in _iter_tuples(data):
+            f.write(json.dumps(dict(zip(EQUIPMENT_FIELDS, values)), ensure_ascii=False))
+            f.write('\n')
+    _replace_atomically(tmp_name, filename)
+
+
+@timed('load_from_jsonl', rows='result')
+def load_from_jsonl(filename='equipment_data.jsonl'):
+    report = LoadReport(filename)
+    return _collect(iter_jsonl(filename, report=report), report)
+
+# ===================== Потоковая загрузка =====================
+
+LOAD_CHUNK_ROWS = 5000         # записей в одной порции загрузчика
+LOAD_POLL_MS = 50              # как часто окно проверяет чтение в фоновом потоке
+JSON_READ_SIZE = 1 << 16       # символов, читаемых из файла за раз
+JSON_MAX_RECORD_CHARS = 1 << 20  # больше этого одна запись быть не может - значит, файл испорчен
+JSON_TAIL_CHARS = 16           # ошибка разбора ближе к концу окна - запись могла просто не дочитаться
+
+class LoadReport:
+    """Итог потоковой загрузки: сколько записей прочитано, сколько и каких пропущено."""
+    MAX_SAMPLES = 20
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = 0
+        self.bad = 0
+        self.samples = []     # первые MAX_SAMPLES пропущенных: (где, причина)
+        self.error = None     # ошибка, из-за которой файл не дочитан
+
+    def add_bad(self, where, reason):
+        self.bad += 1
+        if len(self.samples) < self.MAX_SAMPLES:
+            self.samples.append((where, str(reason)))
+
+    def summary(self):
+        lines = [f"{self.filename}: загружено {self.rows}, пропущено {self.bad}"]
+        lines += [f"  {where}: {reason}" for where, reason in self.samples]
+        if self.bad > len(self.samples):
+            lines.append(f"  ... и еще {self.bad - len(self.samples)}")
+        if self.error:
+            lines.append(f"  файл прочитан не полностью: {self.error}")
+        return '\n'.join(lines)
+
+def _record_to_equipment(rec):
+    if not isinstance(rec, dict):
+        raise ValueError("запись не является объектом")
+    for k in EQUIPMENT_FIELDS:
+        v = rec.get(k)
+        if v is None or isinstance(v, (dict, list)):
+            raise ValueError(f"нет поля '{k}'")
+    return Equipment.from_dict({k: str(rec[k]) for k in EQUIPMENT_FIELDS})
+
+def _equipment_chunks(records, chunk_size, report):
+    """(место, запись или исключение) -> порции Equipment; плохие записи уходят в отчет."""
+    chunk = []
+    for where, rec in records:
+        if isinstance(rec, Exception):
+            report.add_bad(where, rec)
+            continue
+        try:
+            chunk.append(_record_to_equipment(rec))
+        except Exception as e:
+            report.add_bad(where, e)
+            continue
+        report.rows += 1
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _guarded(records, report, what):
+    """Ошибку чтения файла фиксирует в отчете вместо исключения; прочитанное до нее остается."""
+    try:
+        yield from records
+    except Exception as e:
+        report.error = str(e)
+        print(f"Ошибка при чтении {what}: {e}")
+
+def _collect(chunks, report):
+    equipments = []
+    for chunk in chunks:
+        equipments.extend(chunk)
+    if report.bad:
+        print(report.summary())
+    return equipments
+
+def _csv_records(filename):
+    with open(filename, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield f"строка {reader.line_num}", row
+
+def _jsonl_records(filename):
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield f"строка {line_no}", json.loads(line)
+            except ValueError as e:
+                yield f"строка {line_no}", e
+
+def _json_array_records(filename, read_size=JSON_READ_SIZE):
+    """
+    Разбирает массив JSON по одному элементу, держа в памяти только окно файла.
+    Испорченный элемент пропускается: разбор продолжается со следующей '{'.
+    Если файл оборван (нет ']'), прочитанные элементы остаются, а чтение заканчивается ошибкой.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        buf, pos, eof = '', 0, False
+        started = False
+        index = 0
+        while True:
+            # пробелы и разделители; при нехватке данных - дочитываем
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                chunk = f.read(read_size)
+                buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            if pos >= len(buf):
+                if not started:
+                    raise ValueError("файл пуст")
+                raise ValueError("неожиданный конец файла (нет ']')")
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("ожидался массив JSON")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                # дочитываем, только если запись могла оборваться на краю окна; ошибка в ее
+                # середине - порча, и окно не растет до JSON_MAX_RECORD_CHARS на каждой такой записи
+                cut = e.pos >= len(buf) - JSON_TAIL_CHARS or e.msg.startswith('Unterminated string')
+                if cut and not eof and len(buf) - pos < JSON_MAX_RECORD_CHARS:
+                    chunk = f.read(read_size)
+                    buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+                    continue
+                if eof and not buf.rstrip().endswith(']'):
+                    raise ValueError(f"неожиданный конец файла (элемент {index} оборван)")
+                # запись испорчена: сообщаем и ищем начало следующей
+                yield f"элемент {index}", e
+                index += 1
+                nxt = buf.find('{', pos + 1)
+                tail = buf
+                while nxt < 0 and not eof:
+                    buf = f.read(read_size)
+                    eof = not buf
+                    tail = tail[-JSON_TAIL_CHARS:] + buf
+                    nxt = buf.find('{')
+                if nxt < 0:
+                    if not tail.rstrip().endswith(']'):
+                        raise ValueError("неожиданный конец файла (нет ']')")
+                    return
+                pos = nxt
+                continue
+            yield f"элемент {index}", obj
+            index += 1
+            pos = end
+
+def iter_csv(filename='equipment_data.csv', chunk_size=LOAD_CHUNK_ROWS, report=None):
+    """Генератор порций Equipment из CSV с ограниченным расходом памяти."""
+    report = report if report is not None else LoadReport(filename)
+    return _equipment_chunks(_guarded(_csv_records(filename), report, 'CSV'), chunk_size, report)
+
+def iter_json(filename='equipment_data.json', chunk_size=LOAD_CHUNK_ROWS, report=None):
+    """Генератор порций Equipment из массива JSON без чтения файла целиком."""
+    report = report if report is not None else LoadReport(filename)
+    return _equipment_chunks(_guarded(_json_array_records(filename), report, 'JSON'), chunk_size, report)
+
+def iter_jsonl(filename='equipment_data.jsonl', chunk_size=LOAD_CHUNK_ROWS, report=None):
+    """Генератор порций Equipment из JSON Lines."""
+    report = report if report is not None else LoadReport(filename)
+    return _equipment_chunks(_guarded(_jsonl_records(filename), report, 'JSON Lines'), chunk_size, report)
+
+# ===================== Бинарный снимок =====================
+
+SNAPSHOT_FILE = 'equipment_data.rtk'
+SNAPSHOT_MAGIC = b'RTKSNAP\0'
+SNAPSHOT_VERSION = 2
+_SNAP_BOM = 0x01020304          # по нему видно, в каком порядке байт записаны массивы
+_SNAP_HEADER = struct.Struct('<8sIIQII')     # magic, версия, BOM, записей, секций, CRC32
+_SNAP_HEADER_V1 = struct.Struct('<8sIIQI')   # версия 1 - без контрольной суммы, читается как есть
+_SNAP_SECTION = struct.Struct('<16sQQ')      # имя, смещение, длина
+_SNAP_ALIGN = 8
+
+def _snapshot_sections(snap):
+    """(имя, байты) секций файла: словари строк, столбцы, порядок обхода и таблица индекса IMEI."""
+    table = snap.table
+    strings = []
+    meta = {'version': SNAPSHOT_VERSION, 'ranges': {}}
+    for name in CATEGORY_FIELDS:
+        meta['ranges'][name] = [len(strings), len(table.cols[name].values)]
+        strings.extend(table.cols[name].values)
+    for name in DIGIT_FIELDS:
+        meta['ranges'][name + '.extra'] = [len(strings), len(table.cols[name].extra)]
+        strings.extend(table.cols[name].extra)
+    blob = [str(v).encode('utf-8', 'surrogatepass') for v in strings]
+    offsets = array('Q', [0])
+    for b in blob:
+        offsets.append(offsets[-1] + len(b))
+    meta['has_order'] = snap.order is not None
+
+    sections = [('meta', json.dumps(meta, ensure_ascii=False).encode('utf-8')),
+                ('strings.offsets', offsets.tobytes()),
+                ('strings.blob', b''.join(blob))]
+    for name in CATEGORY_FIELDS:
+        sections.append((name + '.codes', table.cols[name].codes.tobytes()))
+    for name in DIGIT_FIELDS:
+        sections.append((name + '.nums', table.cols[name].nums.tobytes()))
+        sections.append((name + '.widths', table.cols[name].widths.tobytes()))
+    sections.append(('dates', table.dates.tobytes()))
+    if snap.order is not None:
+        sections.append(('order', snap.order.tobytes()))
+    sections.append(('imei.index', snap.index_slots.tobytes()))
+    return sections
+
+@timed('write_snapshot', rows=0)
+def write_snapshot(data, filename=SNAPSHOT_FILE):
+    """
+    Бинарный снимок: заголовок, таблица секций и выровненные секции.
+    Каждое поле лежит отдельным массивом фиксированной ширины, поэтому запись i
+    находится по смещению i * ширина в каждой секции, а хранилище принимает
+    массивы целиком (frombytes), без разбора строк.
+    """
+    if isinstance(data, EquipmentStore):
+        data = data.snapshot()
+    elif not isinstance(data, EquipmentSnapshot):
+        data = EquipmentStore(data).snapshot()
+    _write_snapshot_file(data, filename)
+
+def _write_snapshot_file(data, filename):
+    sections = _snapshot_sections(data)
+
+    pos = _SNAP_HEADER.size + _SNAP_SECTION.size * len(sections)
+    layout = []
+    for name, payload in sections:
+        pos = (pos + _SNAP_ALIGN - 1) // _SNAP_ALIGN * _SNAP_ALIGN
+        layout.append((name, pos, len(payload)))
+        pos += len(payload)
+
+    # CRC32 таблицы секций и самих секций (без выравнивания) - так видна обрезка и порча файла
+    section_table = b''.join(_SNAP_SECTION.pack(name.encode('ascii'), offset, length)
+                             for name, offset, length in layout)
+    crc = zlib.crc32(section_table)
+    for _, payload in sections:
+        crc = zlib.crc32(payload, crc)
+
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        f.write(_SNAP_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, _SNAP_BOM, data.table.n, len(sections), crc))
+        f.write(section_table)
+        for (name, payload), (_, offset, _) in zip(sections, layout):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(payload)
+    _replace_atomically(tmp_name, filename)
+
+def save_to_snapshot(data, filename=SNAPSHOT_FILE):
+    try:
+        write_snapshot(data, filename)
+        return True
+    except Exception as e:
+        print(f"Ошибка при сохранении бинарного снимка: {e}")
+        return False
+
+class SnapshotFile:
+    """
+    Бинарный снимок, открытый через mmap. Поиск по IMEI идет по готовой таблице индекса,
+    обход и подсчеты - по массивам прямо в отображенном файле, без загрузки всего снимка.
+    При открытии проверяются заголовок и границы секций (обрезанный файл не откроется),
+    контрольная сумма всего файла - в verify() перед полной загрузкой.
+    """
+    _FORMATS = {'codes': 'I', 'nums': 'q', 'widths': 'b', 'dates': 'i', 'order': 'I',
+                'index': 'i', 'offsets': 'Q'}
+    _ROW_ARRAYS = ('codes', 'nums', 'widths', 'dates', 'order')   # по элементу на запись
+
+    def __init__(self, filename=SNAPSHOT_FILE):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self):
+        mm = self._mm
+        size = len(mm)
+        if size < _SNAP_HEADER_V1.size:
+            raise ValueError(f"{self.filename}: файл снимка обрезан")
+        magic, version = struct.unpack_from('<8sI', mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{self.filename}: это не бинарный снимок")
+        if version not in (1, SNAPSHOT_VERSION):
+            raise ValueError(f"{self.filename}: неподдерживаемая версия снимка {version}")
+        header = _SNAP_HEADER if version == SNAPSHOT_VERSION else _SNAP_HEADER_V1
+        if size < header.size:
+            raise ValueError(f"{self.filename}: файл снимка обрезан")
+        _, _, bom, self.n, count, *crc = header.unpack_from(mm, 0)
+        if bom != _SNAP_BOM:
+            raise ValueError(f"{self.filename}: снимок записан с другим порядком байт")
+        self._crc = crc[0] if crc else None
+        self._table_span = (header.size, header.size + count * _SNAP_SECTION.size)
+        if self._table_span[1] > size:
+            raise ValueError(f"{self.filename}: файл снимка обрезан")
+        self._sections = {}
+        for i in range(count):
+            name, offset, length = _SNAP_SECTION.unpack_from(mm, header.size + i * _SNAP_SECTION.size)
+            if offset + length > size:
+                raise ValueError(f"{self.filename}: файл снимка обрезан")
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+        self._view = memoryview(mm)
+        self._views = {}
+        self.meta = json.loads(bytes(self._bytes('meta')))
+        self._check_sections()
+        self._offsets = self._array_view('strings.offsets')
+        # словари категорий маленькие - раскрываем сразу, дополнительные строки IMEI/модели - по запросу
+        self._values = {name: self._strings(*self.meta['ranges'][name]) for name in CATEGORY_FIELDS}
+        self._extra = {}
+        self._index = self._array_view('imei.index')
+        self._mask = len(self._index) - 1
+
+    def _check_sections(self):
+        """Все секции на месте и массивы записей длиной ровно в n элементов."""
+        needed = ['strings.offsets', 'strings.blob', 'dates', 'imei.index']
+        needed += [name + '.codes' for name in CATEGORY_FIELDS]
+        needed += [name + suffix for name in DIGIT_FIELDS for suffix in ('.nums', '.widths')]
+        if self.meta['has_order']:
+            needed.append('order')
+        missing = [name for name in needed if name not in self._sections]
+        if missing:
+            raise ValueError(f"{self.filename}: в снимке нет секций {', '.join(missing)}")
+        for name in needed:
+            kind = name.rsplit('.', 1)[-1]
+            if kind in self._ROW_ARRAYS and \
+                    self._sections[name][1] != self.n * array(self._FORMATS[kind]).itemsize:
+                raise ValueError(f"{self.filename}: длина секции {name} не совпадает с числом записей")
+
+    def verify(self):
+        """Сверяет CRC32 таблицы секций и секций с заголовком (читает весь файл). Снимок версии 1 - без проверки."""
+        if self._crc is None:
+            return
+        start, end = self._table_span
+        crc = zlib.crc32(self._view[start:end])
+        for offset, length in sorted(self._sections.values()):
+            crc = zlib.crc32(self._view[offset:offset + length], crc)
+        if crc != self._crc:
+            raise ValueError(f"{self.filename}: снимок поврежден (контрольная сумма не совпадает)")
+
+    def _bytes(self, name):
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length]
+
+    def _array_view(self, name):
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = self._bytes(name).cast(self._FORMATS[name.rsplit('.', 1)[-1]])
+        return view
+
+    def _string(self, i):
+        blob_offset = self._sections['strings.blob'][0]
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return bytes(self._view[blob_offset + start:blob_offset + end]).decode('utf-8', 'surrogatepass')
+
+    def _strings(self, start, count):
+        return [self._string(i) for i in range(start, start + count)]
+
+    def _extra_strings(self, name):
+        if name not in self._extra:
+            self._extra[name] = self._strings(*self.meta['ranges'][name + '.extra'])
+        return self._extra[name]
+
+    def close(self):
+        # mmap не закрыть, пока на него есть memoryview
+        for view in getattr(self, '_views', {}).values():
+            view.release()
+        self._views = {}
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.n
+
+    def _rows(self):
+        if self.meta['has_order']:
+            return self._array_view('order')
+        return range(self.n)
+
+    def _digit(self, name, row):
+        width = self._array_view(name + '.widths')[row]
+        num = self._array_view(name + '.nums')[row]
+        if width < 0:
+            return self._extra_strings(name)[num]
+        return str(num).zfill(width)
+
+    def _key_of_row(self, row):
+        width = self._array_view('imei.widths')[row]
+        num = self._array_view('imei.nums')[row]
+        return self._extra_strings('imei')[num] if width < 0 else num * 32 + width
+
+    def row_values(self, row):
+        """Значения строки в порядке EQUIPMENT_FIELDS (дата - ordinal)."""
+        cat = {name: self._values[name][self._array_view(name + '.codes')[row]] for name in CATEGORY_FIELDS}
+        return (cat['branch'], self._digit('imei', row), cat['brand'], self._digit('model', row),
+                cat['status'], cat['condition'], cat['location'], self._array_view('dates')[row])
+
+    def get(self, imei):
+        """Поиск по IMEI по готовой таблице индекса - читаются только нужные ячейки файла."""
+        key = imei_key(imei)
+        index, mask = self._index, self._mask
+        perturb = stable_hash(key)
+        i = perturb & mask
+        while True:
+            row = index[i]
+            if row < 0:
+                return None
+            if self._key_of_row(row) == key:
+                eq = Equipment.__new__(Equipment)
+                eq._table, eq._row = None, list(self.row_values(row))
+                return eq
+            perturb >>= 5
+            i = (i * 5 + perturb + 1) & mask
+
+    def count_by(self, field):
+        values = self._values[field]
+        return {values[code]: cnt for code, cnt in Counter(self._array_view(field + '.codes')).items()}
+
+    def iter_tuples(self):
+        codes = {name: self._array_view(name + '.codes') for name in CATEGORY_FIELDS}
+        values = self._values
+        dates = self._array_view('dates')
+        for row in self._rows():
+            yield (values['branch'][codes['branch'][row]], self._digit('imei', row),
+                   values['brand'][codes['brand'][row]], self._digit('model', row),
+                   values['status'][codes['status'][row]], values['condition'][codes['condition'][row]],
+                   values['location'][codes['location'][row]], ordinal_to_str(dates[row]))
+
+    def _copy_array(self, name):
+        out = array(self._FORMATS[name.rsplit('.', 1)[-1]])
+        out.frombytes(self._bytes(name))
+        return out
+
+    def to_table(self):
+        """Столбцы и индекс в памяти: копирование массивов целиком (memcpy) после проверки CRC32."""
+        self.verify()
+        table = _EquipmentTable()
+        for name in CATEGORY_FIELDS:
+            col = table.cols[name]
+            col.codes = self._copy_array(name + '.codes')
+            col.values = [sys.intern(v) for v in self._values[name]]
+            col.code_of = {v: i for i, v in enumerate(col.values)}
+        for name in DIGIT_FIELDS:
+            col = table.cols[name]
+            col.nums = self._copy_array(name + '.nums')
+            col.widths = self._copy_array(name + '.widths')
+            col.extra = list(self._extra_strings(name))
+        table.dates = self._copy_array('dates')
+        table.n = self.n
+        order = self._copy_array('order') if self.meta['has_order'] else None
+        index = _ImeiIndex.from_slots(table.cols['imei'], self._copy_array('imei.index'), self.n)
+        return table, order, index
+
+@timed('load_snapshot', rows=lambda result, args: result)
+def load_snapshot_into(store, filename=SNAPSHOT_FILE):
+    """Заменяет содержимое хранилища данными бинарного снимка. Возвращает число записей."""
+    with SnapshotFile(filename) as snap:
+        store.adopt(*snap.to_table())
+    return len(store)
+
+def snapshot_is_fresh(filename=SNAPSHOT_FILE, json_file='equipment_data.json'):
+    """Снимок можно брать вместо JSON, если он не старее JSON (JSON могли подменить вручную)."""
+    try:
+        snap_mtime = os.path.getmtime(filename)
+    except OSError:
+        return False
+    try:
+        return snap_mtime >= os.path.getmtime(json_file)
+    except OSError:
+        return True
+
+def convert_to_snapshot(src, dst=SNAPSHOT_FILE):
+    """JSON / CSV / JSON Lines -> бинарный снимок. Возвращает LoadReport загрузки."""
+    report = LoadReport(src)
+    readers = {'.csv': iter_csv, '.jsonl': iter_jsonl}
+    reader = readers.get(os.path.splitext(src)[1].lower(), iter_json)
+    store = EquipmentStore()
+    for chunk in reader(src, report=report):
+        store.extend(chunk)
+    write_snapshot(store, dst)
+    return report
+
+def convert_from_snapshot(src=SNAPSHOT_FILE, dst='equipment_data.json'):
+    """Бинарный снимок -> JSON / CSV / JSON Lines (по расширению dst)."""
+    writers = {'.csv': write_csv, '.jsonl': write_jsonl}
+    writer = writers.get(os.path.splitext(dst)[1].lower(), write_json)
+    with SnapshotFile(src) as snap:
+        writer(snap, dst)
+
+# ===================== Хранение в SQLite =====================
+
+SQLITE_FILE = 'equipment_data.db'
+# RTK_STORAGE=sqlite - данные приложения живут в SQLite вместо снимка JSON + журнала,
+# RTK_STORAGE=shards - в файлах по филиалам (см. save_shards)
+STORAGE_BACKEND = os.environ.get('RTK_STORAGE', 'files')
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS equipment (
+    branch    TEXT NOT NULL,
+    imei      TEXT NOT NULL,
+    brand     TEXT NOT NULL,
+    model     TEXT NOT NULL,
+    status    TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    location  TEXT NOT NULL,
+    date      TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_equipment_imei ON equipment(imei);
+CREATE INDEX IF NOT EXISTS idx_equipment_branch ON equipment(branch);
+CREATE INDEX IF NOT EXISTS idx_equipment_status_condition_date ON equipment(status, condition, date);
+"""
+_SQL_COLUMNS = ', '.join(EQUIPMENT_FIELDS)
+_SQL_INSERT = f"INSERT INTO equipment ({_SQL_COLUMNS}) VALUES ({', '.join('?' * len(EQUIPMENT_FIELDS))})"
+_SQL_UPSERT = _SQL_INSERT + " ON CONFLICT(imei) DO UPDATE SET " + ', '.join(
+    f"{k} = excluded.{k}" for k in EQUIPMENT_FIELDS if k != 'imei')
+_SQL_INSERT_NEW = _SQL_INSERT + " ON CONFLICT(imei) DO NOTHING"
+_SQL_MAX_PARAMS = 500   # параметров в одном запросе (в старых сборках SQLite предел - 999)
+
+class SqliteBackend:
+    """
+    Хранение в SQLite: таблица equipment с индексами по imei, branch и (status, condition, date).
+    Добавление и правка - upsert строки из фоновой записи, без перезаписи базы (правки, пришедшие
+    за debounce, идут одной транзакцией), массовый импорт - вставка новых IMEI порциями;
+    полная замена таблицы - только при загрузке файла целиком и свертке;
+    агрегаты для аналитики считаются в SQL (GROUP BY), без загрузки записей в Python.
+    У каждого потока свое соединение.
+    """
+
+    def __init__(self, filename=SQLITE_FILE):
+        self.filename = filename
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SQLITE_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Закрывает соединение текущего потока."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def has_data(self):
+        if not os.path.exists(self.filename):
+            return False
+        return self._conn().execute("SELECT 1 FROM equipment LIMIT 1").fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM equipment").fetchone()[0]
+
+    def upsert_records(self, records):
+        """Пачка измененных записей (dict): по одной строке на запись, одна транзакция на пачку."""
+        with self._conn() as conn:
+            conn.executemany(_SQL_UPSERT, ([rec[k] for k in EQUIPMENT_FIELDS] for rec in records))
+
+    def insert_rows(self, rows):
+        """
+        Дописывает строки массового импорта (кортежи в порядке EQUIPMENT_FIELDS) одной транзакцией;
+        IMEI, которые уже есть в базе, пропускаются. Остальная таблица не переписывается.
+        Возвращает строки базы для пропущенных IMEI - их данные главнее импортированных.
+        """
+        rows = list(rows)
+        with self._conn() as conn:
+            existing = self.rows_by_imei([row[1] for row in rows])
+            conn.executemany(_SQL_INSERT_NEW, rows)
+        return existing
+
+    def rows_by_imei(self, imeis):
+        """Строки базы (кортежи в порядке EQUIPMENT_FIELDS) для тех из imeis, что в ней есть."""
+        imeis = list(imeis)
+        found = []
+        for start in range(0, len(imeis), _SQL_MAX_PARAMS):
+            part = imeis[start:start + _SQL_MAX_PARAMS]
+            found += self._conn().execute(
+                f"SELECT {_SQL_COLUMNS} FROM equipment WHERE imei IN ({', '.join('?' * len(part))})",
+                part).fetchall()
+        return found
+
+    def replace_all(self, data):
+        """Полная замена содержимого (загрузка файла целиком, свертка)."""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM equipment")
+            conn.executemany(_SQL_INSERT, _iter_tuples(data))
+
+    def get(self, imei):
+        row = self._conn().execute(f"SELECT {_SQL_COLUMNS} FROM equipment WHERE imei = ?", (imei,)).fetchone()
+        return None if row is None else Equipment.from_dict(dict(zip(EQUIPMENT_FIELDS, row)))
+
+    def iter_tuples(self, batch=LOAD_CHUNK_ROWS):
+        cur = self._conn().execute(f"SELECT {_SQL_COLUMNS} FROM equipment ORDER BY rowid")
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                return
+            yield from rows
+
+    def group_count(self, fields, where='', params=(), top_n=None):
+        """[(значения fields..., количество)] - GROUP BY в SQL; с top_n - по убыванию количества."""
+        cols = ', '.join(f for f in fields if f in EQUIPMENT_FIELDS)
+        sql = f"SELECT {cols}, COUNT(*) AS cnt FROM equipment"
+        if where:
+            sql += f" WHERE {where}"
+        sql += f" GROUP BY {cols}"
+        if top_n is not None:
+            sql += f" ORDER BY cnt DESC LIMIT {int(top_n)}"
+        return self._conn().execute(sql, params).fetchall()
+
+    def count_by(self, field):
+        return dict(self.group_count([field]))
+
+def iter_sqlite(filename=SQLITE_FILE, chunk_size=LOAD_CHUNK_ROWS, report=None):
+    """Генератор порций Equipment из базы SQLite."""
+    report = report if report is not None else LoadReport(filename)
+    backend = SqliteBackend(filename)
+
+    def records():
+        try:
+            for i, row in enumerate(backend.iter_tuples(chunk_size), 1):
+                yield f"строка {i}", dict(zip(EQUIPMENT_FIELDS, row))
+        finally:
+            backend.close()
+    return _equipment_chunks(_guarded(records(), report, 'SQLite'), chunk_size, report)
+
+@timed('save_to_sqlite', rows=0)
+def save_to_sqlite(data, filename=SQLITE_FILE):
+    backend = SqliteBackend(filename)
+    try:
+        backend.replace_all(data)
+        return True
+    except Exception as e:
+        print(f"Ошибка при сохранении в SQLite: {e}")
+        return False
+    finally:
+        backend.close()
+
+@timed('load_from_sqlite', rows='result')
+def load_from_sqlite(filename=SQLITE_FILE):
+    report = LoadReport(filename)
+    return _collect(iter_sqlite(filename, report=report), report)
+
+# ===================== Хранение по филиалам =====================
+
+SHARDS_DIR = 'equipment_shards'
+SHARD_MANIFEST = 'manifest.json'
+SHARD_FORMAT_VERSION = 1
+# процессов для чтения/записи файлов филиалов; 0 - по числу ядер
+SHARD_WORKERS = int(os.environ.get('RTK_SHARD_WORKERS', '0') or 0)
+
+def _shard_payload(table, rows=None):
+    """
+    Столбцы строк rows (все, если None) в виде, пригодном для передачи в другой процесс.
+    Словари категорий - только встречающиеся значения по алфавиту, поэтому одинаковые
+    данные филиала всегда дают одинаковые байты (и одинаковую контрольную сумму).
+    """
+    if rows is None:
+        rows = np.arange(table.n)
+    payload = {'n': len(rows)}
+    for name in CATEGORY_FIELDS:
+        col = table.cols[name]
+        codes = np.array(col.codes, dtype=np.uint32)[rows]
+        used = np.unique(codes)
+        used = used[np.argsort([str(col.values[c]) for c in used.tolist()], kind='stable')]
+        rank = np.zeros(len(col.values), dtype=np.uint32)
+        rank[used] = np.arange(len(used), dtype=np.uint32)
+        payload[name] = ([col.values[c] for c in used.tolist()], rank[codes].tobytes())
+    for name in DIGIT_FIELDS:
+        col = table.cols[name]
+        nums = np.array(col.nums, dtype=np.int64)[rows]
+        widths = np.array(col.widths, dtype=np.int8)[rows]
+        other = np.flatnonzero(widths < 0)
+        extra = [col.extra[i] for i in nums[other].tolist()]
+        nums[other] = np.arange(len(other))
+        payload[name] = (extra, nums.tobytes(), widths.tobytes())
+    payload['date'] = np.array(table.dates, dtype=np.int32)[rows].tobytes()
+    return payload
+
+def _payload_digest(payload):
+    digest = hashlib.blake2b(digest_size=16)
+    for name in EQUIPMENT_FIELDS:
+        for part in payload[name] if name != 'date' else (payload[name],):
+            if isinstance(part, list):
+                part = json.dumps(part, ensure_ascii=False).encode('utf-8', 'surrogatepass')
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+    return digest.hexdigest()
+
+def _payload_table(payload):
+    table = _EquipmentTable()
+    for name in CATEGORY_FIELDS:
+        col = table.cols[name]
+        col.values, codes = list(payload[name][0]), payload[name][1]
+        col.code_of = {v: i for i, v in enumerate(col.values)}
+        col.codes.frombytes(codes)
+    for name in DIGIT_FIELDS:
+        col = table.cols[name]
+        col.extra = list(payload[name][0])
+        col.nums.frombytes(payload[name][1])
+        col.widths.frombytes(payload[name][2])
+    table.dates.frombytes(payload['date'])
+    table.n = payload['n']
+    return table
+
+def _write_shard(filename, payload):
+    """Пишет файл филиала (формат бинарного снимка). Выполняется в процессе пула."""
+    table = _payload_table(payload)
+    index = _ImeiIndex.build(table.cols['imei'], table.n)
+    _write_snapshot_file(EquipmentSnapshot(table, None, index.slots), filename)
+    return table.n
+
+def _read_shard(filename, digest):
+    """Читает файл филиала и сверяет контрольную сумму. Выполняется в процессе пула."""
+    with SnapshotFile(filename) as snap:
+        table = snap.to_table()[0]
+    payload = _shard_payload(table)
+    if _payload_digest(payload) != digest:
+        raise ValueError(f"{filename}: контрольная сумма не совпадает с manifest")
+    return payload
+
+def _map_shards(func, tasks, workers=0):
+    """func(*task) для каждой задачи: в пуле процессов, если их больше одного, иначе здесь же."""
+    workers = min(workers or SHARD_WORKERS or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        return [func(*task) for task in tasks]
+    # spawn: процесс с потоками (GUI, фоновая запись) небезопасно клонировать через fork
+    with futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(func, *zip(*tasks)))
+
+def _merge_payloads(payloads):
+    """Столбцы всех филиалов в одну таблицу; повторные IMEI (после ручной правки файлов) - отбрасываются."""
+    table = _EquipmentTable()
+    columns = {}
+    for name in CATEGORY_FIELDS:
+        col = table.cols[name]
+        parts = [np.array([col.encode(v) for v in values], dtype=np.uint32)[np.frombuffer(codes, dtype=np.uint32)]
+                 for values, codes in (p[name] for p in payloads)]
+        columns[name] = np.concatenate(parts) if parts else np.empty(0, dtype=np.uint32)
+    for name in DIGIT_FIELDS:
+        col = table.cols[name]
+        nums, widths = [], []
+        for p in payloads:
+            extra, part_nums, part_widths = p[name]
+            part_nums = np.frombuffer(part_nums, dtype=np.int64).copy()
+            part_widths = np.frombuffer(part_widths, dtype=np.int8)
+            part_nums[part_widths < 0] += len(col.extra)
+            col.extra.extend(extra)
+            nums.append(part_nums)
+            widths.append(part_widths)
+        columns[name] = (np.concatenate(nums) if nums else np.empty(0, dtype=np.int64),
+                         np.concatenate(widths) if widths else np.empty(0, dtype=np.int8))
+    dates = np.concatenate([np.frombuffer(p['date'], dtype=np.int32) for p in payloads]) \
+        if payloads else np.empty(0, dtype=np.int32)
+
+    nums, widths = columns['imei']
+    keep = np.ones(len(dates), dtype=bool)
+    digit = np.flatnonzero(widths >= 0)
+    order = digit[np.lexsort((nums[digit], widths[digit]))]
+    repeat = (nums[order][1:] == nums[order][:-1]) & (widths[order][1:] == widths[order][:-1])
+    keep[order[1:][repeat]] = False
+    seen = set()
+    for row in np.flatnonzero(widths < 0).tolist():
+        key = table.cols['imei'].extra[nums[row]]
+        keep[row] = key not in seen
+        seen.add(key)
+
+    for name in CATEGORY_FIELDS:
+        table.cols[name].codes.frombytes(columns[name][keep].tobytes())
+    for name in DIGIT_FIELDS:
+        table.cols[name].nums.frombytes(columns[name][0][keep].tobytes())
+        table.cols[name].widths.frombytes(columns[name][1][keep].tobytes())
+    table.dates.frombytes(dates[keep].tobytes())
+    table.n = int(np.count_nonzero(keep))
+    return table, len(keep) - table.n
+
+def _shard_filename(branch, digest):
+    slug = re.sub(r'[^\w-]+', '_', str(branch)).strip('_')[:40] or 'branch'
+    return f"{slug}-{digest}.rtk"
+
+def read_shard_manifest(directory=SHARDS_DIR):
+    """Содержимое manifest.json или None, если хранения по филиалам еще нет."""
+    try:
+        with open(os.path.join(directory, SHARD_MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != SHARD_FORMAT_VERSION:
+        raise ValueError(f"{directory}: неподдерживаемая версия manifest {manifest.get('version')}")
+    return manifest
+
+def shards_exist(directory=SHARDS_DIR):
+    return os.path.exists(os.path.join(directory, SHARD_MANIFEST))
+
+@timed('save_shards', rows=0)
+def save_shards(data, directory=SHARDS_DIR, workers=0):
+    """
+    Хранение по филиалам: файл на филиал (формат бинарного снимка) и manifest.json
+    {филиал: файл, записей, контрольная сумма}. Имя файла содержит контрольную сумму его
+    данных, поэтому переписываются только филиалы, данные которых изменились, а старый
+    файл удаляется лишь после замены manifest - при сбое manifest указывает на целые файлы.
+    Файлы пишутся в пуле процессов. Порядок записей внутри филиала сохраняется,
+    между филиалами - нет. Возвращает число записанных файлов.
+    """
+    if isinstance(data, EquipmentStore):
+        data = data.snapshot()
+    elif not isinstance(data, EquipmentSnapshot):
+        data = EquipmentStore(data).snapshot()
+    table = data.table
+    os.makedirs(directory, exist_ok=True)
+    old = read_shard_manifest(directory) or {'shards': {}}
+
+    codes = np.array(table.cols['branch'].codes, dtype=np.int64)
+    rows = np.argsort(codes, kind='stable')
+    found, starts = np.unique(codes[rows], return_index=True)
+    shards, tasks = {}, []
+    for code, part in zip(found.tolist(), np.split(rows, starts[1:])):
+        branch = table.cols['branch'].values[code]
+        payload = _shard_payload(table, part)
+        digest = _payload_digest(payload)
+        filename = _shard_filename(branch, digest)
+        shards[branch] = {'file': filename, 'rows': len(part), 'digest': digest}
+        if not os.path.exists(os.path.join(directory, filename)):
+            tasks.append((os.path.join(directory, filename), payload))
+    _map_shards(_write_shard, tasks, workers)
+
+    manifest = {'version': SHARD_FORMAT_VERSION, 'rows': table.n, 'shards': shards}
+    manifest_file = os.path.join(directory, SHARD_MANIFEST)
+    with open(manifest_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    _replace_atomically(manifest_file + '.tmp', manifest_file)
+    current = {s['file'] for s in shards.values()}
+    for entry in old['shards'].values():
+        if entry['file'] not in current:
+            try:
+                os.remove(os.path.join(directory, entry['file']))
+            except OSError:
+                pass
+    return len(tasks)
+
+def read_shards(directory=SHARDS_DIR, workers=0):
+    """
+    Читает файлы филиалов и сверяет их с manifest в пуле процессов, склеивает столбцы и
+    строит индекс IMEI векторно. Возвращает аргументы EquipmentStore.adopt; хранилище не
+    трогает, поэтому может работать в фоновом потоке.
+    """
+    manifest = read_shard_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(os.path.join(directory, SHARD_MANIFEST))
+    tasks = [(os.path.join(directory, s['file']), s['digest']) for s in manifest['shards'].values()]
+    table, duplicates = _merge_payloads(_map_shards(_read_shard, tasks, workers))
+    if duplicates:
+        print(f"Пропущено повторных IMEI в файлах филиалов: {duplicates}")
+    return table, None, _ImeiIndex.build(table.cols['imei'], table.n)
+
+@timed('load_shards', rows=lambda result, args: result)
+def load_shards_into(store, directory=SHARDS_DIR, workers=0):
+    """Заменяет содержимое хранилища данными файлов филиалов. Возвращает число записей."""
+    store.adopt(*read_shards(directory, workers))
+    return len(store)
+
+# ===================== Журнал изменений =====================
+
+JOURNAL_COMPACT_THRESHOLD = 5000      # записей в журнале до свертки в снимок
+JOURNAL_COMPACT_INTERVAL_MS = 10 * 60 * 1000
+SAVER_POLL_MS = 200                   # как часто GUI забирает результаты фоновой записи
+
+class ChangeJournal:
+    """
+    Журнал изменений в формате JSON Lines: одна строка - одна измененная запись.
+    Актуальное состояние = снимок (equipment_data.json) + журнал поверх него.
+    Каждая строка дописывается с fsync, поэтому после сбоя теряется
+    не больше одной недописанной строки, которая при чтении пропускается.
+    """
+
+    def __init__(self, filename='equipment_data.journal'):
+        self.filename = filename
+        self.entries = 0
+
+    def append(self, eq):
+        try:
+            self.append_records([eq.to_dict()])
+        except Exception as e:
+            print(f"Ошибка при записи в журнал: {e}")
+            return False
+        return True
+
+    def append_records(self, records):
+        """Дописывает пачку записей (dict) одной записью и одним fsync. Ошибки не гасит."""
+        payload = b''.join(
+            json.dumps({'op': 'upsert', 'rec': rec}, ensure_ascii=False).encode('utf-8') + b'\n'
+            for rec in records
+        )
+        with open(self.filename, 'ab') as f:
+            # хвост, оборванный сбоем, не должен склеиться с новой строкой
+            if f.tell() and not self._ends_with_newline():
+                f.write(b'\n')
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries += len(records)
+
+    def _ends_with_newline(self):
+        with open(self.filename, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def replay(self, store):
+        """Применяет журнал к хранилищу. Возвращает (применено, пропущено строк)."""
+        applied = bad = 0
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        if entry.get('op') != 'upsert':
+                            raise ValueError(entry.get('op'))
+                        store.upsert(Equipment.from_dict(entry['rec']))
+                        applied += 1
+                    except Exception:
+                        bad += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ошибка при чтении журнала: {e}")
+        self.entries = applied + bad
+        return applied, bad
+
+    def reset(self):
+        """Очищает журнал после того, как снимок надежно записан."""
+        try:
+            with open(self.filename, 'wb') as f:
+                os.fsync(f.fileno())
+        except Exception as e:
+            print(f"Ошибка при очистке журнала: {e}")
+            return
+        self.entries = 0
+
+def compact(store, journal, json_file='equipment_data.json', csv_file='equipment_data.csv',
+            snapshot_file=SNAPSHOT_FILE):
+    """
+    Свертка: полный снимок в JSON, CSV и бинарный снимок, затем очистка журнала.
+    Если сбой случится до очистки, повторное применение журнала к новому снимку безвредно.
+    Бинарный снимок пишется после JSON, чтобы не оказаться старее него.
+    """
+    if not save_to_json(store, json_file):
+        return False
+    save_to_csv(store, csv_file)
+    save_to_snapshot(store, snapshot_file)
+    journal.reset()
+    return True
+
+# ===================== История изменений =====================
+HISTORY_FILE = 'equipment_data.history'                # события - записи фиксированной длины
+HISTORY_VALUES_FILE = 'equipment_data.history.values'  # словарь значений, JSON-строка на значение
+HISTORY_SNAPSHOT_DIR = 'equipment_history'             # снимки состояния парка
+HISTORY_SNAPSHOT_EVENTS = 50000  # событий между снимками (снимок делается при свертке)
+HISTORY_SNAPSHOTS_KEPT = 24
+HISTORY_FIELDS = ('status', 'condition', 'location')
+_HISTORY_EVENT = struct.Struct('<qqBHH')  # время (мс), ключ устройства, поле, было, стало
+_HISTORY_COLUMNS = (('ts', 'q', '<i8'), ('keys', 'q', '<i8'), ('fields', 'B', 'u1'),
+                    ('old', 'H', '<u2'), ('new', 'H', '<u2'))
+_DAY_MS = 86400 * 1000
+
+def history_key(imei):
+    """Ключ устройства в истории (int64): как imei_key для IMEI из цифр, иначе - отрицательный crc32."""
+    key = imei_key(imei)
+    if type(key) is int and key < 1 << 60:
+        return key
+    return -1 - zlib.crc32(str(imei).encode('utf-8', 'surrogatepass'))
+
+def history_ms(value):
+    """datetime, date или 'YYYY-MM-DD' -> мс от 1970 (дата - конец дня: ее события входят)."""
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    if not isinstance(value, datetime):
+        return int(datetime(value.year, value.month, value.day).timestamp() * 1000) + _DAY_MS - 1
+    return int(value.timestamp() * 1000)
+
+class ChangeHistory:
+    """
+    История изменений статуса, состояния и расположения: события в столбцах array
+    (время, ключ устройства, поле, было, стало - коды словаря значений), на диске - записи
+    фиксированной длины, только дописываются. Каждые HISTORY_SNAPSHOT_EVENTS событий при свертке
+    сохраняется снимок состояния парка; состояние на дату собирается от ближайшей точки -
+    снимка до даты или текущего состояния - проходом только по событиям между ними.
+    """
+
+    def __init__(self, filename=HISTORY_FILE, values_file=HISTORY_VALUES_FILE, snapshot_dir=HISTORY_SNAPSHOT_DIR):
+        self.filename = filename
+        self.values_file = values_file
+        self.snapshot_dir = snapshot_dir
+        self.values = []
+        self.code_of = {}
+        for name, typecode, _ in _HISTORY_COLUMNS:
+            setattr(self, name, array(typecode))
+        self.snapshots = []  # номера событий, после которых снимок записан на диск (по возрастанию)
+        self._pending = None  # снимок, отданный в поток записи, но еще не записанный
+        self._lock = threading.Lock()  # snapshots и файлы снимков: пишет поток записи, читают запросы
+        self._unsaved = 0    # с этого номера значения словаря еще не отданы на запись
+
+    def __len__(self):
+        return len(self.ts)
+
+    def load(self):
+        """Читает словарь, события и список снимков. Оборванная сбоем запись в конце отрезается."""
         try:
-            self.date = datetime.strptime(date_str, '%Y-%m-%d')
-        except:
-            self.date = None
+            with open(self.values_file, 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            lines = []
+        # последний элемент - пустой хвост или недописанная строка
+        for line in lines[:-1]:
+            value = json.loads(line)
+            self.code_of.setdefault(value, len(self.values))
+            self.values.append(value)
+        self._unsaved = len(self.values)
+        try:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        whole = len(data) - len(data) % _HISTORY_EVENT.size
+        if whole < len(data):
+            os.truncate(self.filename, whole)
+        records = np.frombuffer(data, dtype=[(name, dt) for name, _, dt in _HISTORY_COLUMNS], count=whole // _HISTORY_EVENT.size)
+        # события со значением, которое не успело попасть в словарь, не читаются
+        known = (records['old'] < len(self.values)) & (records['new'] < len(self.values))
+        records = records[:int(np.argmin(known)) if not known.all() else len(records)]
+        for name, typecode, _ in _HISTORY_COLUMNS:
+            column = array(typecode)
+            column.frombytes(np.ascontiguousarray(records[name]).tobytes())
+            setattr(self, name, column)
+        if os.path.isdir(self.snapshot_dir):
+            self.snapshots = sorted(pos for pos in (self._snapshot_pos(name) for name in os.listdir(self.snapshot_dir))
+                                    if pos is not None and pos <= len(self))
+        return len(self)
 
-    def to_dict(self):
-        return {
-            'branch': self.branch,
-            'imei': self.imei,
-            'brand': self.brand,
-            'model': self.model,
-            'status': self.status,
-            'condition': self.condition,
-            'location': self.location,
-            'date': self.date.strftime('%Y-%m-%d') if self.date else ''
-        }
+    @staticmethod
+    def _snapshot_pos(name):
+        match = re.fullmatch(r'snapshot-(\d+)\.npz', name)
+        return int(match.group(1)) if match else None
 
-# ... (здесь остаются функции save/load, а также весь предыдущий GUI-код) ...
-def save_to_csv(data, filename='equipment_data.csv'):
-    try:
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
-            if not data:
-                return
-            writer = csv.DictWriter(f, fieldnames=data[0].to_dict().keys())
-            writer.writeheader()
-            for item in data:
-                writer.writerow(item.to_dict())
-    except Exception as e:
-        print(f"Ошибка при сохранении в CSV: {e}")
+    def _snapshot_file(self, pos):
+        return os.path.join(self.snapshot_dir, f'snapshot-{pos:012d}.npz')
 
-def load_from_csv(filename='equipment_data.csv'):
-    equipments = []
-    try:
-        with open(filename, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                equipments.append(Equipment(
-                    branch=row['branch'],
-                    imei=row['imei'],
-                    brand=row['brand'],
-                    model=row['model'],
-                    status=row['status'],
-                    condition=row['condition'],
-                    location=row['location'],
-                    date_str=row['date']
-                ))
-    except Exception as e:
-        print(f"Ошибка при чтении CSV: {e}")
-    return equipments
+    def _code(self, value):
+        code = self.code_of.get(value)
+        if code is None:
+            code = self.code_of[value] = len(self.values)
+            self.values.append(value)
+        return code
 
-def save_to_json(data, filename='equipment_data.json'):
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump([item.to_dict() for item in data], f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"Ошибка при сохранении в JSON: {e}")
+    # --- запись (поток GUI или сервиса, затем поток записи) ---
+    def record(self, eq, changes, when=None):
+        """
+        События по полям истории, которые changes ({поле: новое значение}) действительно меняют;
+        eq - запись до изменения. Возвращает пачку для write() или None, если менять нечего.
+        """
+        start = len(self)
+        ts = max(int((when or datetime.now()).timestamp() * 1000), self.ts[-1] if start else 0)
+        key = history_key(eq.imei)
+        for field_code, field in enumerate(HISTORY_FIELDS):
+            old = getattr(eq, field)
+            if field not in changes or changes[field] == old:
+                continue
+            self.ts.append(ts)
+            self.keys.append(key)
+            self.fields.append(field_code)
+            self.old.append(self._code(old))
+            self.new.append(self._code(changes[field]))
+        if len(self) == start:
+            return None
+        values, self._unsaved = self.values[self._unsaved:], len(self.values)
+        events = b''.join(_HISTORY_EVENT.pack(self.ts[i], self.keys[i], self.fields[i], self.old[i], self.new[i])
+                          for i in range(start, len(self)))
+        return values, events
 
-def load_from_json(filename='equipment_data.json'):
-    equipments = []
-    try:
-        with open(filename, 'r', encoding='utf-8-sig') as f:
-            data_list = json.load(f)
-            for data in data_list:
-                equipments.append(Equipment(
-                    branch=data['branch'],
-                    imei=data['imei'],
-                    brand=data['brand'],
-                    model=data['model'],
-                    status=data['status'],
-                    condition=data['condition'],
-                    location=data['location'],
-                    date_str=data['date']
-                ))
-    except Exception as e:
-        print(f"Ошибка при чтении JSON: {e}")
-    return equipments
+    def write(self, batches):
+        """Дописывает пачки record(): сначала новые значения словаря, потом события (по fsync). Ошибки не гасит."""
+        values = b''.join(json.dumps(v, ensure_ascii=False).encode('utf-8') + b'\n'
+                          for new_values, _ in batches for v in new_values)
+        for filename, payload in ((self.values_file, values), (self.filename, b''.join(e for _, e in batches))):
+            if not payload:
+                continue
+            with open(filename, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def snapshot_due(self):
+        with self._lock:
+            last = max(self.snapshots[-1] if self.snapshots else 0, self._pending or 0)
+        return len(self) - last >= HISTORY_SNAPSHOT_EVENTS
+
+    def snapshot(self, store):
+        """
+        Состояние парка после len(self) событий - для write_snapshot() в потоке записи.
+        В snapshots снимок попадает только после записи файла.
+        """
+        keys, state, values = self._fleet(store)
+        with self._lock:
+            self._pending = len(self)
+        return len(self), values, state, keys
+
+    def write_snapshot(self, pos, values, state, keys):
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            tmp = self._snapshot_file(pos) + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.savez_compressed(f, keys=keys, state=state.astype(np.uint16), values=np.array(values, dtype=str))
+                f.flush()
+                os.fsync(f.fileno())
+            _replace_atomically(tmp, self._snapshot_file(pos))
+            with self._lock:
+                bisect.insort(self.snapshots, pos)
+                for old in self.snapshots[:-HISTORY_SNAPSHOTS_KEPT]:
+                    try:
+                        os.remove(self._snapshot_file(old))
+                    except FileNotFoundError:
+                        pass
+                del self.snapshots[:-HISTORY_SNAPSHOTS_KEPT]
+        finally:
+            # после ошибки снимок можно поставить снова
+            with self._lock:
+                if self._pending == pos:
+                    self._pending = None
+
+    # --- запросы ---
+    @staticmethod
+    def _fleet(store):
+        """(ключи строк хранилища, коды status/condition/location в общем списке значений, этот список)."""
+        table = store._table
+        col = table.cols['imei']
+        nums = np.array(col.nums, dtype=np.int64)
+        widths = np.array(col.widths, dtype=np.int64)
+        keys = nums * 32 + widths
+        for row in np.flatnonzero((widths < 0) | (nums >= 1 << 55)):
+            keys[row] = history_key(col.get(int(row)))
+        values, state = [], []
+        for field in HISTORY_FIELDS:
+            state.append(np.array(table.cols[field].codes, dtype=np.int64) + len(values))
+            values.extend(table.cols[field].values)
+        return keys, np.column_stack(state), values
+
+    def _codes(self, values, extra):
+        """Коды словаря для значений; значения не из словаря получают коды после него (в extra, не на диск)."""
+        codes = np.empty(len(values), dtype=np.int64)
+        for i, value in enumerate(values):
+            code = self.code_of.get(value)
+            codes[i] = code if code is not None else extra.setdefault(value, len(self.values) + len(extra))
+        return codes
+
+    def _column(self, name, lo=0, hi=None):
+        hi = len(self) if hi is None else hi
+        dtype = next(dt for n, _, dt in _HISTORY_COLUMNS if n == name)
+        return np.array(getattr(self, name)[lo:hi], dtype=dtype).astype(np.int64)
+
+    @staticmethod
+    def _index(keys):
+        """Ключи строк хранилища по возрастанию и номера строк в том же порядке - для _rows_of."""
+        order = np.argsort(keys, kind='stable')
+        return keys[order], order
+
+    @staticmethod
+    def _rows_of(keys, index):
+        """Номера строк хранилища по ключам (-1 - устройства нет в хранилище)."""
+        sorted_keys, order = index
+        if not len(sorted_keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return np.where(sorted_keys[pos] == keys, order[pos], -1)
+
+    def _apply(self, state, lo, hi, column, last, index, only=None):
+        """
+        По каждой паре (устройство, поле) из событий [lo, hi) берет первое (или последнее, last=True)
+        и пишет его значение column ('old' или 'new') в state.
+        """
+        keys, fields, values = (self._column(name, lo, hi) for name in ('keys', 'fields', column))
+        if only is not None:
+            mask = np.isin(keys, only)
+            keys, fields, values = keys[mask], fields[mask], values[mask]
+        if last:
+            keys, fields, values = keys[::-1], fields[::-1], values[::-1]
+        _, first = np.unique(keys * 4 + fields, return_index=True)
+        rows = self._rows_of(keys[first], index)
+        hit = rows >= 0
+        state[rows[hit], fields[first][hit]] = values[first][hit]
+
+    def state_at(self, when, store):
+        """
+        Статус, состояние и расположение устройств хранилища на момент when (datetime, date - на конец
+        дня): DataFrame как store.frame() с этими полями на тот момент. Устройства, добавленные позже,
+        входят в ответ с первым известным состоянием.
+        """
+        hi = int(np.searchsorted(self._column('ts'), history_ms(when), side='right'))
+        keys, state, values = self._fleet(store)
+        extra = {}
+        state = self._codes(values, extra)[state]
+        index = self._index(keys)
+        with self._lock:
+            # под блокировкой: поток записи не удалит выбранный снимок, пока он читается
+            snap = max((pos for pos in self.snapshots if pos <= hi), default=None)
+            if snap is not None and hi - snap <= len(self) - hi:
+                with np.load(self._snapshot_file(snap)) as saved:
+                    snap_keys, snap_state, snap_values = saved['keys'], saved['state'], saved['values']
+            else:
+                snap = None
+        if snap is None:
+            # назад от текущего состояния: первое событие после when хранит значение "было"
+            self._apply(state, hi, len(self), 'old', False, index)
+        else:
+            # вперед от снимка; устройства не из снимка - назад от текущего состояния
+            snap_state = self._codes(list(snap_values), extra)[snap_state.astype(np.int64)]
+            rows = self._rows_of(snap_keys, index)
+            hit = rows >= 0
+            covered = np.zeros(len(keys), dtype=bool)
+            covered[rows[hit]] = True
+            missing = keys[~covered]
+            if len(missing):
+                self._apply(state, hi, len(self), 'old', False, index, only=missing)
+            state[rows[hit]] = snap_state[hit]
+            self._apply(state, snap, hi, 'new', True, index)
+        names = self.values + list(extra)
+        frame = store.frame().copy()
+        rows = frame.index.to_numpy()
+        for i, field in enumerate(HISTORY_FIELDS):
+            codes = state[rows, i]
+            frame[field] = pd.Categorical.from_codes(codes, names).remove_unused_categories()
+        return frame
+
+    def spans(self, store, value='ремонт', field='condition', until=None):
+        """
+        Отрезки пребывания в значении value поля field: DataFrame (row, start, end, days, open).
+        Начало - событие перехода в value, конец - следующее событие по этому полю; у незавершенных
+        (open) конец - until (по умолчанию сейчас). Время до начала истории не учитывается.
+        """
+        code = self.code_of.get(value)
+        fields = self._column('fields')
+        sel = np.flatnonzero(fields == HISTORY_FIELDS.index(field))
+        keys, ts, new = self._column('keys')[sel], self._column('ts')[sel], self._column('new')[sel]
+        order = np.lexsort((sel, keys))  # по устройству, внутри - по порядку событий
+        keys, ts, new = keys[order], ts[order], new[order]
+        closed = np.append(keys[1:] == keys[:-1], False)
+        until = history_ms(until or datetime.now())
+        end = np.where(closed, np.append(ts[1:], 0), np.maximum(until, ts))
+        start_mask = new == (code if code is not None else -1)
+        rows = self._rows_of(keys[start_mask], self._index(self._fleet(store)[0]))
+        spans = pd.DataFrame({
+            'row': rows,
+            'start': ts[start_mask].astype('datetime64[ms]'),
+            'end': end[start_mask].astype('datetime64[ms]'),
+            'days': (end[start_mask] - ts[start_mask]) / _DAY_MS,
+            'open': ~closed[start_mask],
+        })
+        return spans[spans['row'] >= 0].reset_index(drop=True)
+
+    def transitions(self, store, value='неисправен', field='status'):
+        """Переходы в value поля field: DataFrame (row, time) в порядке событий."""
+        code = self.code_of.get(value, -1)
+        mask = (self._column('fields') == HISTORY_FIELDS.index(field)) & (self._column('new') == code)
+        rows = self._rows_of(self._column('keys')[mask], self._index(self._fleet(store)[0]))
+        found = pd.DataFrame({'row': rows, 'time': self._column('ts')[mask].astype('datetime64[ms]')})
+        return found[found['row'] >= 0].reset_index(drop=True)
+
+# ===================== Фоновая запись =====================
+
+class PersistenceWorker(threading.Thread):
+    """
+    Поток, в котором выполняется вся запись на диск. Задачи приходят через очередь,
+    пачка задач, пришедших за debounce секунд, сливается в одну запись:
+    изменения дописываются в журнал одним fsync, несколько сверток - в одну.
+    Результаты складываются в очередь results (kind, ok, message),
+    GUI забирает их из своего потока через master.after - Tk из этого потока не трогаем.
+    У 'import_existing' вместо сообщения - (порция, строки базы): IMEI порции, которые
+    уже были в SQLite; хранилище в памяти должно взять строки базы (restore_existing).
+    """
+
+    def __init__(self, journal, json_file='equipment_data.json', csv_file='equipment_data.csv',
+                 jsonl_file='equipment_data.jsonl', snapshot_file=SNAPSHOT_FILE, debounce=0.5, backend=None,
+                 shards_dir=None, history=None):
+        super().__init__(name='persistence', daemon=True)
+        self.journal = journal
+        self.history = history  # ChangeHistory: события правок и снимки состояния при свертке
+        self.backend = backend  # SqliteBackend: изменения - строками в базу, свертка - полная замена
+        self.shards_dir = shards_dir  # свертка - в файлы по филиалам вместо JSON, CSV и снимка
+        self.json_file = json_file
+        self.csv_file = csv_file
+        self.jsonl_file = jsonl_file
+        self.snapshot_file = snapshot_file
+        self.debounce = debounce
+        self.results = queue.Queue()
+        self._tasks = queue.Queue()
+        self._existing = []   # (порция импорта, IMEI, которые уже были в базе) текущей пачки
+
+    # --- вызываются из потока GUI ---
+    def submit_change(self, eq):
+        # запись сериализуется сразу, пока поток GUI не изменил ее снова
+        self._tasks.put(('append', eq.to_dict()))
+
+    def submit_history(self, events):
+        # пачка ChangeHistory.record(); в памяти история уже обновлена
+        self._tasks.put(('history', events))
+
+    def submit_import(self, added):
+        # порция массового импорта (apply_accepted) - дописывается в базу SQLite без ее перезаписи
+        self._tasks.put(('import', added))
+
+    def submit_compact(self, store):
+        # копия столбцов - моментальный снимок; изменения после него попадут в журнал
+        self._tasks.put(('compact', store.snapshot()))
+        if self.history is not None and self.history.snapshot_due():
+            self._tasks.put(('history_snapshot', self.history.snapshot(store)))
+
+    def submit_save(self, fmt, store):
+        self._tasks.put(('save', fmt, store.snapshot()))
+
+    def flush(self, timeout=None):
+        """Ждет, пока все поставленные задачи будут записаны."""
+        done = threading.Event()
+        self._tasks.put(('flush', done))
+        return done.wait(timeout)
+
+    def stop(self, timeout=None):
+        self._tasks.put(('stop',))
+        self.join(timeout)
+
+    # --- поток записи ---
+    def run(self):
+        running = True
+        while running:
+            batch = [self._tasks.get()]
+            deadline = time.monotonic() + self.debounce
+            while batch[-1][0] not in ('flush', 'stop'):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._tasks.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            running = self._process(batch)
+        if self.backend is not None:
+            self.backend.close()
+
+    def _process(self, batch):
+        # все изменения до последней свертки уже попали в ее снимок;
+        # если свертка не удалась (нет места, нет прав), они пишутся в журнал, как и остальные
+        last_compact = max((i for i, t in enumerate(batch) if t[0] == 'compact'), default=-1)
+        compacted = last_compact >= 0 and self._run('compact', self._compact, batch[last_compact][1])
+        for task in batch[last_compact + 1 if compacted else 0:]:
+            if task[0] == 'import':
+                # до правок: правка импортированной строки идет после ее вставки
+                self._run('import', self._import, task[1])
+        appends = [t[1] for t in batch[last_compact + 1 if compacted else 0:] if t[0] == 'append']
+        if appends:
+            write = self.backend.upsert_records if self.backend is not None else self.journal.append_records
+            self._run('append', write, appends)
+        # строки базы для IMEI, которые в ней уже были, - после правок этой пачки, чтобы окно их не откатило
+        existing, self._existing = self._existing, []
+        for added, imeis in existing:
+            try:
+                rows = self.backend.rows_by_imei(imeis)
+            except Exception as e:
+                self.results.put(('import', False, str(e)))
+            else:
+                self.results.put(('import_existing', True, (added, rows)))
+        events = [t[1] for t in batch if t[0] == 'history']
+        if events:
+            self._run('history', self.history.write, events)
+        for task in batch:
+            if task[0] == 'history_snapshot':
+                # после событий: снимок не должен опережать записанную историю
+                self._run('history_snapshot', self.history.write_snapshot, *task[1])
+            if task[0] == 'save':
+                self._run('save_' + task[1], self._save, task[1], task[2])
+        running = True
+        for task in batch:
+            if task[0] == 'flush':
+                task[1].set()
+            elif task[0] == 'stop':
+                running = False
+        return running
+
+    def _run(self, kind, func, *args):
+        """Выполняет задачу, результат - в results. Возвращает True, если она прошла без ошибки."""
+        try:
+            with metrics.timer('saver_' + kind, rows=len(args[-1])):
+                func(*args)
+        except Exception as e:
+            self.results.put((kind, False, str(e)))
+            return False
+        self.results.put((kind, True, None))
+        return True
+
+    def _compact(self, items):
+        if self.backend is not None:
+            self.backend.replace_all(items)
+            # правки с SQLite в журнал не пишутся; в нем мог остаться хвост из работы с файлами,
+            # и при переносе данных в базу он уже учтен
+            self.journal.reset()
+            return
+        if self.shards_dir is not None:
+            save_shards(items, self.shards_dir)
+            self.journal.reset()
+            return
+        write_json(items, self.json_file)
+        write_csv(items, self.csv_file)
+        # бинарный снимок - после JSON: при запуске он берется, только если не старее JSON
+        write_snapshot(items, self.snapshot_file)
+        self.journal.reset()
+
+    def _import(self, added):
+        rows = self.backend.insert_rows(import_tuples(added))
+        if rows:
+            self._existing.append((added, [row[1] for row in rows]))
+
+    def _save(self, fmt, items):
+        if fmt == 'csv':
+            write_csv(items, self.csv_file)
+        elif fmt == 'jsonl':
+            write_jsonl(items, self.jsonl_file)
+        else:
+            write_json(items, self.json_file)
 
 # ===================== analysis.py: функции анализа и визуализации =====================
 
-def top_branches_defective(equipments, top_n=10):
-    """Выводит топ N филиалов по числу неисправных устройств."""
+def equipment_frame(equipments):
+    """
+    Типизированный DataFrame по записям (категории, дата - datetime64).
+    У хранилища - общий кэш EquipmentStore.frame(), его нельзя изменять.
+    """
+    if isinstance(equipments, EquipmentStore):
+        return equipments.frame()
     df = pd.DataFrame([eq.to_dict() for eq in equipments])
-    if df.empty or 'status' not in df:
-        messagebox.showinfo("Информация", "Нет данных для отображения.")
-        return
+    if df.empty:
+        return df
+    df = df.astype({name: 'category' for name in CATEGORY_FIELDS})
+    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce')
+    return df
+
+@timed('defective_by_branch', rows=0)
+def defective_by_branch(equipments, top_n=10):
+    """
+    Серия филиал -> число неисправных устройств (топ N по убыванию).
+    None - данных нет совсем. Для SqliteBackend подсчет идет в SQL, для ServiceClient - в сервисе.
+    """
+    if isinstance(equipments, (EquipmentStore, ServiceClient)):
+        if not len(equipments):
+            return None
+        # готовые счетчики: топ N кучей, без DataFrame и без обхода записей
+        top = heapq.nlargest(top_n, equipments.defective_counts().items(), key=lambda kv: kv[1])
+        return pd.Series([cnt for _, cnt in top], index=[b for b, _ in top], name='count', dtype='int64')
+    if isinstance(equipments, SqliteBackend):
+        if not equipments.has_data():
+            return None
+        # статусы хранятся в нижнем регистре, а lower() в SQLite кириллицу не понижает
+        rows = equipments.group_count(['branch'], "instr(status, 'неисправен') > 0", top_n=top_n)
+        return pd.Series([cnt for _, cnt in rows], index=[b for b, _ in rows], name='count', dtype='int64')
 
+    df = equipment_frame(equipments)
+    if df.empty or 'status' not in df:
+        return None
     faulty_mask = df['status'].str.lower().str.contains('неисправен', na=False)
-    df_faulty = df[faulty_mask]
-    if df_faulty.empty:
-        messagebox.showinfo("Информация", "Нет неисправных устройств.")
-        return
+    counts = df[faulty_mask]['branch'].value_counts()
+    return counts[counts > 0].head(top_n)   # у категорий в подсчет попадают и пустые значения
+
+@timed('brand_condition_pivot', rows=0)
+def brand_condition_pivot(equipments, start=PIVOT_START):
+    """
+    Таблица бренд x состояние с числом устройств, у которых дата не раньше start.
+    None - данных нет совсем. Для SqliteBackend группировка идет в SQL, для ServiceClient - в сервисе,
+    у хранилища при start=PIVOT_START берутся готовые счетчики.
+    """
+    if isinstance(equipments, EquipmentStore) and start == PIVOT_START:
+        if not len(equipments):
+            return None
+        counts = pd.DataFrame([(b, c, cnt) for (b, c), cnt in equipments.brand_condition_counts().items()],
+                              columns=['brand', 'condition', 'count'])
+    elif isinstance(equipments, ServiceClient):
+        if not len(equipments):
+            return None
+        counts = pd.DataFrame([(b, c, cnt) for (b, c), cnt in equipments.brand_condition_counts(start).items()],
+                              columns=['brand', 'condition', 'count'])
+    elif isinstance(equipments, SqliteBackend):
+        if not equipments.has_data():
+            return None
+        # даты хранятся как 'YYYY-MM-DD', пустая дата меньше любой
+        rows = equipments.group_count(['brand', 'condition'], "date >= ?", (start,))
+        counts = pd.DataFrame(rows, columns=['brand', 'condition', 'count'])
+    else:
+        df = equipment_frame(equipments)
+        if df.empty:
+            return None
+        df_filtered = df[df['date'] >= pd.Timestamp(start)]
+        counts = df_filtered.groupby(['brand', 'condition'], observed=True).size().reset_index(name='count')
+        counts = counts.astype({'brand': str, 'condition': str})
+    if counts.empty:
+        return pd.DataFrame()
+    return counts.pivot(index='brand', columns='condition', values='count').fillna(0)
+
+ROLLUP_MONTHS = 36  # динамика по умолчанию - за последние 3 года
+
+def last_months(months, today=None):
+    """Границы [start, end) последних months месяцев, включая текущий: ('YYYY-MM', 'YYYY-MM')."""
+    end = month_number(today or date.today()) + 1
+    return month_label(end - months), month_label(end)
+
+@timed('condition_dynamics', rows=0)
+def condition_dynamics(equipments, by='condition', months=ROLLUP_MONTHS, today=None, **filters):
+    """
+    Число устройств по месяцам установки за последние months месяцев: DataFrame месяцы x значения by
+    (by=None - один столбец 'count'), фильтры - как у RollupCube.series. Состояние, статус и
+    филиал - текущие: это срез парка по месяцу установки, а не история изменений
+    (ее дают failure_counts и time_in_state). У хранилища - по его
+    RollupCube, для ServiceClient - в сервисе, список записей сводится во временном хранилище.
+    """
+    start, end = last_months(months, today)
+    if isinstance(equipments, ServiceClient):
+        return equipments.rollup_series(by, start, end, **filters)
+    if not isinstance(equipments, EquipmentStore):
+        equipments = EquipmentStore(equipments)
+    return equipments.rollup().series(by, start, end, **filters)
+
+TIME_IN_STATE_COLUMNS = ('случаев', 'среднее, дн.', 'медиана, дн.', 'сейчас')
+
+@timed('time_in_state', rows=1)
+def time_in_state(history, store, value='ремонт', field='condition', by='brand', include_open=False):
+    """
+    Сколько дней устройства проводят в value (по умолчанию - в ремонте) по текущим значениям поля by:
+    завершенных случаев, среднее и медиана дней, сколько сейчас в value. С include_open в среднее
+    входят и незавершенные случаи (по сегодняшний день).
+    """
+    spans = history.spans(store, value, field)
+    spans['group'] = store.frame().loc[spans['row'], by].astype(str).to_numpy()
+    done = spans if include_open else spans[~spans['open']]
+    result = done.groupby('group')['days'].agg(['count', 'mean', 'median'])
+    result = result.join(spans.groupby('group')['open'].sum(), how='outer').fillna({'count': 0, 'open': 0})
+    result.columns = TIME_IN_STATE_COLUMNS
+    return result.astype({'случаев': 'int64', 'сейчас': 'int64'}).rename_axis(by).round(1)
+
+@timed('failure_counts', rows=1)
+def failure_counts(history, store, by='brand', value='неисправен', field='status'):
+    """Переходы в value (по умолчанию - поломки) по месяцам и текущим значениям поля by: DataFrame месяцы x значения."""
+    found = history.transitions(store, value, field)
+    found['month'] = found['time'].dt.to_period('M').dt.to_timestamp()
+    found['group'] = store.frame().loc[found['row'], by].astype(str).to_numpy()
+    return pd.crosstab(found['month'], found['group']).rename_axis(index='month', columns=by)
+
+@timed('warranty_report', rows=0)
+def warranty_report(store, within_days=30, today=None):
+    """
+    Отчет по гарантии: (сводка по филиалам, список устройств). В списке - у кого гарантия
+    закончится в ближайшие within_days дней и у кого она завершена, а устройство еще установлено.
+    """
+    today = today or date.today().toordinal()
+    index = store.warranty()
+    groups = [
+        (f"истекает в ближайшие {within_days} дн.", index.expiring(within_days, today)),
+        ("завершена, установлено", index.expired(today, condition='установлен')),
+    ]
+    frame = store.frame()
+    left = index.days_left(today)
+    parts = []
+    for group, rows in groups:
+        rows = np.asarray(rows, dtype=np.int64)
+        part = frame.loc[rows].reset_index(drop=True)   # индекс кадра - номер строки (после sort_by порядок другой)
+        part.insert(0, 'group', group)
+        part['date'] = part['date'].dt.strftime('%Y-%m-%d')
+        part['expires'] = ordinals_to_datetime64(left[rows].astype(np.int64) + today)
+        part['expires'] = part['expires'].dt.strftime('%Y-%m-%d')
+        part['days_left'] = left[rows].astype(np.int64)
+        parts.append(part)
+    devices = pd.concat(parts, ignore_index=True)
+    return index.summary(within_days, today), devices
+
+def write_warranty_report(store, filename, within_days=30, today=None):
+    """Пишет список устройств отчета по гарантии в CSV (UTF-8 BOM, как основная база). Возвращает отчет."""
+    summary, devices = warranty_report(store, within_days, today)
+    devices.to_csv(filename, index=False, encoding='utf-8-sig')
+    return summary, devices
 
-    result = df_faulty['branch'].value_counts().head(top_n)
+def _figure(fig, figsize):
+    """Новая фигура pyplot (fig=None) или очищенная фигура окна - график рисуется на ее месте."""
+    if fig is None:
+        return plt.figure(figsize=figsize)
+    fig.clear()
+    return fig
+
+@timed('draw_warranty')
+def warranty_figure(summary, within_days=30, fig=None):
+    """Гарантия по филиалам: сложенные столбцы на гарантии / завершена и отметка истекающих."""
+    fig = _figure(fig, (10, 6))
+    ax = fig.subplots()
+    summary[['на гарантии', 'завершена']].plot(kind='bar', stacked=True, color=['green', 'gray'], ax=ax)
+    ax.plot(range(len(summary)), summary['истекает'], 'o', color='red',
+            label=f"истекает за {within_days} дн.")
+    ax.set_title("Гарантия по филиалам")
+    ax.set_ylabel("Количество")
+    ax.legend()
+    ax.grid(axis='y', linestyle='--')
+    fig.tight_layout()
+    return fig
 
+@timed('draw_top_defective')
+def top_defective_figure(result, top_n=10, fig=None):
+    """Столбчатая диаграмма топ N филиалов по неисправным."""
     # Правильно: создаем фигуру и ось, и рисуем на ней
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = _figure(fig, (10, 6))
+    ax = fig.subplots()
     result.plot(kind='bar', color='red', ax=ax)
     ax.set_title(f"Топ {top_n} филиалов по количеству неисправных устройств")
     ax.set_ylabel("Количество")
     ax.grid(color='red', linestyle='--', linewidth='1')
     ax.grid(axis='x')
     fig.tight_layout()
-    plt.show()
-def dynamics_by_condition(equipments):
-    """Выводит количество устройств по брендам, начиная с 2000 года."""
-    df = pd.DataFrame([eq.to_dict() for eq in equipments])
-    if df.empty:
-        messagebox.showinfo("Информация", "Нет данных для отображения.")
-        return
-
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')
-    start_date = pd.Timestamp('2000-01-01')
-    df_filtered = df[df['date'] >= start_date]
-    if df_filtered.empty:
-        messagebox.showinfo("Информация", "Нет данных начиная с 2000 года.")
-        return
-
-
-    counts = df_filtered.groupby(['brand', 'condition']).size().reset_index(name='count')
-    pivot_table = counts.pivot(index='brand', columns='condition', values='count').fillna(0)
+    return fig
 
+@timed('draw_brand_condition')
+def brand_condition_figure(pivot_table, fig=None):
+    """Сложенная диаграмма бренд x состояние и круговая по брендам."""
     # Создаем фигуру и оси для двух графиков
-    fig, (ax1, ax2) = plt.subplots(nrows=1, ncols=2, figsize=(12, 8))
+    fig = _figure(fig, (12, 8))
+    ax1, ax2 = fig.subplots(nrows=1, ncols=2)
 
     # Столбчатая диаграмма
     pivot_table.plot(kind='bar', stacked=True, colormap='tab20', ax=ax1)
@@ -160,14 +3318,112 @@ def dynamics_by_condition(equipments):
     ax2.pie(total_counts, labels=total_counts.index, autopct='%1.1f%%', startangle=120, explode=explode,
             colors=plt.cm.tab20.colors)
     ax2.set_title("Доля устройств по брендам")
-    plt.axis('equal')  # Убедимся, что круг правильной формы
+    ax2.axis('equal')  # Убедимся, что круг правильной формы
 
     # Улучшаем отображение
     fig.tight_layout()
+    return fig
+
+DYNAMICS_TITLES = {'branch': 'Филиал', 'brand': 'Бренд', 'condition': 'Состояние', 'status': 'Статус'}
+
+def _plot_monthly(ax, frame, title):
+    """Линия по месяцам на каждый столбец frame (значение поля)."""
+    if len(frame.columns):
+        frame.plot(ax=ax, colormap='tab10', marker='.')
+        ax.legend(title=DYNAMICS_TITLES.get(frame.columns.name))
+    ax.set_title(title)
+    ax.set_xlabel("Месяц установки")
+    ax.set_ylabel("Количество")
+    ax.grid(linestyle='--')
+
+@timed('draw_dynamics')
+def dynamics_figure(by_condition, faulty_by_branch, top_n=5, fig=None):
+    """Текущее состояние по месяцам установки: устройства по состояниям и неисправные в топ N филиалах."""
+    fig = _figure(fig, (12, 8))
+    ax1, ax2 = fig.subplots(nrows=2, ncols=1, sharex=True)
+    _plot_monthly(ax1, by_condition, "Текущее состояние устройств по месяцам установки")
+    top = faulty_by_branch.sum().nlargest(top_n).index
+    _plot_monthly(ax2, faulty_by_branch[top], f"Неисправные сейчас по месяцам установки, топ {top_n} филиалов")
+    fig.tight_layout()
+    return fig
+
+@timed('draw_dynamics')
+def dynamics_series_figure(frame, fig=None):
+    """Одна таблица condition_dynamics линиями по месяцам (для командной строки)."""
+    fig = _figure(fig, (12, 6))
+    ax = fig.subplots()
+    _plot_monthly(ax, frame, "Устройства по месяцам установки (текущие значения полей)")
+    fig.tight_layout()
+    return fig
+
+def _prepare_top_defective(source, top_n=10):
+    """Данные для топа филиалов по неисправным или текст сообщения, если рисовать нечего."""
+    result = defective_by_branch(source, top_n)
+    if result is None:
+        return "Нет данных для отображения."
+    if result.empty:
+        return "Нет неисправных устройств."
+    return result
+
+def _prepare_dynamics(source, months=ROLLUP_MONTHS):
+    """Текущее состояние и неисправные по филиалам по месяцам установки или текст сообщения."""
+    by_condition = condition_dynamics(source, 'condition', months)
+    if by_condition.empty:
+        return f"Нет устройств, установленных за последние {months} мес."
+    return by_condition, condition_dynamics(source, 'branch', months, status='неисправен')
+
+def _prepare_brand_condition(source):
+    """Сводная бренд x состояние или текст сообщения."""
+    pivot_table = brand_condition_pivot(source)
+    if pivot_table is None:
+        return "Нет данных для отображения."
+    if pivot_table.empty:
+        return "Нет данных начиная с 2000 года."
+    return pivot_table
+
+def _prepare_warranty(source, within_days=30):
+    """Сводка гарантии по филиалам."""
+    return source.warranty().summary(within_days)
+
+# вид графика -> (подготовка данных - можно в другом потоке, рисование на фигуре - только в потоке окна)
+CHARTS = {
+    'top_defective': (_prepare_top_defective,
+                      lambda data, fig, top_n=10: top_defective_figure(data, top_n, fig)),
+    'dynamics': (_prepare_dynamics,
+                 lambda data, fig, months=ROLLUP_MONTHS: dynamics_figure(*data, fig=fig)),
+    'brand_condition': (_prepare_brand_condition,
+                        lambda data, fig: brand_condition_figure(data, fig)),
+    'warranty': (_prepare_warranty,
+                 lambda data, fig, within_days=30: warranty_figure(data, within_days, fig)),
+}
+
+def _show_chart(kind, source, **params):
+    """График в отдельном окне pyplot: данные и рисование в текущем потоке."""
+    prepare, draw = CHARTS[kind]
+    data = prepare(source, **params)
+    if isinstance(data, str):
+        messagebox.showinfo("Информация", data)
+        return
+    draw(data, None, **params)
     plt.show()
 
+def top_branches_defective(equipments, top_n=10):
+    """Выводит топ N филиалов по числу неисправных устройств."""
+    _show_chart('top_defective', equipments, top_n=top_n)
+
+def dynamics_by_condition(equipments, months=ROLLUP_MONTHS):
+    """Выводит текущее состояние устройств, установленных за последние months месяцев, по месяцам установки."""
+    _show_chart('dynamics', equipments, months=months)
+
+def brand_condition_chart(equipments):
+    """Выводит количество устройств по брендам, начиная с 2000 года."""
+    _show_chart('brand_condition', equipments)
+
+@timed('sort_equipments_by', rows=1)
 def sort_equipments_by(field, equipments):
-    """Сортирует список Equipment по заданному полю."""
+    """Сортирует список Equipment по заданному полю (у хранилища - по готовому SortedView)."""
+    if isinstance(equipments, EquipmentStore):
+        return list(equipments.sorted_view(field)) if field in SortedView.FIELDS else list(equipments)
     if field == 'date':
         return sorted(equipments, key=lambda eq: eq.date or datetime.min)
     elif field == 'condition':
@@ -199,45 +3455,603 @@ def validate_fields(d: dict):
     Преобразует к нижнему регистру и проверяет ограничения.
     Возвращает (ok, err_msg_or_none, normalized_dict)
     """
-    out = {k: normalize(v) for k, v in d.items()}
+    out = {k: normalize(v) for k, v in d.items()}
+
+    # обязательные поля
+    required = ['branch', 'imei', 'brand', 'model', 'status', 'condition', 'location', 'date']
+    missing = [r for r in required if not out.get(r)]
+    if missing:
+        return False, f"Заполните поля: {', '.join(missing)}", None
+
+    # буквы (кириллица) для этих полей
+    for k in ['branch', 'brand', 'status', 'condition', 'location']:
+        if not is_cyrillic_letters(out[k]):
+            return False, f"Поле '{k}' должно содержать только буквы кириллицы без пробелов и знаков.", None
+
+    # цифры только
+    for k in ['imei', 'model']:
+        if not is_digits(out[k]):
+            return False, f"Поле '{k}' должно содержать только цифры.", None
+
+    # дополнительные проверки IMEI (если нужно ограничение длины)
+    if not (3 <= len(out['imei']) <= 15):
+        return False, "Длина IMEI должна быть от 3 до 15 цифр.", None
+
+    # перечислимые значения
+    if out['status'] not in ALLOWED_STATUS:
+        return False, f"Недопустимый статус. Разрешено: {', '.join(sorted(ALLOWED_STATUS))}.", None
+    if out['condition'] not in ALLOWED_CONDITION:
+        return False, f"Недопустимое состояние. Разрешено: {', '.join(sorted(ALLOWED_CONDITION))}.", None
+    if out['location'] not in ALLOWED_LOCATION:
+        return False, f"Недопустимое расположение. Разрешено: {', '.join(sorted(ALLOWED_LOCATION))}.", None
+
+    # дата формата YYYY-MM-DD
+    try:
+        datetime.strptime(out['date'], '%Y-%m-%d')
+    except Exception:
+        return False, "Неверный формат даты. Используйте YYYY-MM-DD.", None
+
+    return True, None, out
+
+EDITABLE_FIELDS = {'status': ALLOWED_STATUS, 'condition': ALLOWED_CONDITION, 'location': ALLOWED_LOCATION}
+
+def validate_edit(d: dict):
+    """
+    Правка записи: только статус, состояние и расположение (как в диалоге редактирования).
+    Возвращает (ok, err_msg_or_none, normalized_dict)
+    """
+    out = {}
+    for k, v in d.items():
+        allowed = EDITABLE_FIELDS.get(k)
+        if allowed is None:
+            return False, f"Поле '{k}' нельзя изменить. Разрешено: {', '.join(EDITABLE_FIELDS)}.", None
+        v = normalize(v)
+        if not is_cyrillic_letters(v) or v not in allowed:
+            return False, f"Недопустимое значение поля '{k}'. Разрешено: {', '.join(sorted(allowed))}.", None
+        out[k] = v
+    return True, None, out
+
+# ===================== Массовый импорт =====================
+
+BULK_CHUNK_ROWS = 250000
+_DATE_LIKE = r'\d{4}-\d{1,2}-\d{1,2}'
+
+class ImportReport:
+    """Итог массового импорта: сколько строк прочитано и принято, таблица отклоненных с причинами."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.total = 0
+        self.accepted = 0
+        self._rejected = []   # DataFrame'ы со столбцами line, поля записи, reason
+
+    def add_rejected(self, df):
+        if not df.empty:
+            self._rejected.append(df)
+
+    @property
+    def rejected_count(self):
+        return sum(len(df) for df in self._rejected)
+
+    def rejected(self):
+        if not self._rejected:
+            return pd.DataFrame(columns=['line', *EQUIPMENT_FIELDS, 'reason'])
+        return pd.concat(self._rejected, ignore_index=True).sort_values('line', kind='stable')
+
+    def save_rejected(self, filename=None):
+        """Пишет отклоненные строки в CSV (по умолчанию <файл>.rejected.csv). Возвращает имя файла."""
+        filename = filename or os.path.splitext(self.filename)[0] + '.rejected.csv'
+        self.rejected().to_csv(filename, index=False, encoding='utf-8-sig')
+        return filename
+
+    def summary(self):
+        return (f"{self.filename}: прочитано {self.total}, принято {self.accepted}, "
+                f"отклонено {self.rejected_count}")
+
+def _mark(reasons, mask, message):
+    """Причина ставится только строкам, у которых ее еще нет - как первая ошибка в validate_fields."""
+    reasons[mask & reasons.isna()] = message
+
+def validate_frame(df):
+    """
+    Векторная проверка по правилам validate_fields. Принимает столбцы-строки,
+    возвращает (нормализованный DataFrame, Series причин: NaN - строка верна, дата - ordinal в 'ordinal').
+    """
+    out = pd.DataFrame({k: (df[k] if k in df else pd.Series('', index=df.index)).astype(str)
+                        .str.strip().str.lower() for k in EQUIPMENT_FIELDS}, index=df.index)
+    reasons = pd.Series(np.nan, index=df.index, dtype=object)
+
+    # обязательные поля: в сообщении перечисляются все пустые, как в validate_fields
+    empty = {k: out[k] == '' for k in EQUIPMENT_FIELDS}
+    missing = pd.Series('', index=df.index)
+    for k in EQUIPMENT_FIELDS:
+        missing = missing.where(~empty[k], missing + np.where(missing == '', k, ', ' + k))
+    _mark(reasons, missing != '', 'Заполните поля: ' + missing)
+
+    # кириллица: значений с малой кардинальностью мало - проверяются уникальные, затем isin
+    for k in ['branch', 'brand', 'status', 'condition', 'location']:
+        good = [u for u in out[k].unique() if is_cyrillic_letters(u)]
+        _mark(reasons, ~out[k].isin(good),
+              f"Поле '{k}' должно содержать только буквы кириллицы без пробелов и знаков.")
+
+    # \d в re - это ровно isdecimal
+    for k in ['imei', 'model']:
+        _mark(reasons, ~out[k].str.isdecimal(), f"Поле '{k}' должно содержать только цифры.")
+
+    imei_len = out['imei'].str.len()
+    _mark(reasons, (imei_len < 3) | (imei_len > 15), "Длина IMEI должна быть от 3 до 15 цифр.")
+
+    _mark(reasons, ~out['status'].isin(ALLOWED_STATUS),
+          f"Недопустимый статус. Разрешено: {', '.join(sorted(ALLOWED_STATUS))}.")
+    _mark(reasons, ~out['condition'].isin(ALLOWED_CONDITION),
+          f"Недопустимое состояние. Разрешено: {', '.join(sorted(ALLOWED_CONDITION))}.")
+    _mark(reasons, ~out['location'].isin(ALLOWED_LOCATION),
+          f"Недопустимое расположение. Разрешено: {', '.join(sorted(ALLOWED_LOCATION))}.")
+
+    parsed = pd.to_datetime(out['date'], format='%Y-%m-%d', errors='coerce')
+    ordinal = pd.Series(0, index=df.index, dtype='int64')
+    ok = parsed.notna()
+    ordinal[ok] = parsed[ok].values.astype('datetime64[D]').astype('int64') + _ORDINAL_1970
+    # даты вне диапазона pandas проверяются по одной, как в validate_fields
+    retry = ~ok & out['date'].str.fullmatch(_DATE_LIKE)
+    for i in out.index[retry]:
+        ordinal[i] = parse_date_ordinal(out.at[i, 'date'])
+    _mark(reasons, ordinal == 0, "Неверный формат даты. Используйте YYYY-MM-DD.")
+    out['ordinal'] = ordinal
+    return out, reasons
+
+def existing_imei_keys(store):
+    """Ключи IMEI хранилища (int64: число * 32 + длина) для проверки повторов одним isin."""
+    col = store._table.cols['imei']
+    widths = np.frombuffer(col.widths, dtype=np.int8)
+    nums = np.frombuffer(col.nums, dtype=np.int64)
+    usable = (widths >= 3) & (widths <= 15)   # другие IMEI с верными из файла совпасть не могут
+    return nums[usable] * 32 + widths[usable]
+
+def _imei_keys(imei):
+    return imei.astype('int64').to_numpy() * 32 + imei.str.len().to_numpy()
+
+def bulk_validate_csv(filename, existing_keys, report, chunk_size=BULK_CHUNK_ROWS):
+    """
+    Читает CSV порциями, проверяет их векторно и отсеивает повторы IMEI (в файле и в базе)
+    хэш-соединением по ключам. Генератор принятых порций; отклоненные - в report.
+    """
+    in_base = pd.Index(existing_keys)
+    in_file = pd.Index([], dtype='int64')   # ключи принятых строк прежних порций
+    chunks = pd.read_csv(filename, dtype=str, keep_default_na=False, encoding='utf-8-sig',
+                         chunksize=chunk_size)
+    for chunk in chunks:
+        line = chunk.index.to_series() + 2   # строка 1 - заголовок
+        report.total += len(chunk)
+        out, reasons = validate_frame(chunk)
+
+        valid = reasons.isna()
+        ascii_imei = out['imei'].str.isascii()
+        keys = pd.Series(-1, index=out.index, dtype='int64')
+        keys[valid & ascii_imei] = _imei_keys(out.loc[valid & ascii_imei, 'imei'])
+        dup_base = valid & ascii_imei & keys.isin(in_base)
+        _mark(reasons, dup_base, "Этот IMEI уже существует в базе.")
+        valid = reasons.isna()
+        # повтор ищется только среди верных строк: отклоненная строка не занимает IMEI
+        dup_file = valid & (out['imei'].where(valid).duplicated(keep='first') | (ascii_imei & keys.isin(in_file)))
+        _mark(reasons, dup_file, "IMEI повторяется в файле.")
+        valid = reasons.isna()
+
+        bad = ~valid
+        if bad.any():
+            rejected = chunk.loc[bad].reindex(columns=list(EQUIPMENT_FIELDS), fill_value='')
+            rejected.insert(0, 'line', line[bad])
+            rejected['reason'] = reasons[bad]
+            report.add_rejected(rejected)
+        accepted = out.loc[valid]
+        in_file = in_file.append(pd.Index(keys[valid & ascii_imei]))
+        yield accepted.assign(line=line[valid])
+
+def frame_rows(accepted):
+    """Принятая порция -> кортежи для EquipmentStore.append_rows."""
+    cols = [accepted[k].tolist() for k in EQUIPMENT_FIELDS[:-1]] + [accepted['ordinal'].tolist()]
+    return zip(*cols)
+
+def apply_accepted(store, accepted, report):
+    """
+    Добавляет принятую порцию; строки, чей IMEI успел появиться в базе, уходят в отклоненные.
+    Возвращает добавленную часть порции.
+    """
+    skipped = store.append_rows(frame_rows(accepted))
+    report.accepted += len(accepted) - len(skipped)
+    if not skipped:
+        return accepted
+    rejected = accepted.iloc[skipped][['line', *EQUIPMENT_FIELDS]].copy()
+    rejected['reason'] = "Этот IMEI уже существует в базе."
+    report.add_rejected(rejected)
+    return accepted.drop(accepted.index[skipped])
+
+def import_tuples(added):
+    """Добавленная порция -> кортежи для SqliteBackend.insert_rows (дата - 'YYYY-MM-DD')."""
+    return [values[:-1] + (ordinal_to_str(values[-1]),) for values in frame_rows(added)]
+
+def restore_existing(store, added, rows, report=None):
+    """
+    Строки импорта, чей IMEI уже был в базе SQLite, хотя в памяти его не было (базу правили
+    извне): база главнее - ее строки rows возвращаются в хранилище, а строки файла
+    из порции added уходят в отклоненные.
+    """
+    for row in rows:
+        store.upsert(Equipment.from_dict(dict(zip(EQUIPMENT_FIELDS, row))))
+    if report is not None:
+        rejected = added.loc[added['imei'].isin({row[1] for row in rows}), ['line', *EQUIPMENT_FIELDS]].copy()
+        rejected['reason'] = "Этот IMEI уже существует в базе."
+        report.accepted -= len(rejected)
+        report.add_rejected(rejected)
+
+@timed('bulk_import_csv', rows=lambda result, args: result.total)
+def bulk_import_csv(filename, store, chunk_size=BULK_CHUNK_ROWS, backend=None):
+    """
+    Массовый импорт CSV в хранилище с векторной проверкой. Возвращает ImportReport.
+    С backend (SqliteBackend) добавленные строки сразу дописываются и в базу.
+    """
+    report = ImportReport(filename)
+    for accepted in bulk_validate_csv(filename, existing_imei_keys(store), report, chunk_size):
+        added = apply_accepted(store, accepted, report)
+        if backend is not None and len(added):
+            existing = backend.insert_rows(import_tuples(added))
+            if existing:
+                restore_existing(store, added, existing, report)
+    return report
+
+# ===================== Таблица оборудования =====================
+
+GRID_PAGE_ROWS = 25
+GRID_FILTER_DELAY_MS = 300
+GRID_REFRESH_MS = 500
+
+class EquipmentGrid:
+    """
+    Окно с таблицей всех записей. В Treeview лежит только видимая страница,
+    прокрутка меняет смещение и перерисовывает ее, так что скорость и память
+    не зависят от числа записей. Щелчок по заголовку - сортировка
+    (по возрастанию, по убыванию, снять), строка фильтра - поиск по мере ввода,
+    двойной щелчок - редактирование через on_edit.
+    """
+    COLUMNS = [
+        ('branch', 'Филиал', 130),
+        ('imei', 'IMEI', 140),
+        ('brand', 'Марка', 110),
+        ('model', 'Модель', 70),
+        ('status', 'Статус', 90),
+        ('condition', 'Состояние', 110),
+        ('location', 'Расположение', 100),
+        ('date', 'Дата', 90),
+    ]
+    ALL_FIELDS = 'Все поля'
+
+    def __init__(self, master, store, on_edit, page_rows=GRID_PAGE_ROWS):
+        self.store = store
+        self.on_edit = on_edit
+        self.page_rows = page_rows
+        self.offset = 0
+        self.sort_fields = None
+        self.descending = False
+        self._rows = None  # numpy-массив номеров строк при фильтре; None - все записи
+        self._version = None
+        self._filter_job = None
+        self.closed = False
+
+        self.window = tk.Toplevel(master)
+        self.window.title("Таблица оборудования")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        frame_filter = ttk.Frame(self.window)
+        frame_filter.pack(fill='x', padx=5, pady=5)
+        ttk.Label(frame_filter, text="Фильтр").pack(side='left')
+        self.filter_var = tk.StringVar()
+        ttk.Entry(frame_filter, textvariable=self.filter_var, width=30).pack(side='left', padx=5)
+        self.filter_var.trace_add('write', lambda *args: self._schedule_filter())
+        self.field_var = tk.StringVar(value=self.ALL_FIELDS)
+        field_box = ttk.Combobox(frame_filter, textvariable=self.field_var, state='readonly', width=14,
+                                 values=[self.ALL_FIELDS] + [label for _, label, _ in self.COLUMNS])
+        field_box.pack(side='left')
+        field_box.bind('<<ComboboxSelected>>', lambda event: self._schedule_filter())
+        self.info_label = ttk.Label(frame_filter, text="")
+        self.info_label.pack(side='right')
+
+        frame_table = ttk.Frame(self.window)
+        frame_table.pack(fill='both', expand=True, padx=5, pady=5)
+        self.tree = ttk.Treeview(frame_table, columns=[name for name, _, _ in self.COLUMNS],
+                                 show='headings', height=page_rows, selectmode='browse')
+        for name, label, width in self.COLUMNS:
+            self.tree.heading(name, text=label, command=lambda n=name: self.toggle_sort(n))
+            self.tree.column(name, width=width, anchor='w')
+        # полоса прокрутки управляет смещением страницы, а не самим Treeview
+        self.scrollbar = ttk.Scrollbar(frame_table, orient='vertical', command=self._on_scroll)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self._on_wheel)
+        self.tree.bind('<Next>', lambda event: self._scroll_by(self.page_rows))
+        self.tree.bind('<Prior>', lambda event: self._scroll_by(-self.page_rows))
+        self.tree.bind('<Double-1>', self._on_double_click)
+
+        self.refresh()
+        self.window.after(GRID_REFRESH_MS, self._watch_store)
+
+    def close(self):
+        self.closed = True
+        self.window.destroy()
+
+    def total(self):
+        return len(self._rows) if self._rows is not None else len(self.store)
+
+    def _filter_fields(self):
+        label = self.field_var.get()
+        for name, column_label, _ in self.COLUMNS:
+            if column_label == label:
+                return (name,)
+        return EQUIPMENT_FIELDS
+
+    def _ordered_rows(self):
+        """Все номера строк в текущем порядке показа (numpy) - нужны только для фильтра."""
+        if self.sort_fields:
+            rows = np.array(self.store.sorted_view(*self.sort_fields).rows, dtype=np.int64)
+            return rows[::-1] if self.descending else rows
+        rows = self.store.row_numbers()
+        return np.arange(len(rows)) if isinstance(rows, range) else np.array(rows, dtype=np.int64)
+
+    def _select_rows(self):
+        text = self.filter_var.get().strip()
+        if not text:
+            self._rows = None
+            return
+        mask = self.store.match(text, self._filter_fields())
+        rows = self._ordered_rows()
+        self._rows = rows[mask[rows]]
+
+    def _page_rows(self):
+        """Номера строк видимой страницы."""
+        if self._rows is not None:
+            return self._rows[self.offset:self.offset + self.page_rows].tolist()
+        if self.sort_fields:
+            view = self.store.sorted_view(*self.sort_fields)
+            return view.row_numbers(self.offset, self.page_rows, self.descending)
+        return self.store.row_numbers(self.offset, self.page_rows)
+
+    def refresh(self):
+        """Заново отбирает строки по фильтру и перерисовывает страницу."""
+        if self.closed:
+            return
+        self._version = self.store.version
+        self._select_rows()
+        self.render()
+
+    def render(self):
+        total = self.total()
+        self.offset = max(0, min(self.offset, total - self.page_rows))
+        self.tree.delete(*self.tree.get_children())
+        for row in self._page_rows():
+            self.tree.insert('', 'end', iid=str(row), values=self.store.row(row).to_tuple())
+        if total:
+            last = min(total, self.offset + self.page_rows)
+            self.scrollbar.set(self.offset / total, last / total)
+            self.info_label.config(text=f"Записи {self.offset + 1}–{last} из {total}")
+        else:
+            self.scrollbar.set(0, 1)
+            self.info_label.config(text="Нет записей")
+        for name, label, _ in self.COLUMNS:
+            mark = ''
+            if self.sort_fields == (name,):
+                mark = ' ▼' if self.descending else ' ▲'
+            self.tree.heading(name, text=label + mark)
+
+    def scroll_to(self, offset):
+        self.offset = offset
+        self.render()
+
+    def _scroll_by(self, step):
+        self.scroll_to(self.offset + step)
+        return 'break'
+
+    def _on_scroll(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.total()))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self._scroll_by(step * self.page_rows if args[2] == 'pages' else step)
+
+    def _on_wheel(self, event):
+        return self._scroll_by(-3 if event.num == 4 or event.delta > 0 else 3)
+
+    def toggle_sort(self, name):
+        if name not in SortedView.FIELDS:
+            return
+        if self.sort_fields != (name,):
+            self.sort_fields, self.descending = (name,), False
+        elif not self.descending:
+            self.descending = True
+        else:
+            self.sort_fields, self.descending = None, False
+        self.offset = 0
+        self.refresh()
+
+    def _schedule_filter(self):
+        # фильтр применяется после паузы в наборе, а не на каждую букву
+        if self._filter_job is not None:
+            self.window.after_cancel(self._filter_job)
+        self._filter_job = self.window.after(GRID_FILTER_DELAY_MS, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filter_job = None
+        self.offset = 0
+        self.refresh()
+
+    def _watch_store(self):
+        if self.closed:
+            return
+        if self.store.version != self._version:
+            self.refresh()
+        self.window.after(GRID_REFRESH_MS, self._watch_store)
+
+    def _on_double_click(self, event):
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return
+        self.on_edit(self.store.row(int(iid)))
+        self.refresh()
+
+# ===================== Графики в окне =====================
+CHART_CACHE_SIZE = 16   # сколько подготовленных наборов данных держать (вид, параметры, версия)
+
+class ChartWorker(threading.Thread):
+    """
+    Поток подготовки данных графиков (CHARTS): задачи (ключ, вид, источник, параметры) из очереди,
+    результаты (ключ, данные, ошибка) - в results, окно забирает их через master.after.
+    Из нескольких ожидающих задач выполняется только последняя - на экране нужна именно она.
+    Соединение с сервисом открывается на задачу и закрывается после нее.
+    """
+
+    def __init__(self):
+        super().__init__(name='charts', daemon=True)
+        self._tasks = queue.Queue()
+        self.results = queue.Queue()
+
+    def submit(self, key, kind, source, params):
+        """source - хранилище/база/клиент или функция, которая вернет его уже в этом потоке."""
+        self._tasks.put((key, kind, source, params))
+
+    def stop(self):
+        self._tasks.put(None)
+
+    def run(self):
+        while True:
+            task = self._tasks.get()
+            while task is not None:
+                try:
+                    task = self._tasks.get_nowait()
+                except queue.Empty:
+                    break
+            if task is None:
+                return
+            key, kind, source, params = task
+            try:
+                if callable(source):
+                    source = source()
+                with metrics.timer(f'chart_{kind}'):
+                    data = CHARTS[kind][0](source, **params)
+            except Exception as e:
+                self.results.put((key, None, e))
+            else:
+                self.results.put((key, data, None))
+            finally:
+                if isinstance(source, ServiceClient):
+                    source.close()
+
+class ChartCache:
+    """
+    Подготовленные данные графиков по ключу (вид, параметры, версия данных), LRU на size наборов.
+    Версия данных только растет, поэтому с запросом новой версии данные прежних вытесняются,
+    а результат потока графиков для устаревшей версии не кэшируется и не рисуется.
+    version=None (сервис, версия неизвестна) - не кэшируется вовсе.
+    """
 
-    # обязательные поля
-    required = ['branch', 'imei', 'brand', 'model', 'status', 'condition', 'location', 'date']
-    missing = [r for r in required if not out.get(r)]
-    if missing:
-        return False, f"Заполните поля: {', '.join(missing)}", None
+    def __init__(self, size=CHART_CACHE_SIZE):
+        self.size = size
+        self._data = OrderedDict()   # ключ -> данные
+        self._version = None   # версия последнего запроса
+        self.wanted = None     # ключ последнего запроса
+        self.shown = None      # ключ графика на экране
 
-    # буквы (кириллица) для этих полей
-    for k in ['branch', 'brand', 'status', 'condition', 'location']:
-        if not is_cyrillic_letters(out[k]):
-            return False, f"Поле '{k}' должно содержать только буквы кириллицы без пробелов и знаков.", None
+    def __contains__(self, key):
+        return key in self._data
 
-    # цифры только
-    for k in ['imei', 'model']:
-        if not is_digits(out[k]):
-            return False, f"Поле '{k}' должно содержать только цифры.", None
+    def __len__(self):
+        return len(self._data)
 
-    # дополнительные проверки IMEI (если нужно ограничение длины)
-    if not (3 <= len(out['imei']) <= 15):
-        return False, "Длина IMEI должна быть от 3 до 15 цифр.", None
+    def want(self, kind, version, params):
+        """Запоминает запрос как последний. Возвращает его ключ."""
+        key = (kind, tuple(sorted(params.items())), version)
+        self.wanted = key
+        if version is not None and version != self._version:
+            self._version = version
+            for old in [k for k in self._data if k[2] != version]:
+                del self._data[old]
+        return key
 
-    # перечислимые значения
-    if out['status'] not in ALLOWED_STATUS:
-        return False, f"Недопустимый статус. Разрешено: {', '.join(sorted(ALLOWED_STATUS))}.", None
-    if out['condition'] not in ALLOWED_CONDITION:
-        return False, f"Недопустимое состояние. Разрешено: {', '.join(sorted(ALLOWED_CONDITION))}.", None
-    if out['location'] not in ALLOWED_LOCATION:
-        return False, f"Недопустимое расположение. Разрешено: {', '.join(sorted(ALLOWED_LOCATION))}.", None
+    def get(self, key):
+        self._data.move_to_end(key)
+        return self._data[key]
 
-    # дата формата YYYY-MM-DD
-    try:
-        datetime.strptime(out['date'], '%Y-%m-%d')
-    except Exception:
-        return False, "Неверный формат даты. Используйте YYYY-MM-DD.", None
+    def accept(self, key, data):
+        """Результат из потока графиков. True - это последний запрос и его надо нарисовать."""
+        if key[2] is not None and key[2] == self._version:
+            self._data[key] = data
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+        return key == self.wanted
 
-    return True, None, out
+class ChartPanel:
+    """
+    График в главном окне: одна фигура matplotlib на FigureCanvasTkAgg, каждый график
+    рисуется на месте прежнего. Данные готовит ChartWorker; готовые данные хранит ChartCache,
+    так что повторный показ при тех же данных не ждет пересчета.
+    """
+
+    def __init__(self, master, worker):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        self.worker = worker
+        self.frame = ttk.Frame(master)
+        self.frame.pack(fill='both', expand=True, padx=10, pady=5)
+        self.info = ttk.Label(self.frame, text="")
+        self.info.pack(fill='x')
+        self.figure = Figure(figsize=(10, 5))
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.frame)
+        self.canvas.get_tk_widget().pack(fill='both', expand=True)
+        self.cache = ChartCache()
+        self.frame.after(SAVER_POLL_MS, self._poll)
+
+    def show(self, kind, version, make_source, **params):
+        """
+        Показывает график: из кэша сразу, иначе данные готовятся в потоке графиков.
+        version=None - данные не кэшируются (сервис, версия неизвестна);
+        make_source вызывается здесь же только при промахе кэша.
+        """
+        key = self.cache.want(kind, version, params)
+        if version is not None and key == self.cache.shown:
+            return
+        if key in self.cache:
+            self._draw(key, self.cache.get(key))
+            return
+        self.info.config(text="Подготовка графика…")
+        self.worker.submit(key, kind, make_source(), params)
+
+    def _poll(self):
+        while True:
+            try:
+                key, data, error = self.worker.results.get_nowait()
+            except queue.Empty:
+                break
+            if error is not None:
+                if key == self.cache.wanted:
+                    self.info.config(text="")
+                    messagebox.showerror("Ошибка", f"Не удалось подготовить график: {error}")
+                continue
+            if self.cache.accept(key, data):
+                self._draw(key, data)
+        self.frame.after(SAVER_POLL_MS, self._poll)
+
+    def _draw(self, key, data):
+        kind, params, _ = key
+        self.info.config(text="")
+        if isinstance(data, str):
+            messagebox.showinfo("Информация", data)
+            return
+        CHARTS[kind][1](data, self.figure, **dict(params))
+        self.canvas.draw_idle()
+        self.cache.shown = key
 
 # ===================== Обновленный основной класс GUI =====================
+IMEI_SUGGEST_DELAY_MS = 150   # пауза после ввода перед поиском похожих IMEI
+IMEI_SUGGEST_MIN_DIGITS = 3   # с какой длины ввода показывать похожие
+IMEI_SUGGEST_LIMIT = 20
 
 class App:
     def __init__(self, master):
@@ -247,12 +4061,38 @@ class App:
         # Меню
         self._build_menu()
 
-        # Данные
-        self.equipments = load_from_json()
+        # Данные: снимок + журнал изменений поверх него
+        self.store = EquipmentStore()
+        self.journal = ChangeJournal()
+        self.history = load_history()
+        self.backend = SqliteBackend() if STORAGE_BACKEND == 'sqlite' else None
+        self.saver = PersistenceWorker(self.journal, backend=self.backend,
+                                       shards_dir=SHARDS_DIR if STORAGE_BACKEND == 'shards' else None,
+                                       history=self.history)
+        self.saver.start()
+        self._compact_requested = False
+        self._save_msgs = set()
+        self._load_job = None
+        self._bulk_job = None
+        self.grid_view = None
+        self._suggest_job = None
+        self.remote = None  # ServiceClient, если окно работает клиентом сервиса
+        self.chart_worker = ChartWorker()
+        self.chart_worker.start()
+        self.chart_panel = None  # ChartPanel, создается при первом графике
+        self._chart_store = None  # копия хранилища для потока графиков (одна на версию данных)
+        self.master.after(JOURNAL_COMPACT_INTERVAL_MS, self._periodic_compact)
+        self.master.after(SAVER_POLL_MS, self._poll_saver)
 
         # Остальной интерфейс
         self._build_ui()
 
+        if SERVICE_ADDRESS:
+            self._connect_service(SERVICE_ADDRESS)
+        if self.remote is None:
+            # Загрузка идет порциями: окно доступно сразу, данные появляются по мере чтения
+            self._load_snapshot(show_msg=False)
+
         # Сохранение при закрытии окна (крестик)
         self.master.protocol("WM_DELETE_WINDOW", self.save_and_exit)
 
@@ -262,6 +4102,26 @@ class App:
         help_menu.add_command(label="О программе", command=self.show_about)
         menubar.add_cascade(label="Справка", menu=help_menu)
 
+        file_menu = tk.Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Сохранить в JSON Lines",
+                              command=lambda: self.save_data('jsonl', show_msg=True))
+        file_menu.add_command(label="Загрузить из JSON Lines", command=self.load_jsonl)
+        file_menu.add_separator()
+        file_menu.add_command(label="Массовый импорт CSV…", command=self.bulk_import)
+        menubar.add_cascade(label="Файл", menu=file_menu)
+
+        view_menu = tk.Menu(menubar, tearoff=0)
+        view_menu.add_command(label="Таблица оборудования", command=self.show_grid)
+        view_menu.add_command(label="История изменений", command=self.show_history)
+        menubar.add_cascade(label="Вид", menu=view_menu)
+
+        diag_menu = tk.Menu(menubar, tearoff=0)
+        diag_menu.add_command(label="Время операций (p50/p95)", command=self.show_metrics)
+        self.profile_var = tk.BooleanVar(value=metrics.profiler is not None)
+        diag_menu.add_checkbutton(label="Профилирование (cProfile)", variable=self.profile_var,
+                                  command=self.toggle_profiling)
+        menubar.add_cascade(label="Диагностика", menu=diag_menu)
+
         sort_menu = tk.Menu(menubar, tearoff=0)
         sort_menu.add_command(label="Сортировать по дате", command=lambda: self.sort_equipments('date'))
         sort_menu.add_command(label="Сортировать по состоянию", command=lambda: self.sort_equipments('condition'))
@@ -274,9 +4134,9 @@ class App:
         frame_input = ttk.Frame(self.master)
         frame_input.pack(padx=10, pady=10)
 
-        # ttk.Label(frame_input, text="Филиал").grid(row=0, column=0, sticky='w')
-        # self.entry_branch = ttk.Entry(frame_input)
-        # self.entry_branch.grid(row=0, column=1)
+        ttk.Label(frame_input, text="Филиал").grid(row=0, column=0, sticky='w')
+        self.entry_branch = ttk.Entry(frame_input)
+        self.entry_branch.grid(row=0, column=1)
 
         ttk.Label(frame_input, text="IMEI").grid(row=1, column=0, sticky='w')
         self.entry_imei = ttk.Entry(frame_input)
@@ -284,6 +4144,15 @@ class App:
 
         ttk.Button(frame_input, text="Поиск", command=self.search).grid(row=2, column=0, columnspan=2, pady=5)
 
+        # Похожие IMEI (по началу, концу или середине номера) - обновляются при вводе
+        self.candidate_list = tk.Listbox(frame_input, height=6, width=60)
+        self.candidate_list.grid(row=3, column=0, columnspan=2, sticky='we')
+        self._candidate_imeis = []
+        self.entry_imei.bind('<KeyRelease>', self._schedule_suggest)
+        self.entry_branch.bind('<KeyRelease>', self._schedule_suggest)
+        self.candidate_list.bind('<Double-Button-1>', self._pick_candidate)
+        self.candidate_list.bind('<Return>', self._pick_candidate)
+
         # Результат
         self.result_label = ttk.Label(self.master, text="", justify='left', background='white', relief='solid')
         self.result_label.pack(padx=50, pady=50, fill='x')
@@ -326,23 +4195,30 @@ class App:
             text="ТОП 10 по неисправным",
             image=self.top_icon,
             compound="top",  # размещение текста слева от изображения; можно 'right'
-            command=lambda: top_branches_defective(self.equipments)
+            command=lambda: self.show_chart('top_defective', top_n=10)
         )
         top_btn.grid(row=0, column=0, padx=5)
         # ttk.Button(frame_analysis, text="Динамика по состоянию",
         #            command=lambda: dynamics_by_condition(self.equipments)).grid(row=0, column=1, padx=5)
         self.din_icon = tk.PhotoImage(file="imgs/icons7.png")
 
-        # кнопка Динамика по состоянию с иконкой и текстом
+        # кнопка Состояние по месяцам установки с иконкой и текстом
         din_btn = ttk.Button(
             frame_analysis,
-            text="Динамика по состоянию",
+            text="Состояние по месяцам установки",
             image=self.din_icon,
             compound="top",  # размещение текста слева от изображения; можно 'right'
-            command=lambda: dynamics_by_condition(self.equipments)
+            command=lambda: self.show_chart('dynamics', months=ROLLUP_MONTHS)
         )
         din_btn.grid(row=0, column=1, padx=5)
 
+        # кнопка Гарантия (текстом - своей иконки нет)
+        ttk.Button(frame_analysis, text="Гарантия", command=self.show_warranty)\
+            .grid(row=0, column=2, padx=5, sticky='ns')
+        ttk.Button(frame_analysis, text="Бренды и состояния",
+                   command=lambda: self.show_chart('brand_condition'))\
+            .grid(row=0, column=3, padx=5, sticky='ns')
+
         # Сохранение/загрузка/выход
         frame_buttons = ttk.Frame(self.master)
         frame_buttons.pack(pady=5)
@@ -409,8 +4285,32 @@ class App:
         )
         exit_btn.grid(row=0, column=4, padx=5)
 
+        # Состояние фоновой записи
+        self.status_label = ttk.Label(self.master, text="", foreground='gray')
+        self.status_label.pack(side='bottom', fill='x', padx=10, pady=2)
+
+
+
 
+    def _connect_service(self, address):
+        """Поиск, добавление, правка и графики идут через сервис; локальные файлы не трогаются."""
+        try:
+            self.remote = ServiceClient(*parse_service_address(address))
+            rows = len(self.remote)
+        except (OSError, ValueError) as e:
+            self.remote = None
+            messagebox.showerror("Сервис", f"Не удалось подключиться к сервису {address}: {e}\n"
+                                           "Данные будут загружены из локальных файлов.")
+            return
+        self.store = self.remote
+        self.status_label.config(text=f"Клиент сервиса {address}: {rows} записей")
 
+    def _remote_blocked(self):
+        """Действия над локальной копией данных в режиме клиента сервиса недоступны."""
+        if self.remote is None:
+            return False
+        messagebox.showinfo("Сервис", "В режиме клиента сервиса это действие недоступно: данные хранит сервис.")
+        return True
 
     def show_about(self):
         messagebox.showinfo(
@@ -420,12 +4320,13 @@ class App:
 
     def add_equipment(self):
         raw = {k: self.entries[k].get() for k, _ in self.fields}
-        ok, err, data = validate_fields(raw)
+        with metrics.timer('validate_fields'):
+            ok, err, data = validate_fields(raw)
         if not ok:
             messagebox.showerror("Ошибка валидации", err)
             return
 
-        if any(eq.imei == data['imei'] for eq in self.equipments):
+        if data['imei'] in self.store:
             messagebox.showerror("Ошибка", "Этот IMEI уже существует в базе.")
             return
 
@@ -439,43 +4340,338 @@ class App:
             location=data['location'],
             date_str=data['date']
         )
-        self.equipments.append(eq)
-        self.autosave()
+        try:
+            with metrics.timer('add_equipment'):
+                added = self.store.add(eq)
+                if added:
+                    self.autosave(eq)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Ошибка", f"Не удалось добавить: {e}")
+            return
+        if not added:
+            messagebox.showerror("Ошибка", "Этот IMEI уже существует в базе.")
+            return
         messagebox.showinfo("Удачно", "Оборудование добавлено.")
 
         for e in self.entries.values():
             e.delete(0, tk.END)
 
-    def autosave(self):
-        save_to_json(self.equipments)
-        save_to_csv(self.equipments)
+    @timed('autosave')
+    def autosave(self, eq=None):
+        """Ставит в фоновую запись измененную запись (в журнал) или, без нее, свертку."""
+        if self.remote is not None:
+            # изменение уже принято и записано сервисом
+            self.status_label.config(text="Сохранено сервисом")
+            return
+        if eq is not None:
+            self.saver.submit_change(eq)
+        else:
+            self._request_compact()
+        self.status_label.config(text="Сохранение…")
+
+    def _request_compact(self):
+        if self.remote is not None:
+            return
+        if self._load_job is not None:
+            # снимок из недогруженных данных затер бы файл - свернем после загрузки
+            self._load_job['compact_after'] = True
+            return
+        self._compact_requested = True
+        self.saver.submit_compact(self.store)
+
+    def _periodic_compact(self):
+        if self.journal.entries and not self._compact_requested:
+            self._request_compact()
+        self.master.after(JOURNAL_COMPACT_INTERVAL_MS, self._periodic_compact)
+
+    def _poll_saver(self):
+        self._drain_saver_results()
+        self.master.after(SAVER_POLL_MS, self._poll_saver)
+
+    def _drain_saver_results(self):
+        while True:
+            try:
+                kind, ok, message = self.saver.results.get_nowait()
+            except queue.Empty:
+                return
+            self._on_saved(kind, ok, message)
+
+    def _on_saved(self, kind, ok, message):
+        if kind == 'import_existing':
+            added, rows = message
+            report = self._bulk_job['report'] if self._bulk_job is not None else None
+            restore_existing(self.store, added, rows, report)
+            print(f"Импорт: IMEI уже были в базе SQLite, оставлены ее данные: {len(rows)}")
+            return
+        if kind == 'compact':
+            self._compact_requested = False
+        if not ok:
+            self.status_label.config(text=f"Ошибка сохранения: {message}")
+            messagebox.showerror("Ошибка сохранения", message)
+            return
+        self.status_label.config(text=f"Сохранено {datetime.now().strftime('%H:%M:%S')}")
+        if kind == 'append' and self.journal.entries >= JOURNAL_COMPACT_THRESHOLD \
+                and not self._compact_requested:
+            self._request_compact()
+        if kind.startswith('save_'):
+            fmt = kind[len('save_'):]
+            if fmt in self._save_msgs:
+                self._save_msgs.discard(fmt)
+                messagebox.showinfo("Готово", f"Данные сохранены в {fmt.upper()}.")
 
     def save_data(self, fmt, show_msg=False):
-        if fmt == 'csv':
-            save_to_csv(self.equipments)
-        else:
-            save_to_json(self.equipments)
+        if self._remote_blocked():
+            return
+        if self._load_job is not None:
+            messagebox.showwarning("Загрузка", "Дождитесь окончания загрузки данных.")
+            return
+        fmt = fmt if fmt in ('csv', 'jsonl') else 'json'
         if show_msg:
-            messagebox.showinfo("Готово", f"Данные сохранены в {fmt.upper()}.")
+            self._save_msgs.add(fmt)
+        self.saver.submit_save(fmt, self.store)
+        self.status_label.config(text=f"Сохранение в {fmt.upper()}…")
 
     def load_csv(self):
-        self.equipments = load_from_csv()
-        messagebox.showinfo("Готово", "Данные загружены из CSV.")
+        report = LoadReport('equipment_data.csv')
+        # CSV становится новой базой: прежний журнал к ней не относится
+        self._start_load(iter_csv(report=report), report, 'CSV', compact_after=True)
+
+    def load_jsonl(self):
+        report = LoadReport('equipment_data.jsonl')
+        self._start_load(iter_jsonl(report=report), report, 'JSON Lines', compact_after=True)
 
     def load_json(self):
-        self.equipments = load_from_json()
-        messagebox.showinfo("Готово", "Данные загружены из JSON.")
+        self._load_snapshot()
+
+    def _load_snapshot(self, show_msg=True):
+        if self._remote_blocked():
+            return
+        if self.backend is not None and self.backend.has_data():
+            report = LoadReport(self.backend.filename)
+            self._start_load(iter_sqlite(self.backend.filename, report=report), report, 'SQLite',
+                             show_msg=show_msg)
+            return
+        if STORAGE_BACKEND == 'shards' and self._load_job is None and shards_exist():
+            # файлы филиалов читаются в фоновом потоке (пул процессов) и принимаются целиком, журнал - поверх
+            self._start_load(iter(()), LoadReport(SHARDS_DIR), 'файлов филиалов', replay_journal=True,
+                             show_msg=show_msg, pending=self._read_in_background(read_shards))
+            return
+        self._load_files(show_msg)
+
+    def _load_files(self, show_msg):
+        # без базы SQLite или файлов филиалов (первый запуск с RTK_STORAGE) данные переносятся туда из JSON
+        migrate = self.backend is not None or STORAGE_BACKEND == 'shards'
+        if self._load_job is None and snapshot_is_fresh():
+            # бинарный снимок принимается целиком (копирование массивов), журнал - поверх
+            report = LoadReport(SNAPSHOT_FILE)
+            try:
+                report.rows = load_snapshot_into(self.store)
+            except Exception as e:
+                print(f"Ошибка при чтении бинарного снимка, читаем JSON: {e}")
+            else:
+                self._load_job = self._new_load_job(iter(()), report, 'снимка', True, migrate, show_msg)
+                self._finish_load()
+                return
+        report = LoadReport('equipment_data.json')
+        self._start_load(iter_json(report=report), report, 'JSON', replay_journal=True,
+                         compact_after=migrate, show_msg=show_msg)
+
+    def _new_load_job(self, chunks, report, source, replay_journal, compact_after, show_msg, pending=None):
+        return {
+            'chunks': chunks, 'report': report, 'source': source, 'skipped': 0,
+            'replay_journal': replay_journal, 'compact_after': compact_after, 'show_msg': show_msg,
+            'pending': pending, 'started': time.perf_counter(),
+        }
+
+    def _start_load(self, chunks, report, source, replay_journal=False, compact_after=False, show_msg=True,
+                    pending=None):
+        """pending - очередь с результатом чтения в фоновом потоке (см. _read_in_background)."""
+        if self._remote_blocked():
+            return
+        if self._load_job is not None or self._bulk_job is not None:
+            messagebox.showwarning("Загрузка", "Загрузка уже идет.")
+            return
+        self.store.replace_all(())
+        self._load_job = self._new_load_job(chunks, report, source, replay_journal, compact_after, show_msg,
+                                            pending)
+        self.master.after(0, self._load_step)
+
+    @staticmethod
+    def _read_in_background(read):
+        """Запускает read() в фоновом потоке; (True, результат) или (False, исключение) - в очередь."""
+        result = queue.Queue(maxsize=1)
+
+        def run():
+            try:
+                result.put((True, read()))
+            except Exception as e:
+                result.put((False, e))
+
+        threading.Thread(target=run, name='rtk-load', daemon=True).start()
+        return result
+
+    def _take_pending(self, block):
+        """
+        Принимает столбцы, прочитанные в фоне. False - результата еще нет.
+        При ошибке чтения вместо этой загрузки начинается загрузка из JSON.
+        """
+        job = self._load_job
+        try:
+            ok, result = job['pending'].get(block=block)
+        except queue.Empty:
+            return False
+        job['pending'] = None
+        if ok:
+            self.store.adopt(*result)
+            job['report'].rows = len(self.store)
+        else:
+            print(f"Ошибка при чтении {job['source']}, читаем JSON: {result}")
+            self._load_job = None
+            self._load_files(job['show_msg'])
+        return True
+
+    def _load_step(self):
+        """Одна порция за тик event loop: между порциями окно перерисовывается и отвечает."""
+        job = self._load_job
+        if job is None:
+            return
+        if job['pending'] is not None:
+            if not self._take_pending(block=False):
+                self.master.after(LOAD_POLL_MS, self._load_step)
+            elif self._load_job is job:
+                self._finish_load()
+            return
+        chunk = next(job['chunks'], None)
+        if chunk is None:
+            self._finish_load()
+            return
+        job['skipped'] += self.store.extend(chunk)
+        self.status_label.config(text=f"Загрузка из {job['source']}: {len(self.store)} записей…")
+        self.master.after(1, self._load_step)
+
+    def _finish_load_now(self):
+        job = self._load_job
+        if job is None:
+            return
+        job['show_msg'] = False
+        if job['pending'] is not None:
+            self._take_pending(block=True)
+            if self._load_job is not job:
+                # чтение не удалось - дочитываем JSON, которым его заменили
+                self._finish_load_now()
+                return
+        for chunk in job['chunks']:
+            job['skipped'] += self.store.extend(chunk)
+        self._finish_load()
+
+    def _finish_load(self):
+        job, self._load_job = self._load_job, None
+        if job['replay_journal']:
+            # журнал читается только после того, как в него дописано все поставленное
+            self.saver.flush()
+            applied, bad = self.journal.replay(self.store)
+            if bad:
+                print(f"Пропущено поврежденных строк журнала: {bad}")
+        if job['compact_after']:
+            self._request_compact()
+        metrics.record(f"load ({job['source']})", time.perf_counter() - job['started'], len(self.store))
+        report = job['report']
+        self.status_label.config(text=f"Загружено из {job['source']}: {len(self.store)} записей")
+        if job['show_msg']:
+            messagebox.showinfo("Готово", f"Данные загружены из {job['source']}.")
+        if report.bad or report.error:
+            print(report.summary())
+            if job['show_msg']:
+                messagebox.showwarning("Пропущенные записи", report.summary())
+        self._report_duplicates(job['skipped'], job['show_msg'])
+
+    def _report_duplicates(self, skipped, show_msg=True):
+        if not skipped:
+            return
+        msg = f"Пропущено записей с повторяющимся IMEI: {skipped}"
+        print(msg)
+        if show_msg:
+            messagebox.showwarning("Дубли IMEI", msg)
+
+    def bulk_import(self):
+        """Добавляет к базе записи из внешнего CSV: проверка - в фоновом потоке, порции - в окно."""
+        if self._remote_blocked():
+            return
+        if self._load_job is not None or self._bulk_job is not None:
+            messagebox.showwarning("Загрузка", "Дождитесь окончания загрузки данных.")
+            return
+        filename = filedialog.askopenfilename(title="Массовый импорт CSV",
+                                              filetypes=[("CSV", "*.csv"), ("Все файлы", "*.*")])
+        if not filename:
+            return
+        report = ImportReport(filename)
+        # ключи берутся здесь: поток проверки не читает столбцы, которые меняет окно
+        keys = existing_imei_keys(self.store)
+        results = queue.Queue(maxsize=2)   # не больше двух проверенных порций в памяти
+
+        def validate():
+            try:
+                for accepted in bulk_validate_csv(filename, keys, report):
+                    results.put(('chunk', accepted))
+            except Exception as e:
+                results.put(('error', str(e)))
+            else:
+                results.put(('done', None))
+
+        self._bulk_job = {'report': report, 'results': results, 'stopped': False}
+        threading.Thread(target=validate, name='bulk-import', daemon=True).start()
+        self.status_label.config(text=f"Импорт из {os.path.basename(filename)}…")
+        self.master.after(SAVER_POLL_MS, self._bulk_step)
+
+    def _bulk_step(self):
+        job = self._bulk_job
+        if job is None:
+            return
+        report = job['report']
+        while True:
+            try:
+                kind, payload = job['results'].get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'chunk':
+                added = apply_accepted(self.store, payload, report)
+                if self.backend is not None and len(added):
+                    self.saver.submit_import(added)
+                self.status_label.config(text=f"Импорт: прочитано {report.total}, принято {report.accepted}…")
+                continue
+            self._finish_bulk(payload if kind == 'error' else None)
+            return
+        self.master.after(SAVER_POLL_MS, self._bulk_step)
+
+    def _finish_bulk(self, error=None):
+        job, self._bulk_job = self._bulk_job, None
+        report = job['report']
+        if report.accepted and self.backend is None:
+            # массовое добавление пишется одной сверткой, а не тысячами строк журнала;
+            # в SQLite порции уже дописаны по мере импорта
+            self._request_compact()
+        self.status_label.config(text=report.summary())
+        if error:
+            print(f"Ошибка при импорте CSV: {error}")
+            messagebox.showerror("Ошибка импорта", f"{error}\n{report.summary()}")
+            return
+        if not report.rejected_count:
+            messagebox.showinfo("Готово", report.summary())
+            return
+        if messagebox.askyesno("Импорт завершен", report.summary() + "\nСохранить отклоненные строки с причинами?"):
+            try:
+                messagebox.showinfo("Готово", f"Отклоненные строки: {report.save_rejected()}")
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось сохранить отчет: {e}")
 
     def search(self):
-        # branch_val = normalize(self.entry_branch.get())
+        # филиал необязателен: если указан, IMEI ищется только в нем
+        branch_val = normalize(self.entry_branch.get())
         imei_val = normalize(self.entry_imei.get())
 
         if not  imei_val:
-            messagebox.showerror("Ошибка", "Введите Филиал и IMEI")
+            messagebox.showerror("Ошибка", "Введите IMEI")
             return
-        # if not branch_val or not imei_val:
-        #     messagebox.showerror("Ошибка", "Введите Филиал и IMEI")
-        #     return
 
         # Проверка на корректность ввода IMEI
         if not imei_val.isdigit():
@@ -483,24 +4679,20 @@ class App:
             return
 
 
-        selected_eq = None
-        for eq in self.equipments:
-            # if eq.branch == branch_val and eq.imei == imei_val:
-            if eq.imei == imei_val:
-                selected_eq = eq
-                break
+        with metrics.timer('search'):
+            selected_eq = self.store.find(imei_val, branch_val or None)
 
         if not selected_eq:
-            self.result_label.config(text="Объект не найден.")
+            self._suggest()
+            text = "Объект не найден."
+            if self._candidate_imeis:
+                text += " Похожие IMEI - в списке под полем ввода."
+            self.result_label.config(text=text)
             return
 
 
 
-        today = datetime.now()
-        days_passed = (today - selected_eq.date).days if selected_eq.date else None
-        guarantee_status = "Дата неизвестна."
-        if days_passed is not None:
-            guarantee_status = "Гарантия завершена." if days_passed >= 1095 else "На гарантии."
+        guarantee_status = warranty_status(_datetime_to_ordinal(selected_eq.date))
 
         info_text = (
             f"Филиал: {selected_eq.branch}\n"
@@ -518,12 +4710,41 @@ class App:
         if messagebox.askquestion("Редактировать?", "Хотите внести изменения в Статус, Состояние или Расположение?") == 'yes':
             self.edit_fields(selected_eq)
 
+    def _schedule_suggest(self, event=None):
+        if self._suggest_job is not None:
+            self.master.after_cancel(self._suggest_job)
+        self._suggest_job = self.master.after(IMEI_SUGGEST_DELAY_MS, self._suggest)
+
+    def _suggest(self):
+        """Заполняет список похожих IMEI по введенной части номера (и филиалу, если указан)."""
+        self._suggest_job = None
+        text = normalize(self.entry_imei.get())
+        candidates = []
+        if len(text) >= IMEI_SUGGEST_MIN_DIGITS:
+            with metrics.timer('imei_suggest'):
+                candidates = self.store.imei_candidates(text, IMEI_SUGGEST_LIMIT,
+                                                        branch=normalize(self.entry_branch.get()) or None)
+        self._candidate_imeis = [eq.imei for eq, kind in candidates]
+        self.candidate_list.delete(0, 'end')
+        for eq, kind in candidates:
+            self.candidate_list.insert('end', f"{eq.imei}  {eq.branch}, {eq.brand} {eq.model} ({kind})")
+
+    def _pick_candidate(self, event=None):
+        selection = self.candidate_list.curselection()
+        if not selection:
+            return
+        self.entry_imei.delete(0, 'end')
+        self.entry_imei.insert(0, self._candidate_imeis[selection[0]])
+        self.search()
+
     def edit_fields(self, equipment_obj):
+        # изменения собираются из диалогов и применяются разом (замер - без времени на диалоги)
+        changes = {}
         new_status = simpledialog.askstring("Редактировать", "Статус:", initialvalue=equipment_obj.status)
         if new_status is not None:
             ns = normalize(new_status)
             if is_cyrillic_letters(ns) and ns in ALLOWED_STATUS:
-                equipment_obj.status = ns
+                changes['status'] = ns
             else:
                 messagebox.showerror("Ошибка", f"Недопустимый статус. Разрешено: {', '.join(sorted(ALLOWED_STATUS))}.")
 
@@ -531,7 +4752,7 @@ class App:
         if new_condition is not None:
             nc = normalize(new_condition)
             if is_cyrillic_letters(nc) and nc in ALLOWED_CONDITION:
-                equipment_obj.condition = nc
+                changes['condition'] = nc
             else:
                 messagebox.showerror("Ошибка", f"Недопустимое состояние. Разрешено: {', '.join(sorted(ALLOWED_CONDITION))}.")
 
@@ -539,24 +4760,859 @@ class App:
         if new_location is not None:
             nl = normalize(new_location)
             if is_cyrillic_letters(nl) and nl in ALLOWED_LOCATION:
-                equipment_obj.location = nl
+                changes['location'] = nl
             else:
                 messagebox.showerror("Ошибка", f"Недопустимое расположение. Разрешено: {', '.join(sorted(ALLOWED_LOCATION))}.")
 
-        self.autosave()
+        try:
+            with metrics.timer('edit_fields'):
+                if changes:
+                    # в режиме клиента историю ведет сервис
+                    events = self.history.record(equipment_obj, changes) if self.remote is None else None
+                    self.store.update(equipment_obj, **changes)
+                    if events:
+                        self.saver.submit_history(events)
+                self.autosave(equipment_obj)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить изменения: {e}")
+            return
         messagebox.showinfo("Обновлено", "Данные обновлены.")
 
     def sort_equipments(self, field):
-        self.equipments = sort_equipments_by(field, self.equipments)
-        messagebox.showinfo("Готово", f"Отсортировано по {field}", icon='info')
+        if self._remote_blocked():
+            return
+        with metrics.timer('sort_equipments', rows=len(self.store)):
+            self.store.sort_by(field)
+        self.status_label.config(text=f"Отсортировано по {field}")
+        # результат сортировки виден в таблице (без сортировки по столбцу она идет в порядке хранилища)
+        self.show_grid()
 
+    def show_warranty(self):
+        """Окно отчета по гарантии: сводка по филиалам, экспорт списка устройств, график."""
+        if self._remote_blocked():
+            return
+        window = tk.Toplevel(self.master)
+        window.title("Гарантия")
+        frame_top = ttk.Frame(window)
+        frame_top.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frame_top, text="Истекает в ближайшие, дней:").pack(side='left')
+        days_var = tk.StringVar(value='30')
+        ttk.Spinbox(frame_top, from_=1, to=3650, textvariable=days_var, width=6).pack(side='left', padx=5)
+        info = ttk.Label(window, text="")
+        columns = ('branch',) + WarrantyIndex.SUMMARY_COLUMNS
+        tree = ttk.Treeview(window, columns=columns, show='headings', height=12)
+        for name in columns:
+            tree.heading(name, text='филиал' if name == 'branch' else name)
+            tree.column(name, width=150 if name == 'branch' else 120, anchor='w' if name == 'branch' else 'e')
+        report = {}
+
+        def within_days():
+            try:
+                return max(1, int(days_var.get()))
+            except ValueError:
+                return 30
+
+        def refresh():
+            days = within_days()
+            summary, devices = warranty_report(self.store, days)
+            report.update(summary=summary, devices=devices, days=days)
+            tree.delete(*tree.get_children())
+            for branch, counts in summary.iterrows():
+                tree.insert('', 'end', values=(branch, *counts.tolist()))
+            totals = summary.sum()
+            info.config(text=f"Истекает за {days} дн.: {totals.get('истекает', 0)}; "
+                             f"завершена, но установлено: {totals.get('завершена, установлено', 0)}")
+
+        def export():
+            filename = filedialog.asksaveasfilename(parent=window, defaultextension='.csv',
+                                                    initialfile='warranty_report.csv',
+                                                    filetypes=[("CSV", "*.csv")])
+            if not filename:
+                return
+            try:
+                report['devices'].to_csv(filename, index=False, encoding='utf-8-sig')
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось сохранить отчет: {e}", parent=window)
+                return
+            messagebox.showinfo("Готово", f"Устройств в отчете: {len(report['devices'])}", parent=window)
+
+        def chart():
+            if report['summary'].empty:
+                messagebox.showinfo("Информация", "Нет данных для отображения.", parent=window)
+                return
+            self.show_chart('warranty', within_days=report['days'])
+
+        ttk.Button(frame_top, text="Обновить", command=refresh).pack(side='left', padx=5)
+        ttk.Button(frame_top, text="График", command=chart).pack(side='left', padx=5)
+        ttk.Button(frame_top, text="Экспорт отчета (CSV)", command=export).pack(side='left', padx=5)
+        info.pack(fill='x', padx=10)
+        tree.pack(fill='both', expand=True, padx=10, pady=5)
+        refresh()
+
+    def show_history(self):
+        """Окно истории: состояния парка на дату против текущих и время в ремонте по брендам."""
+        if self._remote_blocked():
+            return
+        window = tk.Toplevel(self.master)
+        window.title("История изменений")
+        frame_top = ttk.Frame(window)
+        frame_top.pack(fill='x', padx=10, pady=5)
+        ttk.Label(frame_top, text="Состояние на дату (YYYY-MM-DD):").pack(side='left')
+        date_var = tk.StringVar(value=date.today().isoformat())
+        ttk.Entry(frame_top, textvariable=date_var, width=12).pack(side='left', padx=5)
+        info = ttk.Label(window, text=f"Событий в истории: {len(self.history)}")
+        columns = ('field', 'value', 'then', 'now')
+        state_tree = ttk.Treeview(window, columns=columns, show='headings', height=10)
+        for name, text in zip(columns, ('поле', 'значение', 'на дату', 'сейчас')):
+            state_tree.heading(name, text=text)
+            state_tree.column(name, width=120, anchor='e' if name in ('then', 'now') else 'w')
+        repair_tree = ttk.Treeview(window, columns=('brand',) + TIME_IN_STATE_COLUMNS, show='headings', height=8)
+        repair_tree.heading('brand', text='бренд')
+        repair_tree.column('brand', width=120)
+        for name in TIME_IN_STATE_COLUMNS:
+            repair_tree.heading(name, text=name)
+            repair_tree.column(name, width=110, anchor='e')
+
+        def refresh():
+            try:
+                when = date.fromisoformat(date_var.get().strip())
+            except ValueError:
+                messagebox.showerror("Ошибка", "Дата должна быть в формате YYYY-MM-DD.", parent=window)
+                return
+            then = self.history.state_at(when, self.store)
+            now = self.store.frame()
+            state_tree.delete(*state_tree.get_children())
+            for field in HISTORY_FIELDS:
+                counts = pd.concat([then[field].value_counts(), now[field].value_counts()], axis=1).fillna(0)
+                for value, (n_then, n_now) in counts.iterrows():
+                    state_tree.insert('', 'end', values=(field, value, int(n_then), int(n_now)))
+            repair_tree.delete(*repair_tree.get_children())
+            for brand, row in time_in_state(self.history, self.store).iterrows():
+                repair_tree.insert('', 'end', values=(brand, *('' if pd.isna(v) else v for v in row.tolist())))
+
+        ttk.Button(frame_top, text="Показать", command=refresh).pack(side='left', padx=5)
+        info.pack(fill='x', padx=10)
+        state_tree.pack(fill='both', expand=True, padx=10, pady=5)
+        ttk.Label(window, text="Время в ремонте по брендам").pack(anchor='w', padx=10)
+        repair_tree.pack(fill='both', expand=True, padx=10, pady=5)
+        refresh()
+
+    def show_metrics(self):
+        """Окно с p50/p95 операций текущего сеанса."""
+        rows = metrics.summary()
+        lines = [f"{'операция':28s} {'вызовов':>8s} {'p50, мс':>10s} {'p95, мс':>10s} {'макс, мс':>10s} {'записей':>10s}"]
+        for op, count, p50, p95, max_ms, total_rows in rows:
+            lines.append(f"{op:28s} {count:8d} {p50:10.2f} {p95:10.2f} {max_ms:10.2f} {total_rows or '':>10}")
+        if not rows:
+            lines.append("Замеров пока нет.")
+        lines.append("")
+        lines.append(f"Подробно (каждый вызов): {os.path.abspath(metrics.filename)}")
+
+        window = tk.Toplevel(self.master)
+        window.title("Диагностика: время операций")
+        text = tk.Text(window, width=84, height=min(30, len(lines) + 1), font=('Courier', 10))
+        text.insert('1.0', '\n'.join(lines))
+        text.config(state='disabled')
+        text.pack(padx=10, pady=10, fill='both', expand=True)
+
+    def toggle_profiling(self):
+        if self.profile_var.get():
+            metrics.start_profiling()
+            self.status_label.config(text="Профилирование включено")
+            return
+        filename = metrics.stop_profiling()
+        if filename:
+            messagebox.showinfo("Профилирование", f"Профиль записан: {os.path.abspath(filename)}")
+
+    def show_grid(self):
+        if self._remote_blocked():
+            return
+        if self.grid_view is not None and not self.grid_view.closed:
+            self.grid_view.refresh()
+            self.grid_view.window.lift()
+            return
+        self.grid_view = EquipmentGrid(self.master, self.store, self.edit_fields)
+
+
+    # виды графиков, которые с базой SQLite считаются в SQL
+    SQL_CHARTS = ('top_defective', 'brand_condition')
+
+    def show_chart(self, kind, **params):
+        """График в главном окне; данные готовятся в потоке графиков, окно не ждет."""
+        if self.chart_panel is None:
+            self.chart_panel = ChartPanel(self.master, self.chart_worker)
+        if self.remote is not None:
+            # отдельное соединение: основное занято окном
+            self.chart_panel.show(kind, None, lambda: functools.partial(ServiceClient, *self.remote.address),
+                                  **params)
+        elif self.backend is not None and kind in self.SQL_CHARTS:
+            self.chart_panel.show(kind, self.store.version, lambda: self._flushed_backend, **params)
+        else:
+            self.chart_panel.show(kind, self.store.version, self._frozen_store, **params)
+
+    def _frozen_store(self):
+        """Копия хранилища для потока графиков: делается в потоке окна, одна на версию данных."""
+        if self._chart_store is None or self._chart_store.version != self.store.version:
+            self._chart_store = self.store.frozen_copy()
+        return self._chart_store
+
+    def _flushed_backend(self):
+        # вызывается в потоке графиков: ждет записи накопленных изменений в базу
+        self.saver.flush()
+        return self.backend
 
     def save_and_exit(self):
-        self.autosave()
+        self.chart_worker.stop()
+        if self.remote is not None:
+            # данные сохраняет сервис
+            self.remote.close()
+            self.saver.stop()
+            self.master.destroy()
+            return
+        self.status_label.config(text="Сохранение перед выходом…")
+        self.master.update_idletasks()
+        self._finish_load_now()
+        if self._bulk_job is not None:
+            # уже добавленные порции импорта сохраняются, остаток файла - нет
+            self._bulk_job = None
+            print("Массовый импорт прерван при выходе.")
+        if self.backend is None:
+            # с SQLite каждое изменение уже в базе - свертка не нужна
+            self.saver.submit_compact(self.store)
+        self.saver.stop()
+        self._drain_saver_results()
+        if metrics.stop_profiling():
+            print(f"Профиль записан: {PROFILE_FILE}")
         self.master.destroy()
 
+# ===================== Сервис для нескольких операторов =====================
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+SERVICE_TIMEOUT = 10  # секунд ожидания ответа клиентом
+SERVICE_LINE_LIMIT = 1 << 20  # байт в строке запроса; длиннее - ответ с ошибкой, строка пропускается
+# RTK_SERVICE=host:port (или просто порт) - окно работает клиентом сервиса, данные хранит он
+SERVICE_ADDRESS = os.environ.get('RTK_SERVICE', '')
+
+def parse_service_address(text):
+    """'host:port', 'port' или '' -> (host, port)."""
+    host, _, port = text.rpartition(':')
+    return host or SERVICE_HOST, int(port) if port else SERVICE_PORT
+
+class EquipmentService:
+    """
+    Одно хранилище в памяти на всех операторов: asyncio-сервер на localhost, протокол -
+    JSON Lines (строка запроса {"op": ..., параметры} -> строка ответа {"ok", "result" | "error"}).
+    Запросы выполняются по одному в потоке event loop, поэтому хранилищу и индексам не нужны
+    блокировки, а записи разных клиентов не перетирают друг друга. Изменения уходят в журнал
+    (или базу SQLite / файлы филиалов) через PersistenceWorker, свертка - по порогу и таймеру.
+    """
+
+    def __init__(self, store, saver, journal, history=None):
+        self.store = store
+        self.saver = saver
+        self.journal = journal
+        self.history = history
+        self.clients = 0
+        self.requests = 0
+        self._compact_requested = False
+        self._server = None
+        self._handlers = {
+            'lookup': self.lookup, 'candidates': self.candidates, 'add': self.add, 'edit': self.edit,
+            'aggregate': self.aggregate, 'stats': self.stats,
+        }
+
+    # допустимые типы параметров запроса; у dict значения - строки
+    PARAM_TYPES = {
+        'imei': str, 'text': str, 'kind': str, 'limit': int, 'record': dict, 'fields': dict,
+        'branch': (str, type(None)), 'brand': (str, type(None)), 'field': (str, type(None)),
+        'start': (str, type(None)), 'end': (str, type(None)), 'filters': (dict, type(None)),
+    }
+
+    def _check_params(self, params):
+        for name, value in params.items():
+            allowed = self.PARAM_TYPES.get(name)
+            if allowed is None:
+                continue   # неизвестный параметр отклонит сама операция (TypeError)
+            if not isinstance(value, allowed) or isinstance(value, bool):
+                raise TypeError(f"Параметр '{name}' неверного типа")
+            if isinstance(value, dict) and not all(isinstance(k, str) and isinstance(v, str)
+                                                   for k, v in value.items()):
+                raise TypeError(f"Параметр '{name}': ключи и значения должны быть строками")
+
+    # --- операции (вызываются в потоке event loop) ---
+    def lookup(self, imei, branch=None):
+        eq = self.store.find(normalize(imei), normalize(branch) or None)
+        return None if eq is None else eq.to_dict()
+
+    def candidates(self, text, limit=IMEI_SUGGEST_LIMIT, branch=None, brand=None):
+        found = self.store.imei_candidates(normalize(text), int(limit), normalize(branch) or None,
+                                           normalize(brand) or None)
+        return [[eq.to_dict(), kind] for eq, kind in found]
+
+    def add(self, record):
+        ok, err, data = validate_fields(record)
+        if not ok:
+            raise ValueError(err)
+        eq = Equipment.from_dict(data)
+        if not self.store.add(eq):
+            return False
+        self.saver.submit_change(eq)
+        return True
+
+    def edit(self, imei, fields):
+        ok, err, changes = validate_edit(fields)
+        if not ok:
+            raise ValueError(err)
+        eq = self.store.get(normalize(imei))
+        if eq is None:
+            raise ValueError("Объект не найден.")
+        if changes:
+            events = self.history.record(eq, changes) if self.history is not None else None
+            self.store.update(eq, **changes)
+            self.saver.submit_change(eq)
+            if events:
+                self.saver.submit_history(events)
+        return eq.to_dict()
+
+    def aggregate(self, kind, start=PIVOT_START, field='branch', end=None, filters=None):
+        if kind == 'defective_by_branch':
+            return self.store.defective_counts()
+        if kind == 'brand_condition':
+            pivot = brand_condition_pivot(self.store, start)
+            if pivot is None or pivot.empty:
+                return []
+            counts = pivot.stack()
+            return [[b, c, int(n)] for (b, c), n in counts.items() if n]
+        if kind == 'count_by' and field in EquipmentStore.INDEXED_FIELDS:
+            return self.store.count_by(field)
+        if kind == 'rollup':
+            frame = self.store.rollup().series(field, start, end, **(filters or {}))
+            return {'months': list(frame.index.strftime('%Y-%m')), 'columns': list(frame.columns),
+                    'data': frame.values.tolist()}
+        raise ValueError(f"Неизвестный агрегат: {kind}")
+
+    def stats(self):
+        return {'rows': len(self.store), 'version': self.store.version,
+                'clients': self.clients, 'requests': self.requests}
+
+    def dispatch(self, request):
+        """Ответ на один запрос (dict). Ошибки данных возвращаются клиенту, сервис продолжает работу."""
+        self.requests += 1
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': "Запрос должен быть объектом JSON"}
+        try:
+            params = dict(request)
+            handler = self._handlers.get(params.pop('op', None))
+            if handler is None:
+                raise ValueError(f"Неизвестная операция: {request.get('op')}")
+            params.pop('id', None)
+            self._check_params(params)
+            with metrics.timer('service_' + request['op']):
+                result = handler(**params)
+        except (ValueError, KeyError, TypeError) as e:
+            return {'id': request.get('id'), 'ok': False, 'error': str(e)}
+        if self.journal.entries >= JOURNAL_COMPACT_THRESHOLD and not self._compact_requested:
+            self.request_compact()
+        return {'id': request.get('id'), 'ok': True, 'result': result}
+
+    def request_compact(self):
+        self._compact_requested = True
+        self.saver.submit_compact(self.store)
+
+    def drain_saver_results(self):
+        """Результаты фоновой записи: ошибки - в консоль, конец свертки разрешает следующую."""
+        while True:
+            try:
+                kind, ok, message = self.saver.results.get_nowait()
+            except queue.Empty:
+                return
+            if kind == 'compact':
+                self._compact_requested = False
+            if not ok:
+                print(f"Ошибка при сохранении ({kind}): {message}", file=sys.stderr)
+
+    def respond(self, line):
+        """Ответ на строку запроса; None - строка длиннее SERVICE_LINE_LIMIT (уже пропущена)."""
+        if line is None:
+            return {'ok': False, 'error': f"Запрос длиннее {SERVICE_LINE_LIMIT} байт"}
+        try:
+            return self.dispatch(json.loads(line))
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            return {'ok': False, 'error': f"Неверный запрос: {e}"}
+        except Exception as e:
+            # ошибка в самой операции: клиент получает ответ, соединение и сервис живут дальше
+            print(f"Ошибка при обработке запроса: {e!r}", file=sys.stderr)
+            return {'ok': False, 'error': f"Внутренняя ошибка сервиса: {e}"}
+
+    @staticmethod
+    async def _skip_line(reader, consumed):
+        """Отбрасывает слишком длинную строку до перевода строки. False - клиент отключился."""
+        try:
+            while True:
+                await reader.readexactly(consumed)
+                try:
+                    await reader.readuntil(b'\n')
+                    return True
+                except asyncio.LimitOverrunError as e:
+                    consumed = e.consumed
+        except asyncio.IncompleteReadError:
+            return False
+
+    # --- сеть ---
+    async def _client(self, reader, writer):
+        self.clients += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    if not e.partial:
+                        break
+                    line = e.partial   # последний запрос без перевода строки
+                except asyncio.LimitOverrunError as e:
+                    if not await self._skip_line(reader, e.consumed):
+                        break
+                    line = None
+                response = self.respond(line)
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # клиент отключился или сервис останавливается
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def _watch_saver(self):
+        waited = 0
+        while True:
+            await asyncio.sleep(SAVER_POLL_MS / 1000)
+            self.drain_saver_results()
+            waited += SAVER_POLL_MS
+            if waited >= JOURNAL_COMPACT_INTERVAL_MS:
+                waited = 0
+                if self.journal.entries and not self._compact_requested:
+                    self.request_compact()
+
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT, ready=None):
+        """Принимает клиентов до stop(). ready(port) вызывается, когда порт открыт (port=0 - любой свободный)."""
+        self._server = await asyncio.start_server(self._client, host, port, limit=SERVICE_LINE_LIMIT)
+        watcher = asyncio.get_running_loop().create_task(self._watch_saver())
+        if ready is not None:
+            ready(self._server.sockets[0].getsockname()[1])
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            watcher.cancel()
+
+    def stop(self):
+        """Останавливает прием запросов (можно вызывать из другого потока)."""
+        if self._server is not None:
+            self._server.get_loop().call_soon_threadsafe(self._server.close)
+
+    def start_in_thread(self, host=SERVICE_HOST, port=0):
+        """Запускает сервис в фоновом потоке (проверки, замеры). Возвращает открытый порт."""
+        opened = queue.Queue()
+        thread = threading.Thread(target=lambda: asyncio.run(self.serve(host, port, opened.put)),
+                                  name='service', daemon=True)
+        thread.start()
+        return opened.get(timeout=SERVICE_TIMEOUT)
+
+def run_service(host=SERVICE_HOST, port=SERVICE_PORT):
+    """Сервис для командной строки: загрузка как у load_store, при остановке (Ctrl+C) - свертка."""
+    store = load_store()
+    journal = ChangeJournal()
+    history = load_history()
+    backend = SqliteBackend() if STORAGE_BACKEND == 'sqlite' else None
+    saver = PersistenceWorker(journal, backend=backend,
+                              shards_dir=SHARDS_DIR if STORAGE_BACKEND == 'shards' else None, history=history)
+    saver.start()
+    service = EquipmentService(store, saver, journal, history)
+    print(f"Сервис: {host}:{port}, записей {len(store)}. Остановка - Ctrl+C.", file=sys.stderr)
+    try:
+        asyncio.run(service.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if backend is None:
+            saver.submit_compact(store)
+        saver.stop()
+        service.drain_saver_results()
+    return 0
+
+class ServiceClient:
+    """
+    Клиент сервиса с интерфейсом хранилища для окна-клиента: find, get, in, add, update,
+    imei_candidates и счетчики для графиков. Записи приходят копиями (Equipment вне хранилища).
+    Один запрос - одна строка туда и обратно по постоянному соединению.
+    """
+
+    def __init__(self, host=SERVICE_HOST, port=SERVICE_PORT, timeout=SERVICE_TIMEOUT):
+        self.address = (host, port)
+        self._sock = socket.create_connection(self.address, timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile('rwb')
+        self.version = 0
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def request(self, op, **params):
+        self._file.write(json.dumps({'op': op, **params}, ensure_ascii=False).encode('utf-8') + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Сервис закрыл соединение")
+        response = json.loads(line)
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response['result']
+
+    def __len__(self):
+        stats = self.request('stats')
+        self.version = stats['version']
+        return stats['rows']
+
+    def __contains__(self, imei):
+        return self.get(imei) is not None
+
+    def find(self, imei, branch=None):
+        data = self.request('lookup', imei=imei, branch=branch)
+        return None if data is None else Equipment.from_dict(data)
+
+    def get(self, imei):
+        return self.find(imei)
+
+    def add(self, eq):
+        """Добавляет запись (сервис проверяет ее как validate_fields). False - такой IMEI уже есть."""
+        return self.request('add', record=eq.to_dict())
+
+    def update(self, eq, **fields):
+        """Меняет статус, состояние или расположение; копия eq получает значения с сервиса."""
+        data = self.request('edit', imei=eq.imei, fields=fields)
+        for name in ('status', 'condition', 'location'):
+            setattr(eq, name, data[name])
+
+    def imei_candidates(self, text, limit=IMEI_SUGGEST_LIMIT, branch=None, brand=None):
+        found = self.request('candidates', text=text, limit=limit, branch=branch, brand=brand)
+        return [(Equipment.from_dict(data), kind) for data, kind in found]
+
+    def defective_counts(self):
+        return self.request('aggregate', kind='defective_by_branch')
+
+    def brand_condition_counts(self, start=PIVOT_START):
+        return {(b, c): n for b, c, n in self.request('aggregate', kind='brand_condition', start=start)}
+
+    def count_by(self, field):
+        return self.request('aggregate', kind='count_by', field=field)
+
+    def rollup_series(self, by=None, start=None, end=None, **filters):
+        """Как RollupCube.series, но считает сервис."""
+        data = self.request('aggregate', kind='rollup', field=by, start=start, end=end, filters=filters)
+        index = pd.DatetimeIndex(pd.to_datetime(data['months'], format='%Y-%m'), name='month')
+        return pd.DataFrame(data['data'], index=index, columns=pd.Index(data['columns'], name=by),
+                            dtype='int64')
+
+# ===================== Командная строка =====================
+
+def load_store(report=None):
+    """
+    Хранилище для работы без окна: база SQLite, файлы филиалов, свежий бинарный снимок
+    или JSON, поверх - журнал.
+    """
+    store = EquipmentStore()
+    if STORAGE_BACKEND == 'sqlite' and os.path.exists(SQLITE_FILE):
+        backend = SqliteBackend()
+        try:
+            has_data = backend.has_data()
+        finally:
+            backend.close()
+        if has_data:
+            for chunk in iter_sqlite(report=report):
+                store.extend(chunk)
+            return store
+    loaded = False
+    if STORAGE_BACKEND == 'shards' and shards_exist():
+        try:
+            load_shards_into(store)
+            loaded = True
+        except Exception as e:
+            print(f"Ошибка при чтении файлов филиалов, читаем JSON: {e}", file=sys.stderr)
+    if not loaded and snapshot_is_fresh():
+        try:
+            load_snapshot_into(store)
+            loaded = True
+        except Exception as e:
+            print(f"Ошибка при чтении бинарного снимка, читаем JSON: {e}", file=sys.stderr)
+    if not loaded and os.path.exists('equipment_data.json'):
+        for chunk in iter_json(report=report):
+            store.extend(chunk)
+    ChangeJournal().replay(store)
+    return store
+
+def load_history():
+    """История изменений с диска (пустая, если файлов нет или они не читаются)."""
+    history = ChangeHistory()
+    try:
+        history.load()
+    except Exception as e:
+        print(f"Ошибка при чтении истории изменений: {e}", file=sys.stderr)
+        history = ChangeHistory()
+    return history
+
+def save_store(store):
+    """Сохраняет хранилище после изменений из командной строки: свертка, база SQLite или файлы филиалов."""
+    if STORAGE_BACKEND == 'sqlite':
+        backend = SqliteBackend()
+        try:
+            backend.replace_all(store.snapshot())
+            # журнал (если данные перенесены из файлов) теперь учтен в базе
+            ChangeJournal().reset()
+            return True
+        except Exception as e:
+            print(f"Ошибка при сохранении в SQLite: {e}", file=sys.stderr)
+            return False
+        finally:
+            backend.close()
+    if STORAGE_BACKEND == 'shards':
+        try:
+            save_shards(store)
+        except Exception as e:
+            print(f"Ошибка при сохранении файлов филиалов: {e}", file=sys.stderr)
+            return False
+        ChangeJournal().reset()
+        return True
+    return compact(store, ChangeJournal())
+
+def _save_figure(build, data, filename):
+    """Рисует график в файл без дисплея (Agg); формат - по расширению: .png, .svg, .pdf."""
+    import matplotlib
+    matplotlib.use('Agg')
+    fig = build(data)
+    fig.savefig(filename)
+    plt.close(fig)
+    print(f"График: {filename}", file=sys.stderr)
+
+def _cmd_lookup(args):
+    store = load_store()
+    branch = normalize(args.branch) or None
+    if args.partial:
+        found = store.imei_candidates(normalize(args.imei), args.limit, branch=branch,
+                                      brand=normalize(args.brand) or None)
+    else:
+        eq = store.find(normalize(args.imei), branch)
+        found = [(eq, 'точно')] if eq is not None else []
+    if not found:
+        print("Объект не найден.", file=sys.stderr)
+        return 1
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(EQUIPMENT_FIELDS + (('match',) if args.partial else ()))
+    for eq, kind in found:
+        writer.writerow(eq.to_tuple() + ((kind,) if args.partial else ()))
+    return 0
+
+def _cmd_import(args):
+    store = load_store()
+    # в базу SQLite новые строки дописываются по мере импорта, таблица не переписывается
+    backend = SqliteBackend() if STORAGE_BACKEND == 'sqlite' else None
+    try:
+        report = bulk_import_csv(args.file, store, backend=backend)
+    except Exception as e:
+        print(f"Ошибка при импорте CSV: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if backend is not None:
+            backend.close()
+    print(report.summary(), file=sys.stderr)
+    if report.rejected_count:
+        print(f"Отклоненные строки: {report.save_rejected(args.rejected)}", file=sys.stderr)
+    if report.accepted and backend is None and not save_store(store):
+        return 1
+    return 0
+
+EXPORT_WRITERS = {'csv': write_csv, 'json': write_json, 'jsonl': write_jsonl, 'rtk': write_snapshot}
+
+def _cmd_export(args):
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if fmt not in EXPORT_WRITERS:
+        print(f"Неизвестный формат: {fmt}. Разрешено: {', '.join(EXPORT_WRITERS)}.", file=sys.stderr)
+        return 2
+    store = load_store()
+    try:
+        EXPORT_WRITERS[fmt](store, args.output)
+    except Exception as e:
+        print(f"Ошибка при выгрузке: {e}", file=sys.stderr)
+        return 1
+    print(f"Выгружено записей: {len(store)} -> {args.output}", file=sys.stderr)
+    return 0
+
+def _cmd_convert(args):
+    try:
+        if os.path.splitext(args.src)[1].lower() == '.rtk':
+            convert_from_snapshot(args.src, args.dst)
+        elif os.path.splitext(args.dst)[1].lower() == '.rtk':
+            report = convert_to_snapshot(args.src, args.dst)
+            if report.bad or report.error:
+                print(report.summary(), file=sys.stderr)
+        else:
+            print("Один из файлов должен быть бинарным снимком .rtk.", file=sys.stderr)
+            return 2
+    except Exception as e:
+        print(f"Ошибка при преобразовании: {e}", file=sys.stderr)
+        return 1
+    print(f"Преобразовано: {args.src} -> {args.dst}", file=sys.stderr)
+    return 0
+
+def _cmd_top_defective(args):
+    result = defective_by_branch(load_store(), args.top)
+    if result is None:
+        print("Нет данных для отображения.", file=sys.stderr)
+        return 1
+    result.rename('count').rename_axis('branch').to_csv(sys.stdout, header=True, lineterminator='\n')
+    if args.output and not result.empty:
+        _save_figure(lambda data: top_defective_figure(data, args.top), result, args.output)
+    return 0
+
+def _cmd_brand_condition(args):
+    pivot_table = brand_condition_pivot(load_store(), args.start)
+    if pivot_table is None:
+        print("Нет данных для отображения.", file=sys.stderr)
+        return 1
+    if not pivot_table.empty:
+        pivot_table.rename_axis('brand').to_csv(sys.stdout, lineterminator='\n')
+        if args.output:
+            _save_figure(brand_condition_figure, pivot_table, args.output)
+    return 0
+
+def _cmd_dynamics(args):
+    filters = {f: normalize(getattr(args, f)) for f in RollupCube.FIELDS if getattr(args, f)}
+    try:
+        frame = condition_dynamics(load_store(), args.by, args.months, **filters)
+    except ValueError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 2
+    # строки - месяц установки, значения полей - текущие
+    frame.rename_axis('install_month').to_csv(sys.stdout, lineterminator='\n', date_format='%Y-%m')
+    if args.output and not frame.empty:
+        _save_figure(dynamics_series_figure, frame, args.output)
+    return 0
+
+def _cmd_warranty(args):
+    store = load_store()
+    summary, devices = warranty_report(store, args.days)
+    summary.to_csv(sys.stdout, lineterminator='\n')
+    if args.output:
+        devices.to_csv(args.output, index=False, encoding='utf-8-sig')
+        print(f"Устройств в отчете: {len(devices)} -> {args.output}", file=sys.stderr)
+    if args.chart and not summary.empty:
+        _save_figure(lambda data: warranty_figure(data, args.days), summary, args.chart)
+    return 0
+
+def _cmd_history(args):
+    store = load_store()
+    history = load_history()
+    by = args.by or ('condition' if args.as_of else 'brand')
+    if args.as_of:
+        then = history.state_at(date.fromisoformat(args.as_of), store)
+        table = pd.crosstab(then['branch'], then[by])
+        if args.output:
+            then['date'] = then['date'].dt.strftime('%Y-%m-%d')
+            then.to_csv(args.output, index=False, encoding='utf-8-sig')
+            print(f"Состояние на {args.as_of}: {len(then)} устройств -> {args.output}", file=sys.stderr)
+    elif args.time_in:
+        table = time_in_state(history, store, normalize(args.time_in), args.field, by)
+    else:
+        table = failure_counts(history, store, by)
+        table.index = table.index.strftime('%Y-%m')
+    table.to_csv(sys.stdout, lineterminator='\n')
+    return 0
+
+def _cmd_serve(args):
+    return run_service(args.host, args.port)
+
+def cli_main(argv=None):
+    """Запуск без окна (ночные задачи, скрипты). Таблицы - CSV в stdout, сообщения - в stderr."""
+    parser = argparse.ArgumentParser(
+        prog='rtk_4.py',
+        description="Учет оборудования без окна: поиск, импорт, выгрузка и отчеты. "
+                    "Без аргументов запускается окно.")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('lookup', help='найти устройство по IMEI')
+    p.add_argument('imei')
+    p.add_argument('--branch', default='', help='филиал (необязательно)')
+    p.add_argument('--partial', action='store_true', help='часть IMEI: начало, конец или середина номера')
+    p.add_argument('--brand', default='', help='марка (для --partial)')
+    p.add_argument('--limit', type=int, default=IMEI_SUGGEST_LIMIT, help='сколько кандидатов вывести')
+    p.set_defaults(func=_cmd_lookup)
+
+    p = sub.add_parser('import', help='массовый импорт CSV с проверкой')
+    p.add_argument('file')
+    p.add_argument('--rejected', help='куда записать отклоненные строки (по умолчанию <файл>.rejected.csv)')
+    p.set_defaults(func=_cmd_import)
+
+    p = sub.add_parser('export', help='выгрузить базу в файл')
+    p.add_argument('output')
+    p.add_argument('--format', choices=sorted(EXPORT_WRITERS), help='по умолчанию - по расширению файла')
+    p.set_defaults(func=_cmd_export)
+
+    p = sub.add_parser('convert', help='файл JSON / CSV / JSON Lines в бинарный снимок .rtk и обратно')
+    p.add_argument('src')
+    p.add_argument('dst', help='формат - по расширению файла')
+    p.set_defaults(func=_cmd_convert)
+
+    p = sub.add_parser('top-defective', help='ТОП филиалов по неисправным (CSV)')
+    p.add_argument('--top', type=int, default=10)
+    p.add_argument('--output', help='график в файл .png или .svg')
+    p.set_defaults(func=_cmd_top_defective)
+
+    p = sub.add_parser('brand-condition', help='устройства по брендам и состояниям (CSV)')
+    p.add_argument('--start', default=PIVOT_START, help='с какой даты, YYYY-MM-DD')
+    p.add_argument('--output', help='график в файл .png или .svg')
+    p.set_defaults(func=_cmd_brand_condition)
+
+    p = sub.add_parser('dynamics', help='текущее состояние устройств по месяцам установки (CSV), '
+                                        'например неисправные сейчас по филиалам')
+    p.add_argument('--by', choices=RollupCube.FIELDS, default='condition', help='столбцы таблицы')
+    p.add_argument('--months', type=int, default=ROLLUP_MONTHS, help='за сколько последних месяцев')
+    for field in RollupCube.FIELDS:
+        p.add_argument('--' + field, default='', help='только это значение поля')
+    p.add_argument('--output', help='график в файл .png или .svg')
+    p.set_defaults(func=_cmd_dynamics)
+
+    p = sub.add_parser('warranty', help='гарантия по филиалам (CSV) и список истекающих')
+    p.add_argument('--days', type=int, default=30, help='истекает в ближайшие N дней')
+    p.add_argument('--output', help='список устройств в CSV')
+    p.add_argument('--chart', help='график в файл .png или .svg')
+    p.set_defaults(func=_cmd_warranty)
+
+    p = sub.add_parser('history', help='история изменений: состояние на дату, время в состоянии, поломки')
+    mode = p.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--as-of', help='состояние парка на дату YYYY-MM-DD (CSV филиал x --by)')
+    mode.add_argument('--time-in', help='дней в значении поля --field, например ремонт, по значениям --by')
+    mode.add_argument('--failures', action='store_true', help='переходов в «неисправен» по месяцам и --by')
+    p.add_argument('--field', choices=HISTORY_FIELDS, default='condition', help='поле для --time-in')
+    p.add_argument('--by', choices=CATEGORY_FIELDS, default=None,
+                   help='группировка (по умолчанию: condition для --as-of, brand для остальных)')
+    p.add_argument('--output', help='для --as-of: все устройства с состоянием на дату в CSV')
+    p.set_defaults(func=_cmd_history)
+
+    p = sub.add_parser('serve', help='сервис для нескольких операторов (localhost)')
+    p.add_argument('--host', default=SERVICE_HOST)
+    p.add_argument('--port', type=int, default=SERVICE_PORT)
+    p.set_defaults(func=_cmd_serve)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
 # ===================== запуск =====================
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli_main())
     root = tk.Tk()
     app = App(root)
     root.mainloop()
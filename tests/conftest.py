@@ -0,0 +1,56 @@
+import csv
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rtk_4  # noqa: E402
+
+# замеры в тестах не пишутся в rtk_metrics.jsonl
+rtk_4.metrics.filename = None
+
+BRANCHES = ('москва', 'казань', 'омск', 'тверь')
+BRANDS = ('телтоника', 'галилео', 'навтелеком')
+STATUSES = ('исправен', 'неисправен')
+CONDITIONS = ('установлен', 'неустановлен', 'демонтирован', 'диагностика', 'ремонт')
+LOCATIONS = ('склад', 'тс')
+
+
+def random_record(rnd, imei=None):
+    """Запись с допустимыми значениями всех полей (dict, как в файлах базы)."""
+    return {
+        'branch': rnd.choice(BRANCHES),
+        'imei': imei or str(rnd.randrange(10 ** 14, 10 ** 15)),
+        'brand': rnd.choice(BRANDS),
+        'model': str(rnd.randrange(100, 1000)),
+        'status': rnd.choice(STATUSES),
+        'condition': rnd.choice(CONDITIONS),
+        'location': rnd.choice(LOCATIONS),
+        'date': f"{rnd.randrange(1998, 2026)}-{rnd.randrange(1, 13):02d}-{rnd.randrange(1, 29):02d}",
+    }
+
+
+@pytest.fixture
+def rnd():
+    return random.Random(0)
+
+
+@pytest.fixture
+def write_csv():
+    """Записывает записи в CSV с заголовком, как при выгрузке из учетной системы."""
+    def write(path, records):
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.DictWriter(f, fieldnames=rtk_4.EQUIPMENT_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    return write
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Файлы базы, журнала и снимков - во временном каталоге."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,87 @@
+from collections import Counter
+
+import pandas as pd
+import pytest
+from conftest import BRANCHES, BRANDS, CONDITIONS, random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore
+
+
+def _brute(store):
+    records = [eq.to_dict() for eq in store]
+    faulty = Counter(rec['branch'] for rec in records if 'неисправен' in rec['status'].lower())
+    pivot = Counter((rec['brand'], rec['condition']) for rec in records if rec['date'] >= rtk_4.PIVOT_START)
+    return dict(faulty), dict(pivot)
+
+
+def _check(store):
+    faulty, pivot = _brute(store)
+    assert store.defective_counts() == faulty
+    assert store.brand_condition_counts() == pivot
+    # готовые счетчики дают те же графики, что и подсчет по DataFrame списка записей
+    records = list(store)
+    expected = rtk_4.defective_by_branch(records, 100)
+    got = rtk_4.defective_by_branch(store, 100)
+    assert got.to_dict() == expected.to_dict() and got.dtype == 'int64'
+    pd.testing.assert_frame_equal(rtk_4.brand_condition_pivot(store), rtk_4.brand_condition_pivot(records),
+                                  check_names=False, check_dtype=False)
+
+
+def _edit(store, rnd):
+    eq = store.get(rnd.choice([e.imei for e in store]))
+    field = rnd.choice(['branch', 'status', 'brand', 'condition', 'date', 'location'])
+    if field == 'date':
+        # переход через PIVOT_START в обе стороны и устройства без даты
+        value = rnd.choice(['1999-12-31', '2000-01-01', '2014-05-05', ''])
+        value = rtk_4.ordinal_to_datetime(rtk_4.parse_date_ordinal(value))
+    else:
+        value = rnd.choice({
+            'branch': BRANCHES + ('новый филиал',),
+            'status': ('исправен', 'неисправен', 'Частично НЕИСПРАВЕН'),
+            'brand': BRANDS,
+            'condition': CONDITIONS,
+            'location': ('склад', 'тс'),
+        }[field])
+    store.update(eq, **{field: value})
+
+
+@pytest.fixture
+def store(rnd):
+    return EquipmentStore([Equipment.from_dict(random_record(rnd)) for _ in range(300)])
+
+
+def test_counters_follow_edits(store, rnd):
+    _check(store)
+    for i in range(500):
+        _edit(store, rnd)
+        if i % 9 == 0:
+            store.add(Equipment.from_dict(random_record(rnd)))
+        if i % 13 == 0:
+            store.upsert(Equipment.from_dict(random_record(rnd, rnd.choice([e.imei for e in store]))))
+        if i % 100 == 0:
+            _check(store)
+    _check(store)
+
+
+def test_counters_of_frozen_copy_and_adopted_snapshot(store, rnd, workdir):
+    for _ in range(100):
+        _edit(store, rnd)
+    copy = store.frozen_copy()
+    expected = _brute(store)
+    for _ in range(50):
+        _edit(store, rnd)
+    assert (copy.defective_counts(), copy.brand_condition_counts()) == expected
+    rtk_4.write_snapshot(store)
+    loaded = EquipmentStore()
+    rtk_4.load_snapshot_into(loaded)
+    _check(loaded)
+    assert _brute(loaded) == _brute(store)
+
+
+def test_counters_of_empty_and_replaced_store(store, rnd):
+    empty = EquipmentStore()
+    assert empty.defective_counts() == {} and empty.brand_condition_counts() == {}
+    assert rtk_4.defective_by_branch(empty) is None and rtk_4.brand_condition_pivot(empty) is None
+    store.replace_all(Equipment.from_dict(random_record(rnd)) for _ in range(40))
+    _check(store)
@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore
+
+# порча одного поля -> строка, которую validate_fields отклоняет
+BREAKERS = [
+    ('branch', ''), ('branch', 'moscow'), ('brand', 'бренд 1'), ('status', 'сломан'),
+    ('condition', 'Склад'), ('location', 'гараж'), ('imei', '12'), ('imei', '1234567890123456'),
+    ('imei', '12a45'), ('model', '7-1'), ('date', '2020-13-01'), ('date', '01.02.2020'), ('date', ''),
+]
+
+
+def _import(write_csv, workdir, records, store=None, chunk_size=rtk_4.BULK_CHUNK_ROWS):
+    write_csv(workdir / 'import.csv', records)
+    store = store if store is not None else EquipmentStore()
+    report = rtk_4.bulk_import_csv(str(workdir / 'import.csv'), store, chunk_size)
+    return store, report
+
+
+def _reasons(report):
+    return dict(zip(report.rejected()['line'], report.rejected()['reason']))
+
+
+def test_rules_match_validate_fields(rnd):
+    records = [random_record(rnd) for _ in range(len(BREAKERS) * 3)]
+    for i, (field, value) in enumerate(BREAKERS * 3):
+        records[i][field] = value
+    records[0]['brand'] = records[0]['brand'].upper() + '  '   # регистр и пробелы нормализуются
+    out, reasons = rtk_4.validate_frame(pd.DataFrame(records, dtype=str))
+    for i, rec in enumerate(records):
+        ok, err, norm = rtk_4.validate_fields(rec)
+        assert (reasons[i] if isinstance(reasons[i], str) else None) == err
+        if ok:
+            assert {k: out.at[i, k] for k in rtk_4.EQUIPMENT_FIELDS} == norm
+
+
+def test_duplicates_in_file_and_in_base(rnd, workdir, write_csv):
+    base = [random_record(rnd) for _ in range(3)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in base])
+    fresh = [random_record(rnd) for _ in range(4)]
+    records = fresh[:2] + [dict(base[1], branch='омск'), dict(fresh[0], branch='тверь')] + fresh[2:]
+    store, report = _import(write_csv, workdir, records, store)
+    assert report.total == 6 and report.accepted == 4
+    assert _reasons(report) == {4: "Этот IMEI уже существует в базе.", 5: "IMEI повторяется в файле."}
+    assert store.get(fresh[0]['imei']).to_dict() == fresh[0]
+
+
+def test_invalid_row_does_not_block_later_valid_row_with_same_imei(rnd, workdir, write_csv):
+    valid = random_record(rnd, imei='123456')
+    invalid = dict(valid, status='чепуха')
+    store, report = _import(write_csv, workdir, [invalid, valid])
+    assert report.accepted == 1
+    assert list(_reasons(report)) == [2]
+    assert store.get('123456').to_dict() == valid
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 1000])
+def test_duplicates_across_chunks(rnd, workdir, write_csv, chunk_size):
+    records = [random_record(rnd) for _ in range(5)]
+    records.append(dict(records[0], model='1'))
+    store, report = _import(write_csv, workdir, records, chunk_size=chunk_size)
+    assert report.accepted == 5
+    assert _reasons(report) == {7: "IMEI повторяется в файле."}
+    assert store.get(records[0]['imei']).model == records[0]['model']
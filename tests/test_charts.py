@@ -0,0 +1,114 @@
+import time
+
+import pandas as pd
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import ChartCache, ChartWorker, Equipment, EquipmentStore
+
+
+def _store(rnd, n=100):
+    return EquipmentStore([Equipment.from_dict(random_record(rnd)) for _ in range(n)])
+
+
+def _results(worker, count, timeout=10):
+    deadline = time.monotonic() + timeout
+    results = []
+    while len(results) < count:
+        assert time.monotonic() < deadline
+        try:
+            results.append(worker.results.get(timeout=0.05))
+        except rtk_4.queue.Empty:
+            pass
+    return results
+
+
+def test_new_version_invalidates_cache():
+    cache = ChartCache()
+    key = cache.want('top_defective', 1, {'top_n': 10})
+    assert key not in cache
+    assert cache.accept(key, 'данные')
+    assert cache.get(key) == 'данные'
+    other = cache.want('warranty', 1, {'within_days': 30})
+    cache.accept(other, 'гарантия')
+    assert len(cache) == 2
+    # данные изменились: все наборы прежней версии вытеснены
+    fresh = cache.want('top_defective', 2, {'top_n': 10})
+    assert fresh != key and len(cache) == 0
+
+
+def test_stale_result_is_dropped():
+    cache = ChartCache()
+    old = cache.want('dynamics', 1, {'months': 36})
+    new = cache.want('dynamics', 2, {'months': 36})
+    # результат, подготовленный до правки, пришел позже запроса новой версии
+    assert not cache.accept(old, 'старые данные')
+    assert old not in cache
+    assert cache.accept(new, 'новые данные')
+    assert cache.get(new) == 'новые данные'
+
+
+def test_result_for_other_chart_is_cached_but_not_drawn():
+    cache = ChartCache()
+    first = cache.want('top_defective', 5, {'top_n': 10})
+    second = cache.want('brand_condition', 5, {})
+    assert not cache.accept(first, 'топ')
+    assert first in cache
+    assert cache.accept(second, 'бренды')
+
+
+def test_unknown_version_is_not_cached():
+    cache = ChartCache()
+    key = cache.want('top_defective', None, {'top_n': 10})
+    assert cache.accept(key, 'данные с сервиса')
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = ChartCache(size=3)
+    keys = []
+    for n in range(3):
+        keys.append(cache.want('top_defective', 1, {'top_n': n}))
+        cache.accept(keys[-1], n)
+    cache.get(keys[0])
+    extra = cache.want('top_defective', 1, {'top_n': 99})
+    cache.accept(extra, 99)
+    assert keys[0] in cache and keys[1] not in cache and keys[2] in cache and extra in cache
+
+
+def test_worker_prepares_on_frozen_copy_and_runs_only_latest(rnd):
+    store = _store(rnd)
+    copy = store.frozen_copy()
+    expected = rtk_4.defective_by_branch(copy, 3)
+    # правка после снимка не попадает в данные графика этой версии
+    eq = next(iter(store))
+    store.update(eq, status='неисправен' if eq.status != 'неисправен' else 'исправен')
+    worker = ChartWorker()
+    cache = ChartCache()
+    stale = cache.want('top_defective', copy.version, {'top_n': 3})
+    worker.submit(stale, 'top_defective', copy, {'top_n': 3})
+    latest = cache.want('top_defective', store.version, {'top_n': 3})
+    worker.submit(latest, 'top_defective', store.frozen_copy, {'top_n': 3})
+    worker.start()
+    try:
+        (key, data, error), = _results(worker, 1)
+    finally:
+        worker.stop()
+        worker.join(5)
+    assert worker.results.empty()
+    # из двух ожидавших задач выполнена только последняя
+    assert key == latest and error is None and cache.accept(key, data)
+    assert not data.equals(expected)
+    pd.testing.assert_series_equal(data, rtk_4.defective_by_branch(store, 3))
+
+
+def test_worker_reports_prepare_errors(rnd):
+    worker = ChartWorker()
+    worker.start()
+    try:
+        worker.submit(('dynamics', (), 1), 'dynamics', _store(rnd), {'months': 'много'})
+        (key, data, error), = _results(worker, 1)
+    finally:
+        worker.stop()
+        worker.join(5)
+    assert data is None and error is not None
@@ -0,0 +1,70 @@
+import csv
+import io
+import os
+import subprocess
+import sys
+from collections import Counter
+
+import pytest
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def records(rnd, workdir, monkeypatch):
+    """База equipment_data.json во временном каталоге, хранилище - файлы."""
+    monkeypatch.setattr(rtk_4, 'STORAGE_BACKEND', 'files')
+    records = [random_record(rnd) for _ in range(40)]
+    records[0]['imei'] = '012345678901234'
+    rtk_4.write_json(EquipmentStore([Equipment.from_dict(rec) for rec in records]))
+    return records
+
+
+def _rows(text):
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def test_lookup(records, capsys):
+    assert rtk_4.cli_main(['lookup', records[0]['imei']]) == 0
+    assert _rows(capsys.readouterr().out) == [records[0]]
+    assert rtk_4.cli_main(['lookup', records[0]['imei'], '--branch', 'нет такого']) == 1
+    assert rtk_4.cli_main(['lookup', '0123456', '--partial']) == 0
+    found = _rows(capsys.readouterr().out)
+    assert found[0]['imei'] == records[0]['imei'] and found[0]['match'] == 'начало'
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'json', 'jsonl', 'rtk'])
+def test_export(records, workdir, fmt):
+    output = str(workdir / f'export.{fmt}')
+    assert rtk_4.cli_main(['export', output]) == 0
+    if fmt == 'rtk':
+        store = EquipmentStore()
+        rtk_4.load_snapshot_into(store, output)
+        loaded = [eq.to_dict() for eq in store]
+    else:
+        reader = {'csv': rtk_4.iter_csv, 'json': rtk_4.iter_json, 'jsonl': rtk_4.iter_jsonl}[fmt]
+        loaded = [eq.to_dict() for chunk in reader(output) for eq in chunk]
+    assert loaded == records
+
+
+def test_top_defective(records, capsys):
+    assert rtk_4.cli_main(['top-defective', '--top', '3']) == 0
+    rows = _rows(capsys.readouterr().out)
+    expected = Counter(rec['branch'] for rec in records if rec['status'] == 'неисправен')
+    assert {row['branch']: int(row['count']) for row in rows} == dict(expected.most_common(3))
+    assert [int(row['count']) for row in rows] == sorted(expected.values(), reverse=True)[:3]
+
+
+def test_cli_runs_without_tkinter(records, workdir):
+    # как на сервере без python3-tk: импорт tkinter запрещен
+    code = ("import sys; sys.modules['tkinter'] = None; sys.path.insert(0, sys.argv[1]); "
+            "import rtk_4; sys.exit(rtk_4.cli_main(sys.argv[2:]))")
+    for argv in (['lookup', records[0]['imei']], ['top-defective'], ['export', 'out.csv']):
+        result = subprocess.run([sys.executable, '-c', code, ROOT] + argv, cwd=workdir,
+                                capture_output=True, text=True, encoding='utf-8')
+        assert result.returncode == 0, result.stderr
+    assert (workdir / 'out.csv').exists()
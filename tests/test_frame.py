@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+from conftest import BRANCHES, CONDITIONS, random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore
+
+
+def _fresh(store):
+    """DataFrame, построенный заново из записей, в порядке обхода хранилища."""
+    records = [eq.to_dict() for eq in store]
+    df = pd.DataFrame(records, columns=rtk_4.EQUIPMENT_FIELDS)
+    df['date'] = pd.to_datetime(df['date'].replace('', None), format='%Y-%m-%d')
+    return df
+
+
+def _check(store):
+    frame = store.frame()
+    expected = _fresh(store)
+    assert list(frame.columns) == list(rtk_4.EQUIPMENT_FIELDS)
+    assert list(frame.index) == [store._row_of_imei(imei) for imei in expected['imei']]
+    for name in rtk_4.CATEGORY_FIELDS:
+        assert frame[name].dtype == 'category'
+    got = frame.reset_index(drop=True)
+    for name in rtk_4.EQUIPMENT_FIELDS:
+        if name == 'date':
+            assert got[name].dtype == 'datetime64[s]'
+            pd.testing.assert_series_equal(got[name], expected[name].astype('datetime64[s]'))
+        else:
+            assert got[name].astype(object).tolist() == expected[name].tolist(), name
+
+
+@pytest.fixture
+def store(rnd):
+    return EquipmentStore([Equipment.from_dict(random_record(rnd)) for _ in range(200)])
+
+
+def test_frame_is_cached_until_version_changes(store):
+    frame = store.frame()
+    before = frame.copy()
+    assert store.frame() is frame
+    first = store.get(frame['imei'].iloc[0])
+    status = 'неисправен' if first.status != 'неисправен' else 'исправен'
+    store.update(first, status=status, condition='ремонт', model='999')
+    changed = store.frame()
+    assert changed is not frame and store.frame() is changed
+    assert changed['status'].iloc[0] == status and changed['model'].iloc[0] == '999'
+    # прежний кадр не меняется: его мог взять отчет в другом потоке
+    pd.testing.assert_frame_equal(frame, before)
+
+
+def test_frame_follows_edits_adds_and_order(store, rnd):
+    _check(store)
+    imeis = [eq.imei for eq in store]
+    for i in range(300):
+        eq = store.get(rnd.choice(imeis))
+        field = rnd.choice(['branch', 'condition', 'model', 'date'])
+        value = {
+            'branch': lambda: rnd.choice(BRANCHES + ('новый филиал',)),
+            'condition': lambda: rnd.choice(CONDITIONS),
+            'model': lambda: str(rnd.randrange(100, 1000)),
+            'date': lambda: rtk_4.ordinal_to_datetime(rnd.choice([0, 730000, 738000])),
+        }[field]()
+        store.update(eq, **{field: value})
+        if i % 11 == 0:
+            rec = random_record(rnd)
+            store.add(Equipment.from_dict(rec))
+            imeis.append(rec['imei'])
+        if i % 40 == 0:
+            _check(store)
+        if i == 150:
+            store.sort_by(('branch', 'date'), descending=True)
+    _check(store)
+
+
+def test_frame_after_replace_and_adopt(store, rnd, workdir):
+    store.frame()
+    store.replace_all(Equipment.from_dict(random_record(rnd)) for _ in range(30))
+    _check(store)
+    rtk_4.write_snapshot(store)
+    store.frame()
+    loaded = EquipmentStore()
+    rtk_4.load_snapshot_into(loaded)
+    _check(loaded)
+    empty = EquipmentStore()
+    assert empty.frame().empty and list(empty.frame().columns) == list(rtk_4.EQUIPMENT_FIELDS)
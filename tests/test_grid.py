@@ -0,0 +1,181 @@
+from types import SimpleNamespace
+
+import pytest
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentGrid, EquipmentStore
+
+PAGE = 10
+
+
+class _Var:
+    def __init__(self, value=''):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class _Tree:
+    """Вместо Treeview: строки страницы (iid, значения) и подписи заголовков."""
+
+    def __init__(self):
+        self.items = []
+        self.headings = {}
+
+    def get_children(self):
+        return [iid for iid, _ in self.items]
+
+    def delete(self, *iids):
+        self.items = [item for item in self.items if item[0] not in iids]
+
+    def insert(self, parent, index, iid, values):
+        self.items.append((iid, values))
+
+    def heading(self, name, text):
+        self.headings[name] = text
+
+
+class _Window:
+    def __init__(self):
+        self.calls = []
+
+    def after(self, ms, func):
+        self.calls.append(func)
+        return len(self.calls)
+
+
+def _grid(store, page_rows=PAGE):
+    """EquipmentGrid без Tk: состояние как после __init__, виджеты - заглушки."""
+    grid = EquipmentGrid.__new__(EquipmentGrid)
+    grid.store, grid.on_edit, grid.page_rows = store, None, page_rows
+    grid.offset, grid.sort_fields, grid.descending = 0, None, False
+    grid._rows = grid._version = grid._filter_job = None
+    grid.closed = False
+    grid.window = _Window()
+    grid.filter_var, grid.field_var = _Var(), _Var(EquipmentGrid.ALL_FIELDS)
+    grid.tree = _Tree()
+    grid.scrollbar = SimpleNamespace(set=lambda first, last: setattr(grid, 'scrolled', (first, last)))
+    grid.info_label = SimpleNamespace(config=lambda text: setattr(grid, 'info', text))
+    grid.refresh()
+    return grid
+
+
+def _shown(grid):
+    """Записи видимой страницы: iid - номер строки, значения должны быть ее записью."""
+    rows = []
+    for iid, values in grid.tree.items:
+        eq = grid.store.row(int(iid))
+        assert tuple(values) == eq.to_tuple()
+        rows.append(eq.to_dict())
+    return rows
+
+
+@pytest.fixture
+def store(rnd):
+    return EquipmentStore([Equipment.from_dict(random_record(rnd)) for _ in range(95)])
+
+
+def test_pages_cover_all_records_in_order(store):
+    grid = _grid(store)
+    everything = [eq.to_dict() for eq in store]
+    seen = []
+    for offset in range(0, len(store), PAGE):
+        grid.scroll_to(offset)
+        seen += _shown(grid)
+    # последняя страница прижата к концу: записи 86-95, а не 91-95
+    assert grid.offset == len(store) - PAGE and grid.info == f"Записи 86–95 из {len(store)}"
+    assert seen[:90] == everything[:90] and seen[90:] == everything[85:]
+    assert grid.scrolled == (85 / 95, 1.0)
+
+
+@pytest.mark.parametrize('args, offset', [
+    (('moveto', '0.5'), 47),
+    (('moveto', '1.0'), 85),
+    (('moveto', '-0.2'), 0),
+    (('scroll', '1', 'pages'), 30),
+    (('scroll', '-3', 'units'), 17),
+])
+def test_scrollbar_moves_window(store, args, offset):
+    grid = _grid(store)
+    grid.scroll_to(20)
+    grid._on_scroll(*args)
+    assert grid.offset == offset
+    assert _shown(grid) == [store.row(r).to_dict() for r in store.row_numbers(offset, PAGE)]
+
+
+def test_wheel_and_keys(store):
+    grid = _grid(store)
+    assert grid._on_wheel(SimpleNamespace(num=5, delta=0)) == 'break' and grid.offset == 3
+    grid._on_wheel(SimpleNamespace(num=0, delta=120))
+    grid._on_wheel(SimpleNamespace(num=4, delta=0))
+    assert grid.offset == 0
+    grid._scroll_by(grid.page_rows)
+    assert grid.offset == PAGE
+
+
+def test_sort_cycle(store):
+    grid = _grid(store)
+    branches = sorted(eq.branch for eq in store)
+    grid.toggle_sort('branch')
+    pages = []
+    for offset in range(0, len(store), PAGE):
+        grid.scroll_to(offset)
+        pages.append([rec['branch'] for rec in _shown(grid)])
+    assert pages[0] == branches[:PAGE] and pages[-1] == branches[-PAGE:]
+    assert grid.tree.headings['branch'].endswith('▲')
+    grid.toggle_sort('branch')
+    assert grid.offset == 0 and [rec['branch'] for rec in _shown(grid)] == branches[::-1][:PAGE]
+    assert grid.tree.headings['branch'].endswith('▼')
+    grid.toggle_sort('branch')
+    assert grid.sort_fields is None and _shown(grid) == [eq.to_dict() for eq in store][:PAGE]
+    grid.toggle_sort('imei')   # по IMEI таблица не сортируется
+    assert grid.sort_fields is None
+
+
+@pytest.mark.parametrize('label, text', [
+    (EquipmentGrid.ALL_FIELDS, 'каз'),
+    ('IMEI', '3'),
+    ('Дата', '2010'),
+    ('Филиал', 'нет такого'),
+])
+def test_filter_with_sort(store, label, text):
+    grid = _grid(store)
+    grid.toggle_sort('date')
+    grid.toggle_sort('date')
+    grid.filter_var.value, grid.field_var.value = f"  {text} ", label
+    grid._apply_filter()
+    ordered = [store.row(r).to_dict() for r in store.sorted_view('date').rows][::-1]
+    field = {column_label: name for name, column_label, _ in EquipmentGrid.COLUMNS}.get(label)
+    if field == 'imei':
+        expected = [rec for rec in ordered if rec['imei'].startswith(text)]
+    elif field == 'date':
+        expected = [rec for rec in ordered if rec['date'].startswith(text)]
+    else:
+        expected = [rec for rec in ordered if any(text in rec[f] for f in rtk_4.CATEGORY_FIELDS)
+                    or rec['imei'].startswith(text) or rec['model'].startswith(text)]
+    assert grid.total() == len(expected)
+    seen = []
+    for offset in range(0, max(grid.total(), 1), PAGE):
+        grid.scroll_to(offset)
+        seen += _shown(grid)
+    assert seen[:len(expected) // PAGE * PAGE] == expected[:len(expected) // PAGE * PAGE]
+    assert seen[-PAGE:] == expected[-PAGE:]
+    if not expected:
+        assert grid.info == "Нет записей" and grid.scrolled == (0, 1)
+
+
+def test_store_changes_are_picked_up(store, rnd):
+    grid = _grid(store)
+    grid.filter_var.value, grid.field_var.value = 'ремонт', 'Состояние'
+    grid._apply_filter()
+    before = grid.total()
+    eq = next(eq for eq in store if eq.condition != 'ремонт')
+    store.update(eq, condition='ремонт')
+    store.add(Equipment.from_dict(dict(random_record(rnd), condition='ремонт')))
+    grid._watch_store()
+    assert grid.total() == before + 2 and grid.window.calls == [grid._watch_store]
+    grid.closed = True   # окно закрыто: опрос хранилища прекращается
+    grid._watch_store()
+    assert len(grid.window.calls) == 1
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+from conftest import CONDITIONS, LOCATIONS, STATUSES, random_record
+
+import rtk_4
+from rtk_4 import ChangeHistory, Equipment, EquipmentStore
+
+START = datetime(2025, 1, 1)
+EVENTS = 400
+
+
+def _history(workdir):
+    return ChangeHistory(str(workdir / 'h.history'), str(workdir / 'h.values'), str(workdir / 'h_snapshots'))
+
+
+def _fleet(rnd, workdir, snapshot_at=EVENTS // 2):
+    """Хранилище, история EVENTS правок (по минуте) и состояния после каждой правки для сверки."""
+    records = [random_record(rnd) for _ in range(60)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    history = _history(workdir)
+    states = [{rec['imei']: tuple(rec[f] for f in rtk_4.HISTORY_FIELDS) for rec in records}]
+    for i in range(EVENTS):
+        eq = store.get(rnd.choice(records)['imei'])
+        changes = {'status': rnd.choice(STATUSES), 'condition': rnd.choice(CONDITIONS),
+                   'location': rnd.choice(LOCATIONS)}
+        changes = dict(rnd.sample(sorted(changes.items()), rnd.randrange(1, 4)))
+        events = history.record(eq, changes, START + timedelta(minutes=i))
+        store.update(eq, **changes)
+        if events:
+            history.write([events])
+        state = dict(states[-1])
+        state[eq.imei] = tuple(getattr(eq, f) for f in rtk_4.HISTORY_FIELDS)
+        states.append(state)
+        if i + 1 == snapshot_at:
+            history.write_snapshot(*history.snapshot(store))
+    return store, history, states
+
+
+def _state(history, store, when):
+    frame = history.state_at(when, store)
+    imeis = [eq.imei for eq in store]
+    return {imei: tuple(str(frame.iloc[i][f]) for f in rtk_4.HISTORY_FIELDS) for i, imei in enumerate(imeis)}
+
+
+@pytest.mark.parametrize('minute', [0, 50, EVENTS // 2 - 1, EVENTS // 2 + 10, EVENTS * 3 // 4 - 5,
+                                    EVENTS * 3 // 4 + 5, EVENTS - 1])
+def test_state_at_matches_replay(rnd, workdir, minute):
+    store, history, states = _fleet(rnd, workdir)
+    assert len(history.snapshots) == 1
+    # minute - номер правки; состояние после нее (время правки входит)
+    assert _state(history, store, START + timedelta(minutes=minute)) == states[minute + 1]
+
+
+def test_state_before_history_is_initial(rnd, workdir):
+    store, history, states = _fleet(rnd, workdir)
+    assert _state(history, store, START - timedelta(days=1)) == states[0]
+
+
+def test_reloaded_history_gives_same_answers(rnd, workdir):
+    store, history, states = _fleet(rnd, workdir)
+    reloaded = _history(workdir)
+    assert reloaded.load() == len(history)
+    assert reloaded.snapshots == history.snapshots
+    for minute in (10, EVENTS // 2 + 20, EVENTS - 3):
+        assert _state(reloaded, store, START + timedelta(minutes=minute)) == states[minute + 1]
+
+
+def test_queued_snapshot_is_not_used_before_it_is_written(rnd, workdir):
+    store, history, states = _fleet(rnd, workdir, snapshot_at=None)
+    queued = history.snapshot(store)
+    assert history.snapshots == []
+    assert not history.snapshot_due()
+    minute = EVENTS - 2
+    assert _state(history, store, START + timedelta(minutes=minute)) == states[minute + 1]
+    history.write_snapshot(*queued)
+    assert history.snapshots == [len(history)]
+
+
+def test_failed_snapshot_write_is_not_recorded(rnd, workdir, monkeypatch):
+    store, history, states = _fleet(rnd, workdir, snapshot_at=None)
+    monkeypatch.setattr(rtk_4, 'HISTORY_SNAPSHOT_EVENTS', 10)
+    queued = history.snapshot(store)
+    (workdir / 'h_snapshots').write_text('не каталог')
+    with pytest.raises(OSError):
+        history.write_snapshot(*queued)
+    assert history.snapshots == []
+    assert history.snapshot_due()
+    assert _state(history, store, START + timedelta(minutes=100)) == states[101]
+
+
+def test_old_snapshots_are_trimmed(rnd, workdir, monkeypatch):
+    monkeypatch.setattr(rtk_4, 'HISTORY_SNAPSHOTS_KEPT', 2)
+    store, history, states = _fleet(rnd, workdir, snapshot_at=None)
+    eq = next(iter(store))
+    for i in range(3):
+        history.write_snapshot(*history.snapshot(store))
+        changes = {'status': 'неисправен' if eq.status == 'исправен' else 'исправен'}
+        history.record(eq, changes, START + timedelta(minutes=EVENTS + i))
+        store.update(eq, **changes)
+    assert len(history.snapshots) == 2
+    assert sorted(p.name for p in (workdir / 'h_snapshots').iterdir()) == \
+        [f'snapshot-{pos:012d}.npz' for pos in history.snapshots]
@@ -0,0 +1,79 @@
+import pytest
+from conftest import random_record
+
+from rtk_4 import Equipment, EquipmentStore
+
+KIND_ORDER = ('точно', 'начало', 'конец', 'середина')
+
+
+def _kind(imei, text):
+    if imei == text:
+        return 'точно'
+    if imei.startswith(text):
+        return 'начало'
+    if imei.endswith(text):
+        return 'конец'
+    if text in imei:
+        return 'середина'
+    return None
+
+
+def _brute(records, text, branch=None, brand=None):
+    found = [(rec['imei'], _kind(rec['imei'], text)) for rec in records
+             if (branch is None or rec['branch'] == branch) and (brand is None or rec['brand'] == brand)]
+    found = [(imei, kind) for imei, kind in found if kind]
+    # конец номера ищется по перевернутым номерам, поэтому и упорядочен по ним
+    return sorted(found, key=lambda item: (KIND_ORDER.index(item[1]),
+                                           int(item[0][::-1]) if item[1] == 'конец' else int(item[0])))
+
+
+def _fleet(rnd, n, widths=(15,)):
+    # мало разных цифр - много совпадений по началу, концу и середине
+    records = []
+    seen = set()
+    while len(records) < n:
+        imei = ''.join(rnd.choice('1237') for _ in range(rnd.choice(widths)))
+        if imei not in seen:
+            seen.add(imei)
+            records.append(random_record(rnd, imei))
+    return records
+
+
+def _probes(rnd, records, count=40):
+    probes = []
+    for _ in range(count):
+        imei = rnd.choice(records)['imei']
+        start = rnd.randrange(len(imei))
+        probes.append(imei[start:start + rnd.randrange(1, 7)])
+    return probes + [records[0]['imei'], '9', '12']
+
+
+def _search(store, text, limit, **filters):
+    return [(eq.imei, kind) for eq, kind in store.imei_candidates(text, limit, **filters)]
+
+
+def test_candidates_match_brute_force_in_order(rnd):
+    records = _fleet(rnd, 2000)
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    for text in _probes(rnd, records):
+        expected = _brute(records, text)
+        assert _search(store, text, len(records)) == expected
+        assert _search(store, text, 7) == expected[:7]
+
+
+@pytest.mark.parametrize('filters', [{'branch': 'омск'}, {'brand': 'галилео'}, {'branch': 'тверь', 'brand': 'телтоника'}])
+def test_filters(rnd, filters):
+    records = _fleet(rnd, 1500)
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    for text in _probes(rnd, records, 20):
+        assert _search(store, text, len(records), **filters) == _brute(records, text, **filters)
+
+
+def test_rows_added_after_build_and_mixed_widths(rnd):
+    records = _fleet(rnd, 1200, widths=(8, 12, 15))
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records[:1000]])
+    store.imei_candidates('12')   # индекс строится здесь, остальные строки - в хвосте
+    for rec in records[1000:]:
+        store.add(Equipment.from_dict(rec))
+    for text in _probes(rnd, records):
+        assert set(_search(store, text, len(records))) == set(_brute(records, text))
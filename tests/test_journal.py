@@ -0,0 +1,54 @@
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import ChangeJournal, Equipment, EquipmentStore
+
+
+def _journal_with(records, workdir):
+    journal = ChangeJournal(str(workdir / 'equipment_data.journal'))
+    journal.append_records(records)
+    return journal
+
+
+def test_replay_skips_torn_last_line(rnd, workdir):
+    records = [random_record(rnd) for _ in range(5)]
+    journal = _journal_with(records, workdir)
+    data = open(journal.filename, 'rb').read()
+    # сбой посреди последней строки
+    open(journal.filename, 'wb').write(data[:-25])
+    store = EquipmentStore()
+    assert journal.replay(store) == (4, 1)
+    assert [eq.to_dict() for eq in store] == records[:4]
+
+
+def test_append_after_torn_line_starts_new_line(rnd, workdir):
+    records = [random_record(rnd) for _ in range(3)]
+    journal = _journal_with(records, workdir)
+    data = open(journal.filename, 'rb').read()
+    open(journal.filename, 'wb').write(data[:-10])
+    late = random_record(rnd)
+    journal.append_records([late])
+    store = EquipmentStore()
+    assert journal.replay(store) == (3, 1)
+    assert [eq.to_dict() for eq in store] == records[:2] + [late]
+
+
+def test_replay_applies_later_entries_over_snapshot(rnd, workdir):
+    base = [random_record(rnd) for _ in range(4)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in base])
+    changed = dict(base[1], status='неисправен', condition='ремонт')
+    journal = _journal_with([changed, changed], workdir)
+    assert journal.replay(store) == (2, 0)
+    assert len(store) == 4
+    assert store.get(changed['imei']).to_dict() == changed
+
+
+def test_compact_writes_snapshot_and_clears_journal(rnd, workdir):
+    records = [random_record(rnd) for _ in range(10)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    journal = _journal_with(records[:3], workdir)
+    assert rtk_4.compact(store, journal)
+    assert open(journal.filename, 'rb').read() == b''
+    assert journal.entries == 0
+    loaded = rtk_4.load_store()
+    assert [eq.to_dict() for eq in loaded] == records
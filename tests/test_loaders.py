@@ -0,0 +1,125 @@
+import json
+
+import pytest
+from conftest import random_record
+
+import rtk_4
+
+
+def _load(reader, filename, chunk_size=7):
+    report = rtk_4.LoadReport(filename)
+    records = [eq.to_dict() for chunk in reader(filename, chunk_size, report=report) for eq in chunk]
+    return records, report
+
+
+def _json_text(records):
+    """Массив JSON и позиции, на которых заканчивается каждый элемент."""
+    text, ends = '[', []
+    for i, rec in enumerate(records):
+        text += (',\n' if i else '\n') + json.dumps(rec, ensure_ascii=False)
+        ends.append(len(text))
+    return text + '\n]\n', ends
+
+
+@pytest.fixture
+def records(rnd):
+    return [random_record(rnd) for _ in range(30)]
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 64, rtk_4.JSON_READ_SIZE])
+def test_corrupt_elements_are_skipped(records, workdir, read_size):
+    text, _ = _json_text(records)
+    broken = {
+        3: '{"branch": "москва", "imei": 12 34}',                    # не JSON
+        10: '{"branch": "омск", "imei": "1" "brand": "галилео"}',   # нет запятой
+        17: '"строка вместо объекта"',
+        25: json.dumps(dict(records[25], model=None), ensure_ascii=False),   # нет поля
+    }
+    for i, bad in broken.items():
+        text = text.replace(json.dumps(records[i], ensure_ascii=False), bad)
+    (workdir / 'data.json').write_text(text, encoding='utf-8')
+    report = rtk_4.LoadReport('data.json')
+    chunks = rtk_4._equipment_chunks(
+        rtk_4._guarded(rtk_4._json_array_records('data.json', read_size), report, 'JSON'), 5, report)
+    loaded = [eq.to_dict() for chunk in chunks for eq in chunk]
+    assert loaded == [rec for i, rec in enumerate(records) if i not in broken]
+    assert report.bad == len(broken) and report.error is None
+    assert [where for where, _ in report.samples] == [f"элемент {i}" for i in sorted(broken)]
+
+
+def test_corrupt_element_does_not_read_ahead(rnd, workdir, monkeypatch):
+    # за испорченной записью - больше JSON_MAX_RECORD_CHARS данных: о ней сообщается сразу
+    records = [random_record(rnd) for _ in range(rtk_4.JSON_MAX_RECORD_CHARS // 150)]
+    text, ends = _json_text(records)
+    text = text[:ends[0]] + ',\n{"branch": "москва", "imei": 12 34}' + text[ends[0]:]
+    (workdir / 'data.json').write_text(text, encoding='utf-8')
+    assert len(text) > rtk_4.JSON_MAX_RECORD_CHARS
+    read = []
+
+    def counting_open(*args, **kwargs):
+        f = open(*args, **kwargs)
+        real_read = f.read
+
+        def counted(size=-1):
+            chunk = real_read(size)
+            read.append(len(chunk))
+            return chunk
+        f.read = counted
+        return f
+
+    monkeypatch.setattr(rtk_4, 'open', counting_open, raising=False)
+    elements = rtk_4._json_array_records('data.json', read_size=4096)
+    assert not isinstance(next(elements)[1], Exception)
+    where, error = next(elements)
+    assert where == "элемент 1" and isinstance(error, ValueError)
+    assert sum(read) <= ends[0] + 3 * 4096
+
+
+@pytest.mark.parametrize('read_size', [5, rtk_4.JSON_READ_SIZE])
+def test_truncated_file_keeps_prefix(records, workdir, read_size):
+    text, ends = _json_text(records[:6])
+    for cut in range(0, len(text) - 3):
+        (workdir / 'data.json').write_text(text[:cut], encoding='utf-8')
+        report = rtk_4.LoadReport('data.json')
+        elements = rtk_4._guarded(rtk_4._json_array_records('data.json', read_size), report, 'JSON')
+        loaded = [eq.to_dict() for chunk in rtk_4._equipment_chunks(elements, 4, report) for eq in chunk]
+        assert loaded == [rec for rec, end in zip(records, ends) if end <= cut], cut
+        assert report.bad == 0 and report.error, cut
+
+
+def test_json_round_trip_and_empty_array(records, workdir):
+    rtk_4.write_json(rtk_4.EquipmentStore([rtk_4.Equipment.from_dict(rec) for rec in records]), 'data.json')
+    loaded, report = _load(rtk_4.iter_json, 'data.json')
+    assert loaded == records and report.rows == len(records) and not report.bad and not report.error
+    (workdir / 'empty.json').write_text('[]', encoding='utf-8')
+    loaded, report = _load(rtk_4.iter_json, 'empty.json')
+    assert loaded == [] and report.error is None
+
+
+def test_csv_bad_rows_are_reported(records, workdir, write_csv):
+    write_csv(workdir / 'data.csv', records)
+    with open(workdir / 'data.csv', 'a', encoding='utf-8') as f:
+        f.write('москва,123\n')  # короткая строка
+    loaded, report = _load(rtk_4.iter_csv, 'data.csv')
+    assert loaded == records
+    assert [where for where, _ in report.samples] == [f"строка {len(records) + 2}"]
+
+
+def test_jsonl_bad_lines_are_skipped(records, workdir):
+    lines = [json.dumps(rec, ensure_ascii=False) for rec in records]
+    lines[2] = lines[2][:-5]
+    (workdir / 'data.jsonl').write_text('\n'.join(lines) + '\n\n', encoding='utf-8')
+    loaded, report = _load(rtk_4.iter_jsonl, 'data.jsonl')
+    assert loaded == records[:2] + records[3:]
+    assert [where for where, _ in report.samples] == ["строка 3"]
+
+
+def test_report_summary_is_bounded(workdir):
+    report = rtk_4.LoadReport('data.json')
+    for i in range(report.MAX_SAMPLES + 5):
+        report.add_bad(f"элемент {i}", ValueError("плохо"))
+    report.error = "неожиданный конец файла"
+    lines = report.summary().split('\n')
+    assert lines[0] == f"data.json: загружено 0, пропущено {report.MAX_SAMPLES + 5}"
+    assert len(lines) == report.MAX_SAMPLES + 3
+    assert lines[-2] == "  ... и еще 5" and lines[-1].endswith("неожиданный конец файла")
@@ -0,0 +1,106 @@
+import json
+import math
+
+import pytest
+
+import rtk_4
+from rtk_4 import LatencyHistogram, Metrics
+
+# верхняя граница корзины больше любого значения в ней не более чем в 2 ** (1 / PER_DOUBLING) раз
+STEP = 2 ** (1 / LatencyHistogram.PER_DOUBLING)
+
+
+def _nearest_rank(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+@pytest.mark.parametrize('q', [0.01, 0.5, 0.9, 0.95, 0.99, 1.0])
+def test_percentile_bounds_true_value(rnd, q):
+    values = [LatencyHistogram.BASE_MS * 2 ** rnd.uniform(0, 20) for _ in range(2000)]
+    hist = LatencyHistogram()
+    for ms in values:
+        hist.add(ms)
+    true = _nearest_rank(values, q)
+    got = hist.percentile(q)
+    assert true * (1 - 1e-9) <= got <= true * STEP * (1 + 1e-9)
+    assert got <= max(values)
+
+
+def test_histogram_totals_and_edges():
+    hist = LatencyHistogram()
+    assert hist.percentile(0.5) == 0.0
+    for ms, rows in [(0.0, None), (0.001, 3), (5.0, 0), (5.0, 10)]:
+        hist.add(ms, rows)
+    assert hist.count == 4 and hist.total_ms == pytest.approx(10.001)
+    assert hist.max_ms == 5.0 and hist.rows == 13
+    # значения меньше BASE_MS - в первой корзине
+    assert hist.buckets[0] == 2
+    assert hist.percentile(0.5) == pytest.approx(LatencyHistogram.BASE_MS * STEP)
+    assert hist.percentile(1.0) == 5.0
+
+
+def test_record_and_summary():
+    m = Metrics(filename=None)
+    for ms in (1, 2, 3):
+        m.record('search', ms / 1000, rows=1)
+    m.record('save', 1.0)
+    summary = m.summary()
+    assert [row[0] for row in summary] == ['save', 'search']
+    op, count, p50, p95, top, rows = summary[1]
+    assert count == 3 and top == pytest.approx(3) and rows == 3
+    assert 2 <= p50 <= 2 * STEP and p95 == pytest.approx(3)
+
+
+def test_timer_records_even_on_error(tmp_path, monkeypatch):
+    ticks = iter([10.0, 10.25])
+    monkeypatch.setattr(rtk_4.time, 'perf_counter', lambda: next(ticks))
+    m = Metrics(filename=None)
+    with pytest.raises(RuntimeError):
+        with m.timer('load', rows=7):
+            raise RuntimeError
+    hist = m.histograms['load']
+    assert hist.count == 1 and hist.max_ms == pytest.approx(250) and hist.rows == 7
+
+
+def test_timed_counts_rows(monkeypatch):
+    m = Metrics(filename=None)
+    monkeypatch.setattr(rtk_4, 'metrics', m)
+
+    @rtk_4.timed('by_result', rows='result')
+    def listing(n):
+        return list(range(n))
+
+    @rtk_4.timed('by_arg', rows=0)
+    def total(items):
+        return sum(items)
+
+    @rtk_4.timed('by_func', rows=lambda result, args: result * 2)
+    def double(n):
+        return n
+
+    @rtk_4.timed('no_len', rows='result')
+    def number():
+        return 42
+
+    assert listing(5) == [0, 1, 2, 3, 4] and total([1, 2, 3]) == 6 and double(4) == 4 and number() == 42
+    assert listing.__name__ == 'listing'
+    rows = {op: h.rows for op, h in m.histograms.items()}
+    assert rows == {'by_result': 5, 'by_arg': 3, 'by_func': 8, 'no_len': 0}
+    assert all(h.count == 1 for h in m.histograms.values())
+
+
+def test_lines_go_to_own_rotating_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(rtk_4, 'METRICS_MAX_BYTES', 2000)
+    first, second = Metrics(str(tmp_path / 'a.jsonl')), Metrics(str(tmp_path / 'b.jsonl'))
+    first.record('search', 0.001, rows=2)
+    second.record('save', 0.002)
+    line = json.loads((tmp_path / 'a.jsonl').read_text(encoding='utf-8'))
+    assert line['op'] == 'search' and line['ms'] == 1.0 and line['rows'] == 2 and 'ts' in line
+    # у каждого Metrics - свой файл, строки другого в него не попадают
+    assert [json.loads(s)['op'] for s in (tmp_path / 'b.jsonl').read_text(encoding='utf-8').splitlines()] == ['save']
+    for _ in range(200):
+        first.record('search', 0.001)
+    files = sorted(p.name for p in tmp_path.iterdir() if p.name.startswith('a.jsonl'))
+    assert files == ['a.jsonl'] + [f'a.jsonl.{i}' for i in range(1, rtk_4.METRICS_BACKUPS + 1)]
+    assert all(p.stat().st_size <= 2000 for p in tmp_path.iterdir())
@@ -0,0 +1,49 @@
+from conftest import random_record
+
+from rtk_4 import ChangeJournal, Equipment, EquipmentStore, PersistenceWorker
+
+
+def _results(worker):
+    out = []
+    while not worker.results.empty():
+        out.append(worker.results.get_nowait()[:2])
+    return out
+
+
+def _worker(workdir, json_file):
+    journal = ChangeJournal(str(workdir / 'equipment_data.journal'))
+    worker = PersistenceWorker(journal, json_file=json_file, csv_file=str(workdir / 'equipment_data.csv'),
+                               snapshot_file=str(workdir / 'equipment_data.snapshot'), debounce=5)
+    worker.start()
+    return journal, worker
+
+
+def test_changes_before_failed_compact_reach_journal(rnd, workdir):
+    # свертка падает: каталога для JSON нет
+    journal, worker = _worker(workdir, str(workdir / 'missing' / 'equipment_data.json'))
+    records = [random_record(rnd) for _ in range(3)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    worker.submit_change(store.get(records[0]['imei']))
+    worker.submit_compact(store)
+    worker.submit_change(store.get(records[1]['imei']))
+    worker.flush()
+    worker.stop()
+    assert ('compact', False) in _results(worker)
+    replayed = EquipmentStore()
+    assert journal.replay(replayed) == (2, 0)
+    assert [eq.imei for eq in replayed] == [records[0]['imei'], records[1]['imei']]
+
+
+def test_changes_before_successful_compact_are_not_journaled(rnd, workdir):
+    journal, worker = _worker(workdir, str(workdir / 'equipment_data.json'))
+    records = [random_record(rnd) for _ in range(3)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    worker.submit_change(store.get(records[0]['imei']))
+    worker.submit_compact(store)
+    worker.submit_change(store.get(records[1]['imei']))
+    worker.flush()
+    worker.stop()
+    assert _results(worker) == [('compact', True), ('append', True)]
+    replayed = EquipmentStore()
+    assert journal.replay(replayed) == (1, 0)
+    assert [eq.imei for eq in replayed] == [records[1]['imei']]
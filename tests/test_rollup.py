@@ -0,0 +1,77 @@
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+from conftest import BRANCHES, CONDITIONS, STATUSES, random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore, RollupCube
+
+
+def _expected(store, by=None, **filters):
+    """То же, что RollupCube.series, через groupby по кадру хранилища."""
+    df = pd.DataFrame([eq.to_dict() for eq in store])
+    df['month'] = pd.to_datetime(df['date'], errors='coerce').dt.to_period('M').dt.to_timestamp()
+    df = df.dropna(subset=['month'])
+    months = pd.date_range(df['month'].min(), df['month'].max(), freq='MS', name='month')
+    for field, value in filters.items():
+        df = df[df[field] == value]
+    if by is None:
+        return df.groupby('month').size().reindex(months, fill_value=0).to_frame('count')
+    table = df.groupby(['month', by]).size().unstack(fill_value=0).reindex(months, fill_value=0)
+    return table.loc[:, table.sum() > 0]
+
+
+def _check(store, by=None, **filters):
+    got = store.rollup().series(by, **filters)
+    expected = _expected(store, by, **filters)
+    pd.testing.assert_frame_equal(got.sort_index(axis=1), expected.sort_index(axis=1).astype('int64'),
+                                  check_names=False, check_freq=False, check_index_type=False)
+
+
+def _edit(store, rnd, i):
+    eq = store.get(rnd.choice([e.imei for e in store]))
+    field = rnd.choice(['branch', 'status', 'condition', 'date'])
+    if field == 'date':
+        # в том числе месяцы вне построенного куба и устройства без даты
+        value = rnd.choice([f"{rnd.randrange(1990, 2031)}-{rnd.randrange(1, 13):02d}-01", ''])
+        value = datetime.strptime(value, '%Y-%m-%d') if value else None
+    else:
+        value = rnd.choice({'branch': BRANCHES + ('новый филиал',), 'status': STATUSES,
+                            'condition': CONDITIONS}[field])
+    store.update(eq, **{field: value})
+    if i % 7 == 0:
+        store.add(Equipment.from_dict(random_record(rnd)))
+
+
+@pytest.mark.parametrize('by', [None] + list(RollupCube.FIELDS))
+def test_series_match_groupby_after_edits(rnd, by):
+    records = [random_record(rnd) for _ in range(300)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    _check(store, by)
+    for i in range(200):
+        _edit(store, rnd, i)
+    _check(store, by)
+    _check(store, by, status='неисправен')
+    _check(store, by, branch='новый филиал', condition='ремонт')
+
+
+def test_condition_dynamics_window(rnd):
+    store = EquipmentStore([Equipment.from_dict(random_record(rnd)) for _ in range(300)])
+    today = date(2025, 6, 15)
+    frame = rtk_4.condition_dynamics(store, 'branch', 24, today=today, status='неисправен')
+    assert len(frame) == 24 and frame.index[0] == pd.Timestamp('2023-07-01') \
+        and frame.index[-1] == pd.Timestamp('2025-06-01')
+    expected = _expected(store, 'branch', status='неисправен').reindex(frame.index, fill_value=0)
+    expected = expected.loc[:, expected.sum() > 0]
+    pd.testing.assert_frame_equal(frame.sort_index(axis=1), expected.sort_index(axis=1).astype('int64'),
+                                  check_names=False, check_freq=False, check_index_type=False)
+
+
+def test_filter_by_value_without_dated_rows(rnd):
+    store = EquipmentStore([Equipment.from_dict(random_record(rnd)) for _ in range(20)])
+    store.rollup()
+    store.add(Equipment.from_dict(dict(random_record(rnd), branch='без даты', date='')))
+    frame = store.rollup().series('condition', branch='без даты')
+    assert frame.empty or not frame.to_numpy().any()
+    assert store.rollup().series(branch='без даты')['count'].sum() == 0
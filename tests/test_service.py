@@ -0,0 +1,68 @@
+import json
+import socket
+
+import pytest
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import ChangeJournal, Equipment, EquipmentService, EquipmentStore, PersistenceWorker
+
+
+@pytest.fixture
+def service(rnd, workdir):
+    records = [random_record(rnd) for _ in range(20)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    journal = ChangeJournal(str(workdir / 'equipment_data.journal'))
+    saver = PersistenceWorker(journal, debounce=0.01)
+    saver.start()
+    service = EquipmentService(store, saver, journal)
+    port = service.start_in_thread()
+    conn = socket.create_connection(('127.0.0.1', port), timeout=rtk_4.SERVICE_TIMEOUT)
+    stream = conn.makefile('rwb')
+    yield records, stream
+    conn.close()
+    service.stop()
+    saver.stop()
+
+
+def _ask(stream, payload):
+    stream.write(payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8') + b'\n')
+    stream.flush()
+    return json.loads(stream.readline())
+
+
+@pytest.mark.parametrize('request_', [
+    {'op': 'lookup', 'imei': 123},
+    {'op': 'lookup', 'imei': ['1']},
+    {'op': 'candidates', 'text': '12', 'limit': '5'},
+    {'op': 'add', 'record': {'imei': 1}},
+    {'op': 'add', 'record': 'x'},
+    {'op': 'edit', 'imei': '1', 'fields': {'status': None}},
+    {'op': 'aggregate', 'kind': 'rollup', 'filters': {'branch': 1}},
+    {'op': 'lookup'},
+    {'op': 'nope'},
+    [1, 2],
+])
+def test_bad_requests_get_error_and_connection_stays(service, request_):
+    records, stream = service
+    reply = _ask(stream, request_)
+    assert reply['ok'] is False and reply['error']
+    reply = _ask(stream, {'op': 'lookup', 'imei': records[0]['imei']})
+    assert reply['ok'] and reply['result'] == records[0]
+
+
+@pytest.mark.parametrize('payload', [b'garbage\n', b'\xff\xfe\n', b'{"op": "lookup", "imei": "1"'])
+def test_unreadable_lines_get_error(service, payload):
+    records, stream = service
+    if not payload.endswith(b'\n'):
+        payload += b'\n'
+    assert _ask(stream, payload)['ok'] is False
+    assert _ask(stream, {'op': 'lookup', 'imei': records[1]['imei']})['result'] == records[1]
+
+
+def test_line_over_limit_is_skipped_with_error(service):
+    records, stream = service
+    huge = json.dumps({'op': 'lookup', 'imei': '1' * (rtk_4.SERVICE_LINE_LIMIT * 2)}).encode('utf-8') + b'\n'
+    reply = _ask(stream, huge)
+    assert reply['ok'] is False and str(rtk_4.SERVICE_LINE_LIMIT) in reply['error']
+    assert _ask(stream, {'op': 'lookup', 'imei': records[2]['imei']})['result'] == records[2]
@@ -0,0 +1,136 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore
+
+
+def _store(records):
+    return EquipmentStore([Equipment.from_dict(rec) for rec in records])
+
+
+def _by_branch(records):
+    """Записи по филиалам в исходном порядке: его файлы филиалов и сохраняют."""
+    grouped = {}
+    for rec in records:
+        grouped.setdefault(rec['branch'], []).append(rec)
+    return grouped
+
+
+def _files(directory):
+    return {name: os.stat(os.path.join(directory, name)) for name in os.listdir(directory)
+            if name.endswith('.rtk')}
+
+
+@pytest.fixture
+def records(rnd):
+    records = [random_record(rnd) for _ in range(200)]
+    records[0]['imei'] = '000012345678'
+    return records
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_round_trip(records, workdir, workers):
+    # workers=2 - пул процессов spawn, как в окне на многоядерной машине
+    rtk_4.save_shards(_store(records), workers=workers)
+    store = EquipmentStore()
+    assert rtk_4.load_shards_into(store, workers=workers) == len(records)
+    loaded = [eq.to_dict() for eq in store]
+    assert _by_branch(loaded) == _by_branch(records)
+    assert store.get('000012345678').to_dict() == records[0]
+
+
+def test_unchanged_branches_are_not_rewritten(records, workdir):
+    store = _store(records)
+    assert rtk_4.save_shards(store, workers=1) == len(_by_branch(records))
+    before = _files(rtk_4.SHARDS_DIR)
+    assert rtk_4.save_shards(store, workers=1) == 0
+    assert _files(rtk_4.SHARDS_DIR) == before
+
+    changed = records[5]
+    store.update(store.get(changed['imei']), condition='ремонт' if changed['condition'] != 'ремонт' else 'склад')
+    assert rtk_4.save_shards(store, workers=1) == 1
+    after = _files(rtk_4.SHARDS_DIR)
+    manifest = rtk_4.read_shard_manifest()
+    assert set(after) == {s['file'] for s in manifest['shards'].values()}
+    rewritten = manifest['shards'][changed['branch']]['file']
+    assert rewritten not in before
+    assert {name: st.st_mtime_ns for name, st in after.items() if name != rewritten} == \
+           {name: st.st_mtime_ns for name, st in before.items() if name in after}
+
+
+def test_corrupt_shard_falls_back_to_json(records, workdir, monkeypatch):
+    monkeypatch.setattr(rtk_4, 'STORAGE_BACKEND', 'shards')
+    rtk_4.save_shards(_store(records), workers=1)
+    rtk_4.write_json(_store(records[:10]))
+    # файл филиала подменен: контрольная сумма в manifest с ним не сходится
+    manifest = rtk_4.read_shard_manifest()
+    entry = manifest['shards'][records[0]['branch']]
+    entry['digest'] = '0' * len(entry['digest'])
+    with open(os.path.join(rtk_4.SHARDS_DIR, rtk_4.SHARD_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        rtk_4.read_shards(workers=1)
+    assert [eq.to_dict() for eq in rtk_4.load_store()] == records[:10]
+
+
+class _Master:
+    """Вместо Tk: after() только запоминает вызов, тест выполняет их сам."""
+
+    def __init__(self):
+        self.calls = []
+
+    def after(self, ms, func):
+        self.calls.append(func)
+
+
+def _app():
+    app = rtk_4.App.__new__(rtk_4.App)
+    app.master = _Master()
+    app.store = EquipmentStore()
+    app.journal = rtk_4.ChangeJournal()
+    app.saver = SimpleNamespace(flush=lambda: None)
+    app.status_label = SimpleNamespace(config=lambda **kw: None)
+    app.backend = app.remote = app._load_job = app._bulk_job = None
+    return app
+
+
+def _pump(app, timeout=30):
+    deadline = time.monotonic() + timeout
+    while app._load_job is not None:
+        assert time.monotonic() < deadline
+        if app.master.calls:
+            app.master.calls.pop(0)()
+        else:
+            time.sleep(0.01)
+
+
+def test_app_reads_shards_in_background(records, workdir, monkeypatch):
+    monkeypatch.setattr(rtk_4, 'STORAGE_BACKEND', 'shards')
+    rtk_4.save_shards(_store(records), workers=1)
+    edited = dict(records[3], status='неисправен', condition='ремонт')
+    rtk_4.ChangeJournal().append(Equipment.from_dict(edited))
+    app = _app()
+    app._load_snapshot(show_msg=False)
+    # окно не ждет чтения: управление вернулось, данные примет очередной тик
+    assert app._load_job['pending'] is not None and len(app.store) == 0
+    _pump(app)
+    assert len(app.store) == len(records)
+    assert app.store.get(edited['imei']).to_dict() == edited
+
+
+def test_app_falls_back_to_json_when_shards_fail(records, workdir, monkeypatch):
+    monkeypatch.setattr(rtk_4, 'STORAGE_BACKEND', 'shards')
+    rtk_4.save_shards(_store(records), workers=1)
+    rtk_4.write_json(_store(records[:10]))
+    os.remove(os.path.join(rtk_4.SHARDS_DIR, sorted(_files(rtk_4.SHARDS_DIR))[0]))
+    app = _app()
+    app._request_compact = lambda: None   # перенос JSON в файлы филиалов здесь не проверяется
+    app._load_snapshot(show_msg=False)
+    _pump(app)
+    assert [eq.to_dict() for eq in app.store] == records[:10]
@@ -0,0 +1,92 @@
+import os
+import struct
+
+import pytest
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore, SnapshotFile
+
+# IMEI, которые не помещаются в число фиксированной ширины или теряют вид при переводе в число
+ODD_IMEIS = ['', '0', '000123456789012', '1' * 18, '9' * 19, '12345678901234567890123', '١٢٣٤٥', '０１２']
+
+
+def _store(records):
+    return EquipmentStore([Equipment.from_dict(rec) for rec in records])
+
+
+@pytest.fixture
+def records(rnd):
+    return [random_record(rnd, imei=imei) for imei in ODD_IMEIS] + [random_record(rnd) for _ in range(50)]
+
+
+@pytest.fixture
+def files(records, workdir, monkeypatch):
+    """JSON и более свежий снимок с разными данными: видно, откуда прочитана база."""
+    monkeypatch.setattr(rtk_4, 'STORAGE_BACKEND', 'files')
+    rtk_4.write_json(_store(records[:5]))
+    rtk_4.write_snapshot(_store(records))
+    os.utime(rtk_4.SNAPSHOT_FILE, (os.path.getmtime('equipment_data.json') + 1,) * 2)
+    with open(rtk_4.SNAPSHOT_FILE, 'rb') as f:
+        return f.read()
+
+
+def _loaded():
+    return [eq.to_dict() for eq in rtk_4.load_store()]
+
+
+def test_round_trip(records, workdir):
+    store = _store(records)
+    store.sort_by(['date'], descending=True)
+    rtk_4.write_snapshot(store)
+    loaded = EquipmentStore()
+    assert rtk_4.load_snapshot_into(loaded) == len(records)
+    assert [eq.to_dict() for eq in loaded] == [eq.to_dict() for eq in store]
+    with SnapshotFile() as snap:
+        assert [tuple(row) for row in snap.iter_tuples()] == [eq.to_tuple() for eq in store]
+        for rec in records:
+            assert snap.get(rec['imei']).to_dict() == rec
+            assert loaded.get(rec['imei']).to_dict() == rec
+        assert snap.get('404') is None
+
+
+def test_fresh_snapshot_is_preferred(records, files):
+    assert _loaded() == records
+
+
+def test_unknown_version_falls_back_to_json(records, files):
+    with open(rtk_4.SNAPSHOT_FILE, 'r+b') as f:
+        f.seek(len(rtk_4.SNAPSHOT_MAGIC))
+        f.write(struct.pack('<I', rtk_4.SNAPSHOT_VERSION + 1))
+    with pytest.raises(ValueError, match='версия'):
+        SnapshotFile()
+    assert _loaded() == records[:5]
+
+
+@pytest.mark.parametrize('keep', [0, 20, 0.3, 0.9, -1])
+def test_truncated_file_falls_back_to_json(records, files, keep):
+    size = len(files) + keep if keep < 0 else int(len(files) * keep) if isinstance(keep, float) else keep
+    with open(rtk_4.SNAPSHOT_FILE, 'wb') as f:
+        f.write(files[:size])
+    with pytest.raises(ValueError):
+        rtk_4.load_snapshot_into(EquipmentStore())
+    assert _loaded() == records[:5]
+
+
+def test_corrupt_file_falls_back_to_json(records, files):
+    # порча байта в середине данных: заголовок и границы секций целы, не сходится CRC32
+    data = bytearray(files)
+    data[len(data) // 2] ^= 0xFF
+    with open(rtk_4.SNAPSHOT_FILE, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError, match='контрольная сумма'):
+        rtk_4.load_snapshot_into(EquipmentStore())
+    assert _loaded() == records[:5]
+
+
+def test_convert_command(records, workdir, write_csv):
+    write_csv(workdir / 'dump.csv', records)
+    assert rtk_4.cli_main(['convert', 'dump.csv', 'dump.rtk']) == 0
+    assert rtk_4.cli_main(['convert', 'dump.rtk', 'back.json']) == 0
+    assert [eq.to_dict() for chunk in rtk_4.iter_json('back.json') for eq in chunk] == records
+    assert rtk_4.cli_main(['convert', 'dump.csv', 'back.json']) == 2
@@ -0,0 +1,90 @@
+import itertools
+
+import pytest
+from conftest import BRANCHES, CONDITIONS, STATUSES, random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore, SortedView
+
+FIELD_SETS = [('date',), ('branch',), ('condition', 'date'), ('branch', 'brand', 'date'), ('status', 'location')]
+
+
+def _expected(store, fields):
+    """Номера строк по sorted(): ключ - значения полей, при равенстве - номер строки."""
+    def key(row):
+        rec = store.row(row)
+        return tuple(rtk_4.parse_date_ordinal(rec.to_dict()['date']) if f == 'date' else getattr(rec, f)
+                     for f in fields) + (row,)
+    return sorted(range(len(store)), key=key)
+
+
+def _edit(store, rnd, imeis):
+    eq = store.get(rnd.choice(imeis))
+    field = rnd.choice(['branch', 'status', 'condition', 'date', 'location'])
+    value = {
+        'branch': lambda: rnd.choice(BRANCHES + ('анадырь', 'якутск')),
+        'status': lambda: rnd.choice(STATUSES),
+        'condition': lambda: rnd.choice(CONDITIONS),
+        'date': lambda: rtk_4.ordinal_to_datetime(rnd.choice([0, 730120, 730120, 738000])),
+        'location': lambda: rnd.choice(('склад', 'тс')),
+    }[field]()
+    store.update(eq, **{field: value})
+
+
+@pytest.fixture
+def store(rnd):
+    return EquipmentStore([Equipment.from_dict(random_record(rnd)) for _ in range(250)])
+
+
+@pytest.mark.parametrize('fields', FIELD_SETS)
+def test_view_matches_sorted_after_edits(store, rnd, fields):
+    view = store.sorted_view(*fields)
+    assert list(view.rows) == _expected(store, fields)
+    imeis = [eq.imei for eq in store]
+    for i in range(400):
+        _edit(store, rnd, imeis)
+        if i % 10 == 0:
+            rec = random_record(rnd)
+            store.add(Equipment.from_dict(rec))
+            imeis.append(rec['imei'])
+    # представление поддерживалось правками, а не построено заново
+    assert store.sorted_view(*fields) is view
+    assert list(view.rows) == _expected(store, fields)
+    assert list(SortedView(store._table, fields).rows) == list(view.rows)
+
+
+def test_pages_ascending_and_descending(store):
+    view = store.sorted_view('branch', 'date')
+    expected = _expected(store, ('branch', 'date'))
+    for descending, order in ((False, expected), (True, expected[::-1])):
+        pages = [view.row_numbers(offset, 30, descending) for offset in range(0, len(store), 30)]
+        assert list(itertools.chain(*pages)) == order
+        assert view.row_numbers(len(store) - 5, 30, descending) == order[-5:]
+        assert view.row_numbers(len(store), 30, descending) == []
+        assert [eq.imei for eq in view.top(7, descending)] == [store.row(r).imei for r in order[:7]]
+    assert view.row_numbers(-10, 5) == expected[:5]
+
+
+def test_sort_by_reorders_traversal(store, rnd):
+    before = [eq.imei for eq in store]
+    version = store.version
+    store.sort_by(['condition', 'date'], descending=True)
+    assert store.version > version
+    assert [store._row_of_imei(eq.imei) for eq in store] == _expected(store, ('condition', 'date'))[::-1]
+    assert sorted(eq.imei for eq in store) == sorted(before)
+    # после сортировки новые записи идут в конец обхода
+    rec = random_record(rnd)
+    store.add(Equipment.from_dict(rec))
+    assert [eq.imei for eq in store][-1] == rec['imei']
+    version = store.version
+    store.sort_by('imei')
+    assert store.version == version
+
+
+def test_unknown_fields_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.sorted_view('imei')
+    with pytest.raises(ValueError):
+        SortedView(store._table, ())
+    empty = EquipmentStore()
+    assert empty.sorted_view('date').row_numbers(0, 10) == []
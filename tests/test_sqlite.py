@@ -0,0 +1,106 @@
+import os
+
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore, PersistenceWorker, SqliteBackend
+
+
+def _rows(backend):
+    return {row[1]: dict(zip(rtk_4.EQUIPMENT_FIELDS, row)) for row in backend.iter_tuples()}
+
+
+def _store_rows(store):
+    return {eq.imei: eq.to_dict() for eq in store}
+
+
+def test_bulk_import_appends_rows_without_rewriting_table(rnd, workdir, write_csv):
+    base = [random_record(rnd) for _ in range(5)]
+    backend = SqliteBackend(str(workdir / 'equipment.db'))
+    backend.replace_all(Equipment.from_dict(rec) for rec in base)
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in base])
+    # строка, которой нет в памяти, но есть в базе, не должна быть перезаписана импортом
+    only_in_db = random_record(rnd)
+    backend.upsert_records([only_in_db])
+    rowids = dict(backend._conn().execute("SELECT imei, rowid FROM equipment").fetchall())
+    imported = [random_record(rnd) for _ in range(4)] + [dict(only_in_db, status='неисправен')]
+    write_csv(workdir / 'import.csv', imported)
+    report = rtk_4.bulk_import_csv(str(workdir / 'import.csv'), store, backend=backend)
+    assert report.accepted == 4
+    assert dict(zip(report.rejected()['imei'], report.rejected()['reason'])) == \
+        {only_in_db['imei']: "Этот IMEI уже существует в базе."}
+    rows = _rows(backend)
+    assert len(rows) == 10
+    assert rows[only_in_db['imei']] == only_in_db
+    for rec in imported[:4]:
+        assert rows[rec['imei']] == rec
+    # в памяти - то же, что в базе: для уже бывшего там IMEI взята строка базы
+    assert _store_rows(store) == rows
+    assert dict(backend._conn().execute("SELECT imei, rowid FROM equipment").fetchall()).items() >= rowids.items()
+    backend.close()
+
+
+def test_worker_writes_imports_then_edits(rnd, workdir, write_csv):
+    backend = SqliteBackend(str(workdir / 'equipment.db'))
+    store = EquipmentStore()
+    journal = rtk_4.ChangeJournal(str(workdir / 'equipment_data.journal'))
+    worker = PersistenceWorker(journal, backend=backend, debounce=5)
+    worker.start()
+    records = [random_record(rnd) for _ in range(6)]
+    write_csv(workdir / 'import.csv', records)
+    report = rtk_4.ImportReport(str(workdir / 'import.csv'))
+    for accepted in rtk_4.bulk_validate_csv(str(workdir / 'import.csv'), [], report):
+        worker.submit_import(rtk_4.apply_accepted(store, accepted, report))
+    eq = store.get(records[2]['imei'])
+    store.update(eq, condition='ремонт')
+    worker.submit_change(eq)
+    worker.flush()
+    worker.stop()
+    rows = _rows(backend)
+    assert len(rows) == 6
+    assert rows[records[2]['imei']]['condition'] == 'ремонт'
+    # с базой журнал не ведется
+    assert not os.path.exists(journal.filename)
+
+
+def test_worker_reports_rows_already_in_db(rnd, workdir, write_csv):
+    backend = SqliteBackend(str(workdir / 'equipment.db'))
+    only_in_db = random_record(rnd)
+    backend.upsert_records([only_in_db])
+    store = EquipmentStore()
+    worker = PersistenceWorker(rtk_4.ChangeJournal(str(workdir / 'equipment_data.journal')),
+                               backend=backend, debounce=5)
+    worker.start()
+    records = [random_record(rnd) for _ in range(3)] + [dict(only_in_db, condition='ремонт')]
+    write_csv(workdir / 'import.csv', records)
+    report = rtk_4.ImportReport(str(workdir / 'import.csv'))
+    for accepted in rtk_4.bulk_validate_csv(str(workdir / 'import.csv'), [], report):
+        worker.submit_import(rtk_4.apply_accepted(store, accepted, report))
+    # правка той же пачки: окно не должно откатить ее строкой базы, прочитанной до правки
+    eq = store.get(only_in_db['imei'])
+    store.update(eq, location='тс' if eq.location != 'тс' else 'склад')
+    worker.submit_change(eq)
+    worker.flush()
+    worker.stop()
+    results = []
+    while not worker.results.empty():
+        results.append(worker.results.get())
+    assert all(ok for _, ok, _ in results)
+    (added, rows), = [message for kind, _, message in results if kind == 'import_existing']
+    rtk_4.restore_existing(store, added, rows, report)
+    assert report.accepted == 3 and report.rejected_count == 1
+    assert _store_rows(store) == _rows(backend)
+
+
+def test_compact_resets_journal_left_from_files(rnd, workdir):
+    records = [random_record(rnd) for _ in range(3)]
+    journal = rtk_4.ChangeJournal(str(workdir / 'equipment_data.journal'))
+    journal.append(Equipment.from_dict(records[0]))
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    backend = SqliteBackend(str(workdir / 'equipment.db'))
+    worker = PersistenceWorker(journal, backend=backend)
+    worker.start()
+    worker.submit_compact(store)
+    worker.stop()
+    assert list(_rows(backend).values()) == records
+    assert os.path.getsize(journal.filename) == 0
@@ -0,0 +1,93 @@
+from collections import Counter
+
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore
+
+
+def _check(store, model):
+    """Индексы и счетчики хранилища против простого словаря IMEI -> запись."""
+    assert len(store) == len(model)
+    for imei, rec in model.items():
+        assert imei in store
+        assert store.get(imei).to_dict() == rec
+        assert store.find(imei, rec['branch']).imei == imei
+    assert {eq.imei: eq.to_dict() for eq in store} == model
+    for field in EquipmentStore.INDEXED_FIELDS:
+        assert store.count_by(field) == Counter(rec[field] for rec in model.values())
+        for value in set(rec[field] for rec in model.values()):
+            assert sorted(eq.imei for eq in store.filter_by(field, value)) == \
+                sorted(imei for imei, rec in model.items() if rec[field] == value)
+    assert store.defective_counts() == Counter(
+        rec['branch'] for rec in model.values() if 'неисправен' in rec['status'])
+    assert store.brand_condition_counts() == Counter(
+        (rec['brand'], rec['condition']) for rec in model.values() if rec['date'] >= '2000-01-01')
+
+
+def test_random_adds_and_updates_keep_indexes_consistent(rnd):
+    store, model = EquipmentStore(), {}
+    for _ in range(300):
+        rec = random_record(rnd)
+        assert store.add(Equipment.from_dict(rec)) == (rec['imei'] not in model)
+        model.setdefault(rec['imei'], rec)
+    # индексы строятся лениво - часть проверок до правок, часть после
+    store.filter_by('branch', 'омск')
+    store.sort_by('date')
+    imeis = list(model)
+    for step in range(600):
+        imei = rnd.choice(imeis)
+        if step % 5 == 0:
+            # повторное добавление того же IMEI отклоняется
+            dup = random_record(rnd, imei)
+            assert not store.add(Equipment.from_dict(dup))
+            continue
+        if step % 7 == 0:
+            rec = random_record(rnd, imei)
+            store.upsert(Equipment.from_dict(rec))
+            model[imei] = rec
+            continue
+        changes = {f: random_record(rnd)[f] for f in rnd.sample(('status', 'condition', 'location', 'branch'), 2)}
+        store.update(store.get(imei), **changes)
+        model[imei].update(changes)
+    _check(store, model)
+    # SortedView поддерживался при правках: повторная сортировка берет его без пересчета
+    store.sort_by('date')
+    assert [eq.imei for eq in store] == [imei for imei, _ in sorted(
+        model.items(), key=lambda item: (rtk_4.parse_date_ordinal(item[1]['date']), store._row_of_imei(item[0])))]
+
+
+def test_replace_all_drops_removed_records(rnd):
+    records = [random_record(rnd) for _ in range(200)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    store.filter_by('brand', 'галилео')
+    kept = records[::3]
+    assert store.replace_all(Equipment.from_dict(rec) for rec in kept) == 0
+    model = {rec['imei']: rec for rec in kept}
+    _check(store, model)
+    for rec in records:
+        if rec['imei'] not in model:
+            assert rec['imei'] not in store
+            assert store.get(rec['imei']) is None
+
+
+def test_imei_change_is_rejected(rnd):
+    rec = random_record(rnd)
+    store = EquipmentStore([Equipment.from_dict(rec)])
+    try:
+        store.update(store.get(rec['imei']), imei='123')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("IMEI изменен")
+    assert store.get(rec['imei']).to_dict() == rec
+
+
+def test_frozen_copy_is_independent(rnd):
+    records = [random_record(rnd) for _ in range(100)]
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records])
+    before = {eq.imei: eq.to_dict() for eq in store}
+    copy = store.frozen_copy()
+    store.update(store.get(records[0]['imei']), status='неисправен', condition='ремонт')
+    store.add(Equipment.from_dict(random_record(rnd)))
+    _check(copy, before)
@@ -0,0 +1,125 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+from conftest import random_record
+
+import rtk_4
+from rtk_4 import Equipment, EquipmentStore
+
+TODAY = date(2025, 6, 1)
+
+
+def _store(rnd):
+    records = [random_record(rnd) for _ in range(400)]
+    # часть гарантий истекает в ближайший месяц
+    for rec in records[::5]:
+        ends = TODAY + timedelta(days=rnd.randrange(1, 31))
+        rec['date'] = (ends - timedelta(days=rtk_4.WARRANTY_DAYS)).isoformat()
+    return EquipmentStore([Equipment.from_dict(rec) for rec in records]), {rec['imei']: rec for rec in records}
+
+
+def _expected(model, within_days):
+    today = TODAY.toordinal()
+    out = set()
+    for imei, rec in model.items():
+        left = date.fromisoformat(rec['date']).toordinal() + rtk_4.WARRANTY_DAYS - today
+        if 0 < left <= within_days:
+            out.add(('expiring', imei, left))
+        elif left <= 0 and rec['condition'] == 'установлен':
+            out.add(('expired', imei, left))
+    return out
+
+
+@pytest.mark.parametrize('sort', [None, 'date', 'condition'])
+def test_report_rows_match_devices_in_any_traversal_order(rnd, sort):
+    store, model = _store(rnd)
+    if sort:
+        store.sort_by(sort)
+    summary, devices = rtk_4.warranty_report(store, 30, TODAY.toordinal())
+    got = set()
+    for row in devices.to_dict('records'):
+        rec = model[row['imei']]
+        assert {k: row[k] for k in rtk_4.EQUIPMENT_FIELDS} == rec
+        expires = date.fromisoformat(rec['date']) + timedelta(days=rtk_4.WARRANTY_DAYS)
+        assert row['expires'] == expires.isoformat()
+        got.add(('expiring' if row['group'].startswith('истекает') else 'expired', row['imei'], row['days_left']))
+    assert got == _expected(model, 30)
+    assert summary['истекает'].sum() == sum(1 for g, _, _ in got if g == 'expiring')
+
+
+# дней до конца гарантии -> дата установки; None - дата неизвестна
+EDGES = {'expired_long_ago': -400, 'expired_yesterday': -1, 'expires_today': 0, 'tomorrow': 1,
+         'window_edge': 30, 'after_window': 31, 'fresh': rtk_4.WARRANTY_DAYS, 'no_date': None}
+
+
+@pytest.fixture
+def edges(rnd):
+    records = {}
+    for name, left in EDGES.items():
+        installed = '' if left is None else \
+            (TODAY + timedelta(days=left - rtk_4.WARRANTY_DAYS)).isoformat()
+        records[name] = random_record(rnd, imei=str(10 ** 14 + len(records)))
+        records[name].update(date=installed, condition='установлен', branch='москва')
+    records['expired_removed'] = dict(records['expired_yesterday'], imei='1' * 15, condition='демонтирован')
+    store = EquipmentStore([Equipment.from_dict(rec) for rec in records.values()])
+    return store, {rec['imei']: name for name, rec in records.items()}
+
+
+def _names(store, names, rows):
+    return sorted(names[store.row(row).imei] for row in rows)
+
+
+def test_window_boundaries(edges):
+    store, names = edges
+    index = store.warranty()
+    today = TODAY.toordinal()
+    # истекает сегодня - уже завершена; последний день окна входит, следующий - нет
+    assert _names(store, names, index.expiring(30, today)) == ['tomorrow', 'window_edge']
+    assert _names(store, names, index.expiring(31, today)) == ['after_window', 'tomorrow', 'window_edge']
+    assert _names(store, names, index.expiring(1, today)) == ['tomorrow']
+    assert list(index.expiring(0, today)) == []
+    assert _names(store, names, index.expired(today)) == \
+        ['expired_long_ago', 'expired_removed', 'expired_yesterday', 'expires_today']
+    assert _names(store, names, index.expired(today, condition='установлен')) == \
+        ['expired_long_ago', 'expired_yesterday', 'expires_today']
+    assert _names(store, names, index.active(today)) == ['after_window', 'fresh', 'tomorrow', 'window_edge']
+    with pytest.raises(ValueError):
+        index.expired(today, imei='1')
+
+
+def test_status_and_days_left_agree(edges):
+    store, names = edges
+    index = store.warranty()
+    today = TODAY.toordinal()
+    left = index.days_left(today)
+    for row in range(len(store)):
+        eq = store.row(row)
+        expected = EDGES.get(names[eq.imei], -1)   # expired_removed - копия expired_yesterday
+        ordinal = rtk_4.parse_date_ordinal(eq.to_dict()['date'])
+        status = rtk_4.warranty_status(ordinal, today)
+        if expected is None:
+            assert np.isnan(left[row]) and status == "Дата неизвестна."
+        else:
+            assert left[row] == expected
+            assert status == ("Гарантия завершена." if expected <= 0 else "На гарантии.")
+
+
+def test_summary_and_report_at_edges(edges):
+    store, names = edges
+    summary, devices = rtk_4.warranty_report(store, 30, TODAY.toordinal())
+    assert summary.loc['москва'].to_dict() == {
+        'на гарантии': 4, 'истекает': 2, 'завершена': 4, 'завершена, установлено': 3, 'дата неизвестна': 1}
+    assert list(summary.index) == ['москва']
+    rows = {names[imei]: left for imei, left in zip(devices['imei'], devices['days_left'])}
+    assert rows == {'tomorrow': 1, 'window_edge': 30, 'expires_today': 0,
+                    'expired_yesterday': -1, 'expired_long_ago': -400}
+    expires = dict(zip(devices['imei'], devices['expires']))
+    edge = next(imei for imei, name in names.items() if name == 'expires_today')
+    assert expires[edge] == TODAY.isoformat()
+
+
+def test_store_without_dates(rnd):
+    store = EquipmentStore([Equipment.from_dict(dict(random_record(rnd), date='')) for _ in range(3)])
+    summary, devices = rtk_4.warranty_report(store, 30, TODAY.toordinal())
+    assert devices.empty and summary['дата неизвестна'].sum() == 3 and summary['завершена'].sum() == 0